@@ -1,13 +1,38 @@
 #!/usr/bin/env python3
+import json
 import os
 
 import aws_cdk as cdk
 
+from wttr_in_data.sizing import DEFAULT_WORKLOAD
 from wttr_in_data.wttr_in_data_stack import WttrInDataStack
 
 
 app = cdk.App()
+
+# Declared workload the resources are sized for, e.g.
+# cdk deploy -c workload='{"locations": 20, "fetch_interval_minutes": 30, "retention_days": 730}'
+workload = app.node.try_get_context('workload') or {}
+if isinstance(workload, str):
+    workload = json.loads(workload)
+
+# Fetch locations when they are due a new observation rather than every
+# fetch interval, e.g. cdk deploy -c adaptive_polling=true
+adaptive_polling = str(app.node.try_get_context('adaptive_polling')).lower() == 'true'
+
+# Flatten raw objects into the curated table as they land, e.g.
+# cdk deploy -c near_real_time=true --parameters ArrowLayerArn=...
+near_real_time = str(app.node.try_get_context('near_real_time')).lower() == 'true'
+
+# Split the nightly ETL into concurrent runs by areaName, e.g.
+# cdk deploy -c etl_shards=4
+etl_shards = int(app.node.try_get_context('etl_shards') or 1)
+
 WttrInDataStack(app, "WttrInDataStack",
+    workload=DEFAULT_WORKLOAD._replace(**workload),
+    adaptive_polling=adaptive_polling,
+    near_real_time=near_real_time,
+    etl_shards=etl_shards,
     # If you don't specify 'env', this stack will be environment-agnostic.
     # Account/Region-dependent features and context lookups will not work,
     # but a single synthesized template can be deployed anywhere.
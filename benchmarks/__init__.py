@@ -0,0 +1,11 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The lambda and glue directories are deployed as flat assets, so add them to
+# the import path the same way the runtimes see them
+for asset_dir in ('lambda', 'glue'):
+    path = os.path.join(ROOT_DIR, asset_dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
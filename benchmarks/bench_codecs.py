@@ -0,0 +1,44 @@
+import json
+
+import raw_codec
+from benchmarks.bench_transform import measure
+
+
+def available_codecs():
+    codecs = []
+    for name in raw_codec.CODECS:
+        try:
+            raw_codec.get_codec(name)
+        except ValueError:
+            continue
+        codecs.append(name)
+
+    return codecs
+
+
+def bench_codecs(payloads, repeat=3):
+    # Stored size and encode/decode time of the raw payloads for each codec
+    raw_objects = [json.dumps(payload, indent=4).encode('utf-8') for payload in payloads]
+    raw_bytes = sum(len(raw_object) for raw_object in raw_objects)
+
+    results = {}
+    for name in available_codecs():
+        encoded = [raw_codec.encode(raw_object, name) for raw_object in raw_objects]
+        stored_bytes = sum(len(encoded_object) for encoded_object in encoded)
+
+        encode_seconds, _ = measure(
+            lambda: [raw_codec.encode(raw_object, name) for raw_object in raw_objects], repeat=repeat)
+        decode_seconds, _ = measure(
+            lambda: [raw_codec.decode(encoded_object) for encoded_object in encoded], repeat=repeat)
+
+        results[name] = {
+            'objects': len(raw_objects),
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+            'ratio': raw_bytes / stored_bytes if stored_bytes else None,
+            'encode_seconds': encode_seconds,
+            'decode_seconds': decode_seconds,
+            'decode_mb_per_second': raw_bytes / decode_seconds / 1e6 if decode_seconds else None,
+        }
+
+    return results
@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.generate_payloads import generate_payloads
+from benchmarks.local_services import s3_service, wttr_in_service
+
+BUCKET = 'benchmark-ingest-bucket'
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda')
+
+# Runs in a fresh interpreter, like a new Lambda container: times the import
+# of the handler module (the init phase) and then each invocation, the first
+# one paying for any lazily created clients and connections
+CONTAINER_SCRIPT = '''
+import contextlib, json, os, sys, time
+
+started = time.perf_counter()
+import get_data
+import_seconds = time.perf_counter() - started
+
+timings = []
+with open(os.devnull, 'w') as devnull:
+    for invocation in range(int(sys.argv[1])):
+        event = {'time': f'2022-06-23T{invocation % 24:02d}:00:00Z'}
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(devnull):
+            response = get_data.handler(event, None)
+        timings.append(time.perf_counter() - started)
+        if response['statusCode'] != 200:
+            raise RuntimeError(response['body'])
+
+with open(sys.argv[2], 'w') as result:
+    json.dump({'import_seconds': import_seconds, 'invocation_seconds': timings}, result)
+'''
+
+
+def handler_imports(importtime_lines, module='get_data'):
+    # Cumulative import time in ms of each module imported by the handler
+    # module, from the -X importtime output
+    imports = {}
+    children = {}
+    for line in importtime_lines:
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 1:
+            children[name] = int(cumulative) / 1000
+        elif depth == 0:
+            if name == module:
+                imports = children
+            children = {}
+
+    return dict(sorted(imports.items(), key=lambda item: -item[1]))
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def run_container(env, invocations, lambda_dir):
+    with tempfile.NamedTemporaryFile(suffix='.json') as result:
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CONTAINER_SCRIPT, str(invocations), result.name],
+            env=dict(env, PYTHONPATH=lambda_dir), stderr=subprocess.PIPE, universal_newlines=True, check=False)
+        if process.returncode != 0:
+            raise RuntimeError(f'Container failed: {process.stderr[-2000:]}')
+        with open(result.name) as result_file:
+            report = json.load(result_file)
+
+    report['imports_ms'] = handler_imports(process.stderr.splitlines())
+    return report
+
+
+def bench_cold_start(payloads_by_location, cold_starts=5, invocations=10, lambda_dir=LAMBDA_DIR):
+    # Cold start: import plus first invocation of a new container. Warm
+    # invocations are the following ones of the same container.
+    bodies = {location: json.dumps(payload, indent=4).encode('utf-8')
+              for location, payload in payloads_by_location.items()}
+    objects = {}
+
+    with wttr_in_service(bodies) as wttr_in, s3_service(objects) as s3:
+        env = dict(os.environ, **{
+            'INGEST_BUCKET': BUCKET,
+            'RAW_DATA_PATH': 'weather_data_raw',
+            'LOCATION_QUERY_STRING': ';'.join(bodies),
+            'DEDUP_MODE': 'off',
+            'WTTR_IN_URL': wttr_in.url,
+            'AWS_ENDPOINT_URL_S3': s3.url,
+            'AWS_ACCESS_KEY_ID': 'benchmark',
+            'AWS_SECRET_ACCESS_KEY': 'benchmark',
+            'AWS_DEFAULT_REGION': 'us-east-1',
+        })
+        containers = [run_container(env, invocations, lambda_dir) for _ in range(cold_starts)]
+
+    imports = [container['import_seconds'] for container in containers]
+    first = [container['invocation_seconds'][0] for container in containers]
+    warm = [seconds for container in containers for seconds in container['invocation_seconds'][1:]]
+
+    return {
+        'locations': len(bodies),
+        'cold_starts': cold_starts,
+        'invocations_per_container': invocations,
+        'median_import_seconds': statistics.median(imports),
+        'median_first_invocation_seconds': statistics.median(first),
+        'median_cold_start_seconds': statistics.median(
+            [imported + invoked for imported, invoked in zip(imports, first)]),
+        'median_warm_invocation_seconds': statistics.median(warm) if warm else None,
+        'p95_warm_invocation_seconds': percentile(warm, 0.95) if warm else None,
+        'imports_ms': containers[-1]['imports_ms'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure cold and warm starts of the ingest function')
+    parser.add_argument('--locations', type=int, default=5)
+    parser.add_argument('--cold-starts', type=int, default=5)
+    parser.add_argument('--invocations', type=int, default=10)
+    parser.add_argument('--lambda-dir', default=LAMBDA_DIR,
+                        help='Function code to measure, e.g. the lambda directory of another checkout')
+    args = parser.parse_args(argv)
+
+    payloads = {location: payload for location, _, payload in generate_payloads(args.locations, 1)}
+    json.dump(bench_cold_start(payloads, args.cold_starts, args.invocations, args.lambda_dir),
+              sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
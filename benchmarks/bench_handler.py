@@ -0,0 +1,85 @@
+import contextlib
+import importlib
+import io
+import json
+import os
+import time
+
+from benchmarks.local_services import s3_service, wttr_in_service
+
+BUCKET = 'benchmark-ingest-bucket'
+
+
+def bench_handler(payloads_by_location, invocations=3, max_concurrency=8, dedup_mode='off'):
+    # Times get_data.handler end to end against local wttr.in and S3 stand-ins.
+    # The payloads do not change between invocations, so with deduplication
+    # enabled only the first invocation uploads them.
+    bodies = {location: json.dumps(payload, indent=4).encode('utf-8')
+              for location, payload in payloads_by_location.items()}
+    objects = {}
+
+    with wttr_in_service(bodies) as wttr_in, s3_service(objects) as s3:
+        os.environ.update({
+            'INGEST_BUCKET': BUCKET,
+            'RAW_DATA_PATH': 'weather_data_raw',
+            'LOCATION_QUERY_STRING': ';'.join(bodies),
+            'MAX_CONCURRENCY': str(max_concurrency),
+            'DEDUP_MODE': dedup_mode,
+            'WTTR_IN_URL': wttr_in.url,
+            'AWS_ENDPOINT_URL_S3': s3.url,
+            'AWS_ACCESS_KEY_ID': 'benchmark',
+            'AWS_SECRET_ACCESS_KEY': 'benchmark',
+            'AWS_DEFAULT_REGION': 'us-east-1',
+        })
+
+        started = time.perf_counter()
+        import get_data
+        get_data = importlib.reload(get_data)
+        import_seconds = time.perf_counter() - started
+
+        # The handler's metric lines are captured rather than printed, and
+        # summarised per phase
+        metric_lines = io.StringIO()
+        timings = []
+        for invocation in range(invocations):
+            event = {'time': f'2022-06-23T{invocation % 24:02d}:00:00Z'}
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(metric_lines):
+                response = get_data.handler(event, None)
+            timings.append(time.perf_counter() - started)
+
+            if response['statusCode'] != 200:
+                raise RuntimeError(f'Handler failed: {response["body"]}')
+
+    raw_objects = [body for (_, key), body in objects.items() if key.startswith('weather_data_raw/')]
+
+    return {
+        'locations': len(bodies),
+        'invocations': invocations,
+        'max_concurrency': max_concurrency,
+        'dedup_mode': dedup_mode,
+        'import_seconds': import_seconds,
+        'first_invocation_seconds': timings[0],
+        'mean_invocation_seconds': sum(timings) / len(timings),
+        'mean_seconds_per_location': sum(timings) / len(timings) / len(bodies),
+        'uploaded_objects': len(raw_objects),
+        'uploaded_bytes': sum(len(body) for body in raw_objects),
+        'phases': summarise_phases(metric_lines.getvalue().splitlines()),
+    }
+
+
+def summarise_phases(lines):
+    # Total and mean duration of each phase from the EMF lines
+    phases = {}
+    for line in lines:
+        document = json.loads(line)
+        if 'Phase' not in document:
+            continue
+        summary = phases.setdefault(document['Phase'], {'count': 0, 'total_ms': 0.0})
+        summary['count'] += 1
+        summary['total_ms'] += document['DurationMs']
+
+    for summary in phases.values():
+        summary['mean_ms'] = summary['total_ms'] / summary['count']
+
+    return phases
@@ -0,0 +1,46 @@
+import json
+import time
+import tracemalloc
+
+import arrow_flatten
+
+
+def measure(function, *args, repeat=3):
+    # Best wall time of several runs, and the peak traced memory of one run
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(timings), peak
+
+
+def bench_transform(payloads, repeat=3):
+    raw_objects = [json.dumps(payload, indent=4).encode('utf-8') for payload in payloads]
+    records = list(payloads)
+    raw_bytes = sum(len(raw_object) for raw_object in raw_objects)
+
+    stages = {
+        'load_records': lambda: [arrow_flatten.load_records(raw_object) for raw_object in raw_objects],
+        'flatten_current_condition': lambda: arrow_flatten.flatten_records(records),
+        'flatten_forecast': lambda: arrow_flatten.flatten_forecast_records(records),
+    }
+
+    results = {}
+    for name, stage in stages.items():
+        seconds, peak_memory_bytes = measure(stage, repeat=repeat)
+        results[name] = {
+            'records': len(records),
+            'raw_bytes': raw_bytes,
+            'seconds': seconds,
+            'records_per_second': len(records) / seconds if seconds else None,
+            'peak_memory_bytes': peak_memory_bytes,
+        }
+
+    return results
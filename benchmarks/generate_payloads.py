@@ -0,0 +1,83 @@
+import copy
+import json
+import math
+import os
+import random
+from datetime import datetime, timedelta
+
+from benchmarks import ROOT_DIR
+
+SAMPLE_RAW_DATA = os.path.join(ROOT_DIR, 'glue', 'sample_raw_data.json')
+
+LOCAL_OBS_DATETIME_FORMAT = '%Y-%m-%d %I:%M %p'
+
+
+def load_sample():
+    with open(SAMPLE_RAW_DATA) as sample:
+        return json.load(sample)
+
+
+def location_name(number):
+    return f'Location {number:04d}'
+
+
+def generate_payload(sample, location_number, observed_at, rng):
+    # Shift the sample to another place and time, with a daily temperature
+    # cycle and some noise so the values are not all identical
+    payload = copy.deepcopy(sample)
+    daily_cycle = math.sin((observed_at.hour - 9) / 24 * 2 * math.pi)
+    temp_c = round(12 + 6 * daily_cycle + rng.uniform(-2, 2))
+
+    current_condition = payload['current_condition'][0]
+    current_condition.update({
+        'localObsDateTime': observed_at.strftime(LOCAL_OBS_DATETIME_FORMAT),
+        'observation_time': observed_at.strftime('%I:%M %p'),
+        'temp_C': str(temp_c),
+        'temp_F': str(round(temp_c * 9 / 5 + 32)),
+        'FeelsLikeC': str(temp_c - rng.randint(0, 4)),
+        'humidity': str(rng.randint(40, 100)),
+        'cloudcover': str(rng.randint(0, 100)),
+        'pressure': str(rng.randint(995, 1035)),
+        'precipMM': f'{max(0.0, rng.gauss(0, 1)):.1f}',
+        'winddirDegree': str(rng.randint(0, 359)),
+        'windspeedKmph': str(rng.randint(0, 60)),
+    })
+
+    nearest_area = payload['nearest_area'][0]
+    nearest_area['areaName'] = [{'value': location_name(location_number)}]
+    nearest_area['latitude'] = f'{rng.uniform(-45, -10):.3f}'
+    nearest_area['longitude'] = f'{rng.uniform(110, 155):.3f}'
+    nearest_area['population'] = str(rng.randint(1000, 5000000))
+
+    for day_index, day in enumerate(payload['weather']):
+        day['date'] = (observed_at.date() + timedelta(days=day_index)).isoformat()
+        for hour in day['hourly']:
+            hour['tempC'] = str(temp_c + rng.randint(-5, 5))
+
+    return payload
+
+
+def generate_payloads(locations=10, hours=24, start=datetime(2022, 6, 23), seed=0, sample=None):
+    # Yields (location, event time, payload) for every location and hour
+    rng = random.Random(seed)
+    sample = sample or load_sample()
+
+    for hour in range(hours):
+        observed_at = start + timedelta(hours=hour, minutes=rng.randint(0, 59))
+        event_time = (start + timedelta(hours=hour)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        for location_number in range(locations):
+            yield location_name(location_number), event_time, generate_payload(
+                sample, location_number, observed_at, rng)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Write synthetic wttr.in j1 payloads as line-delimited JSON')
+    parser.add_argument('--locations', type=int, default=10)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for _, _, payload in generate_payloads(args.locations, args.hours, seed=args.seed):
+        print(json.dumps(payload))
@@ -0,0 +1,127 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+
+class LocalService:
+    # Runs a handler class on a local port in a background thread
+
+    def __init__(self, handler_class):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def wttr_in_service(payloads, delay=0.0):
+    # Serves /{location}?format=j1 from a {location: bytes} dict
+    class WttrInHandler(BaseHTTPRequestHandler):
+        # Keeps connections alive like the real service
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            location = unquote(urlparse(self.path).path.lstrip('/')).replace('+', ' ')
+            body = payloads.get(location)
+            if delay:
+                threading.Event().wait(delay)
+
+            if body is None:
+                self.send_response(404)
+                body = b'Unknown location'
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return LocalService(WttrInHandler)
+
+
+def scripted_service(responses, body=b'{}'):
+    # Answers the n-th request with the n-th (status, delay) of responses, and
+    # the last one once they run out, to inject upstream errors and latency.
+    # The paths of the requests received are appended to service.requests.
+    requests = []
+    lock = threading.Lock()
+
+    class ScriptedHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with lock:
+                status, delay = responses[min(len(requests), len(responses) - 1)]
+                requests.append(self.path)
+            if delay:
+                threading.Event().wait(delay)
+
+            content = body if status == 200 else f'HTTP {status}'.encode('utf-8')
+            try:
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client timed out and went away
+                self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    service = LocalService(ScriptedHandler)
+    service.requests = requests
+    return service
+
+
+def s3_service(objects):
+    # Accepts path-style PutObject and GetObject requests, bodies are stored
+    # in a {(bucket, key): bytes} dict
+    class S3Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 answers the Expect: 100-continue header sent by botocore
+        protocol_version = 'HTTP/1.1'
+
+        def object_id(self):
+            bucket, _, key = unquote(urlparse(self.path).path.lstrip('/')).partition('/')
+            return bucket, key
+
+        def do_GET(self):
+            body = objects.get(self.object_id())
+
+            if body is None:
+                body = b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchKey</Code></Error>'
+                self.send_response(404)
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            objects[self.object_id()] = body
+
+            self.send_response(200)
+            self.send_header('ETag', '"0"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    return LocalService(S3Handler)
@@ -0,0 +1,62 @@
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+from benchmarks.bench_codecs import bench_codecs
+from benchmarks.bench_cold_start import bench_cold_start
+from benchmarks.bench_handler import bench_handler
+from benchmarks.bench_transform import bench_transform
+from benchmarks.generate_payloads import generate_payloads
+
+
+def run(locations, hours, invocations, max_concurrency, repeat, dedup_mode='off', cold_starts=3):
+    payloads = list(generate_payloads(locations, hours))
+    latest = {location: payload for location, _, payload in payloads}
+
+    return {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'locations': locations,
+            'hours': hours,
+            'invocations': invocations,
+            'max_concurrency': max_concurrency,
+            'repeat': repeat,
+            'dedup_mode': dedup_mode,
+            'cold_starts': cold_starts,
+        },
+        'transform': bench_transform([payload for _, _, payload in payloads], repeat),
+        'codecs': bench_codecs([payload for _, _, payload in payloads], repeat),
+        'handler': bench_handler(latest, invocations, max_concurrency, dedup_mode),
+        'cold_start': bench_cold_start(latest, cold_starts, invocations),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ingest and transform data path')
+    parser.add_argument('--locations', type=int, default=50)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--invocations', type=int, default=3)
+    parser.add_argument('--max-concurrency', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--dedup-mode', default='off', choices=['observation', 'content', 'off'])
+    parser.add_argument('--cold-starts', type=int, default=3, help='New interpreters started to time cold starts')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = run(args.locations, args.hours, args.invocations, args.max_concurrency, args.repeat,
+                 args.dedup_mode, args.cold_starts)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
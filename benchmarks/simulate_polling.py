@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import dedup
+import poll_schedule
+import raw_codec
+from benchmarks.generate_payloads import LOCAL_OBS_DATETIME_FORMAT, location_name
+
+# Replays recorded payloads against the fixed and the adaptive polling
+# policies on a virtual clock. A recording maps each location to the
+# observation times it published, in order. Each observation becomes
+# visible upstream PUBLISH_LAG_SECONDS after its localObsDateTime.
+TICK_SECONDS = 5 * 60
+FIXED_INTERVAL_SECONDS = 3600
+PUBLISH_LAG_SECONDS = 10 * 60
+
+
+def load_recording(raw_dir):
+    # Reads a local copy of the raw zone (e.g. from aws s3 sync), any codec
+    recording = {}
+
+    for directory, _, file_names in os.walk(raw_dir):
+        location = next((part.split('=', 1)[1] for part in directory.split(os.sep)
+                         if part.startswith('location=')), None)
+        if location is None:
+            continue
+
+        for file_name in file_names:
+            with open(os.path.join(directory, file_name), 'rb') as raw_file:
+                data = raw_codec.decode(raw_file.read())
+            for line in data.decode('utf-8').splitlines() if file_name.endswith(('.jsonl', '.jsonl.gz')) else [data]:
+                observation = dedup.fingerprint(line, 'observation')
+                if observation:
+                    recording.setdefault(location, set()).add(observation)
+
+    return {location: sorted(observations, key=poll_schedule.parse_observation)
+            for location, observations in recording.items()}
+
+
+def synthetic_recording(locations=20, hours=48, cadences_minutes=(15, 30, 60, 180), start=datetime(2022, 6, 23),
+                        seed=0):
+    # Locations publish at one of the cadences, with a random phase and some
+    # skipped observations
+    rng = random.Random(seed)
+    recording = {}
+
+    for location_number in range(locations):
+        cadence = timedelta(minutes=cadences_minutes[location_number % len(cadences_minutes)])
+        observed_at = start + timedelta(minutes=rng.randint(0, 59))
+        observations = []
+        while observed_at < start + timedelta(hours=hours):
+            if rng.random() > 0.05:
+                observations.append(observed_at.strftime(LOCAL_OBS_DATETIME_FORMAT))
+            observed_at += cadence
+        recording[location_name(location_number)] = observations
+
+    return recording
+
+
+def latest_observation(published, now):
+    # Latest observation visible upstream at now
+    visible = [observation for observation, visible_at in published if visible_at <= now]
+    return visible[-1] if visible else None
+
+
+def simulate(recording, policy, throttle_rate=0.0, seed=0, max_fetches=None):
+    rng = random.Random(seed)
+    published = {location: [(observation, poll_schedule.parse_observation(observation) + PUBLISH_LAG_SECONDS)
+                             for observation in observations]
+                 for location, observations in recording.items() if observations}
+    start = min(visible_at for observations in published.values() for _, visible_at in observations)
+    end = max(visible_at for observations in published.values() for _, visible_at in observations) + 3600
+    # Align the ticks with the hour, like the cron schedule
+    start -= start % 3600
+
+    schedule = {}
+    captured = {location: {} for location in published}
+    fetches = wasted = throttled = 0
+    fetches_per_tick = []
+
+    for now in range(int(start), int(end), TICK_SECONDS):
+        if policy == 'fixed':
+            due = list(published) if (now - start) % FIXED_INTERVAL_SECONDS == 0 else []
+        else:
+            due = poll_schedule.due_locations(list(published), schedule, now, max_fetches)
+        fetches_per_tick.append(len(due))
+
+        for location in due:
+            fetches += 1
+            if rng.random() < throttle_rate:
+                throttled += 1
+                outcome, observation = 'throttled', None
+            else:
+                outcome, observation = 'ok', latest_observation(published[location], now)
+                if observation is None or observation in captured[location]:
+                    wasted += 1
+                else:
+                    captured[location][observation] = now
+
+            if policy == 'adaptive':
+                schedule[location] = poll_schedule.record_fetch(
+                    schedule.get(location), location, now, outcome, observation, rng)
+
+    staleness = [seen_at - visible_at for location, observations in published.items()
+                 for observation, visible_at in observations
+                 for seen_at in [captured[location].get(observation)] if seen_at is not None]
+    observations = sum(len(observations) for observations in published.values())
+
+    return {
+        'policy': policy,
+        'locations': len(published),
+        'hours': (end - start) / 3600,
+        'observations': observations,
+        'captured': len(staleness),
+        'missed': observations - len(staleness),
+        'fetches': fetches,
+        'wasted_fetches': wasted,
+        'throttled_fetches': throttled,
+        'fetches_per_captured_observation': fetches / len(staleness) if staleness else None,
+        'mean_staleness_minutes': sum(staleness) / len(staleness) / 60 if staleness else None,
+        'max_staleness_minutes': max(staleness) / 60 if staleness else None,
+        'peak_fetches_per_tick': max(fetches_per_tick) if fetches_per_tick else 0,
+    }
+
+
+def compare(recording, throttle_rate=0.0, seed=0, max_fetches=None):
+    return {policy: simulate(recording, policy, throttle_rate, seed, max_fetches) for policy in ('fixed', 'adaptive')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare fixed and adaptive polling on recorded observations')
+    parser.add_argument('--recording', help='Local copy of the raw zone, a synthetic recording is used otherwise')
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--hours', type=int, default=48)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-fetches', type=int, help='Most locations fetched per adaptive invocation')
+    args = parser.parse_args(argv)
+
+    if args.recording:
+        recording = load_recording(args.recording)
+    else:
+        recording = synthetic_recording(args.locations, args.hours, seed=args.seed)
+
+    json.dump(compare(recording, args.throttle_rate, args.seed, args.max_fetches), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
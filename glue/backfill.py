@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+import arrow_flatten
+import parquet_layout
+import rollups
+import weather_schema
+
+# Reprocesses the raw objects of a date range into the curated table without
+# running the Glue workflow:
+#
+# 1. every {raw}/location=X/date=D/ directory of the range is flattened by a
+#    process pool, and its rows are staged locally
+# 2. each curated areaName/localObsDate partition the rows fall in is
+#    rewritten by the pool: the staged rows are merged with the rows already
+#    stored (reprocessed rows replace stored rows of the same observation)
+#    and written as new files, then the old files are deleted
+#
+# Progress is checkpointed to a local state file after each step, so an
+# interrupted run continues where it stopped when the same command is run
+# again. New files carry the run id: files of an attempt that did not get
+# checkpointed are deleted before the partition is rewritten, so a partition
+# never ends up with rows twice. Readers never see a partition without its
+# rows, but may see them twice between the new files being written and the
+# old ones being deleted. The watermark of the nightly job is not touched,
+# and neither are the rollups: the months of the rewritten partitions are
+# returned as stale_rollup_months, recomputed by the next ETL job run with
+# --rollupsBackfill true.
+
+# Rows of a partition are unique per observation time, the partition columns
+# are stored in the directory names
+UNIQUE_KEYS = ['localObsTimeStamp']
+PARTITION_SCHEMA = pa.schema([field for field in arrow_flatten.CURATED_SCHEMA
+                              if field.name not in weather_schema.PARTITION_KEYS])
+
+
+def date_range(start, end):
+    days = (date.fromisoformat(end) - date.fromisoformat(start)).days
+    return [(date.fromisoformat(start) + timedelta(days=day)).isoformat() for day in range(days + 1)]
+
+
+def list_locations(filesystem, raw_dir):
+    return sorted(file_info.base_name.split('=', 1)[1]
+                  for file_info in filesystem.get_file_info(fs.FileSelector(raw_dir, allow_not_found=True))
+                  if file_info.type == fs.FileType.Directory and file_info.base_name.startswith('location='))
+
+
+def list_files(filesystem, directory, suffix=''):
+    return sorted(file_info.path
+                  for file_info in filesystem.get_file_info(
+                      fs.FileSelector(directory, recursive=True, allow_not_found=True))
+                  if file_info.type == fs.FileType.File and file_info.path.endswith(suffix))
+
+
+def read_raw_records(filesystem, paths):
+    for path in paths:
+        with filesystem.open_input_stream(path) as raw_file:
+            yield from arrow_flatten.load_records(raw_file.read())
+
+
+def transform_unit(filesystem, raw_dir, location, day, staging_path):
+    # Flattens the hourly and compacted raw objects of a location and day,
+    # and stages the rows. Returns the number of objects, the number of rows
+    # and the partitions of the rows.
+    paths = list_files(filesystem, f'{raw_dir}/location={location}/date={day}')
+    table = arrow_flatten.flatten_records(read_raw_records(filesystem, paths))
+    pq.write_table(table, staging_path)
+
+    partitions = {tuple(row[name] for name in weather_schema.PARTITION_KEYS)
+                  for row in table.select(weather_schema.PARTITION_KEYS).to_pylist()}
+
+    return len(paths), table.num_rows, [[value if value is None else str(value) for value in values]
+                                        for values in sorted(partitions, key=str)]
+
+
+def partition_filter(table, values):
+    mask = None
+    for name, value in zip(weather_schema.PARTITION_KEYS, values):
+        column = table[name].cast(pa.string())
+        condition = column.is_null() if value is None else pc.equal(column, value)
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return table.filter(mask)
+
+
+def merge_rows(new, existing):
+    # Reprocessed rows come first, so the first row of each observation is
+    # the reprocessed one when there is one
+    rows = pa.concat_tables([new.cast(PARTITION_SCHEMA), existing.cast(PARTITION_SCHEMA)])
+    positions = rows.select(UNIQUE_KEYS).append_column('position', pa.array(range(rows.num_rows), pa.int64()))
+    first = positions.group_by(UNIQUE_KEYS).aggregate([('position', 'min')])['position_min']
+    return rows.take(pc.take(first, pc.sort_indices(first)))
+
+
+def read_partition(filesystem, paths):
+    if not paths:
+        return PARTITION_SCHEMA.empty_table()
+    tables = [pq.read_table(path, filesystem=filesystem) for path in paths]
+    # Spark writes INT96 timestamps, which are read with nanosecond precision
+    return pa.concat_tables(table.select(PARTITION_SCHEMA.names).cast(PARTITION_SCHEMA) for table in tables)
+
+
+def write_merged_partition(filesystem, output_dir, values, staging_paths, run_id, codec):
+    # Writes the merged rows of a partition as new files, and returns the
+    # new files and the old files to delete once the new ones are checkpointed
+    partition_dir = f'{output_dir}/{weather_schema.partition_path(values)}'
+
+    # Files of an attempt that was interrupted before being checkpointed
+    for path in list_files(filesystem, partition_dir, '.parquet'):
+        if run_id in path.rsplit('/', 1)[-1]:
+            filesystem.delete_file(path)
+    old_paths = list_files(filesystem, partition_dir, '.parquet')
+
+    new = pa.concat_tables(partition_filter(pq.read_table(path), values) for path in staging_paths)
+    new = new.select(PARTITION_SCHEMA.names)
+    merged = merge_rows(new, read_partition(filesystem, old_paths))
+
+    new_paths = parquet_layout.write_partition(merged, filesystem, partition_dir, codec, run_id=run_id)
+
+    return new_paths, old_paths
+
+
+def load_state(path, settings):
+    if os.path.exists(path):
+        with open(path) as state_file:
+            state = json.load(state_file)
+        if state['settings'] != settings:
+            raise ValueError(f'{path} belongs to a backfill with other settings, pass another --state')
+        return state
+
+    return {'settings': settings, 'run_id': uuid.uuid4().hex, 'units': {}, 'partitions': {}}
+
+
+def save_state(path, state):
+    # Written to a temporary file first, so an interruption never leaves a truncated state
+    with open(f'{path}.tmp', 'w') as state_file:
+        json.dump(state, state_file, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def default_state_path(locations, start, end):
+    return f'.backfill-{"_".join(locations) or "all"}-{start}-{end}.json'
+
+
+def run_tasks(function, tasks, workers):
+    # Yields (task, result) as they complete, in a process pool when there is more than one worker
+    if workers <= 1:
+        for task in tasks:
+            yield task, function(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(function, *task): task for task in tasks}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def report(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def backfill(raw_uri, output_uri, start, end, locations=None, state_path=None, workers=None,
+             codec=parquet_layout.DEFAULT_CODEC, endpoint_url=None, progress=report):
+    raw_filesystem, raw_dir = parquet_layout.filesystem_from_uri(raw_uri, endpoint_url)
+    output_filesystem, output_dir = parquet_layout.filesystem_from_uri(output_uri, endpoint_url)
+    workers = workers or os.cpu_count()
+
+    locations = sorted(locations or list_locations(raw_filesystem, raw_dir))
+    state_path = state_path or default_state_path(locations, start, end)
+    settings = {'raw': raw_uri, 'output': output_uri, 'start': start, 'end': end,
+                'locations': locations, 'codec': codec}
+    state = load_state(state_path, settings)
+    staging_dir = f'{state_path}.staging'
+    os.makedirs(staging_dir, exist_ok=True)
+
+    # 1. Flatten and stage the rows of each location and day
+    all_units = [(location, day) for location in locations for day in date_range(start, end)]
+    units = [(location, day) for location, day in all_units if f'{location}/{day}' not in state['units']]
+    tasks = [(raw_filesystem, raw_dir, location, day, os.path.join(staging_dir, f'{location}_{day}.parquet'))
+             for location, day in units]
+    for task, (objects, rows, partitions) in run_tasks(transform_unit, tasks, workers):
+        state['units'][f'{task[2]}/{task[3]}'] = {
+            'staging': task[4], 'objects': objects, 'rows': rows, 'partitions': partitions}
+        save_state(state_path, state)
+        progress(f'[{len(state["units"])}/{len(all_units)}] '
+                 f'transformed {task[2]} {task[3]}: {objects} objects, {rows} rows')
+
+    # 2. Rewrite every partition the rows fall in
+    staging_paths = {}
+    for unit in state['units'].values():
+        for values in unit['partitions']:
+            staging_paths.setdefault(json.dumps(values), []).append(unit['staging'])
+
+    for key, partition in state['partitions'].items():
+        # Checkpointed new files, the old ones may not have been deleted yet
+        if not partition.get('done'):
+            for path in partition['old']:
+                delete_if_exists(output_filesystem, path)
+            partition['done'] = True
+            save_state(state_path, state)
+
+    tasks = [(output_filesystem, output_dir, json.loads(key), paths, state['run_id'], codec)
+             for key, paths in sorted(staging_paths.items()) if key not in state['partitions']]
+    for task, (new_paths, old_paths) in run_tasks(write_merged_partition, tasks, workers):
+        key = json.dumps(task[2])
+        state['partitions'][key] = {'new': new_paths, 'old': old_paths, 'done': False}
+        save_state(state_path, state)
+
+        for path in old_paths:
+            delete_if_exists(output_filesystem, path)
+        state['partitions'][key]['done'] = True
+        save_state(state_path, state)
+        progress(f'[{len(state["partitions"])}/{len(staging_paths)}] rewrote {weather_schema.partition_path(task[2])}')
+
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    partitions = [json.loads(key) for key in state['partitions']]
+    stale_months = rollups.affected_months((area_name, date.fromisoformat(obs_date))
+                                           for area_name, obs_date in partitions if obs_date is not None)
+    if stale_months:
+        progress(f'rollups of {len(stale_months)} months are stale, run the ETL job with --rollupsBackfill true')
+
+    return {
+        'state': state_path,
+        'units': len(state['units']),
+        'objects': sum(unit['objects'] for unit in state['units'].values()),
+        'rows': sum(unit['rows'] for unit in state['units'].values()),
+        'partitions': len(state['partitions']),
+        'stale_rollup_months': [list(month) for month in stale_months],
+    }
+
+
+def delete_if_exists(filesystem, path):
+    if filesystem.get_file_info(path).type == fs.FileType.File:
+        filesystem.delete_file(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reprocess raw objects of a date range into the curated table')
+    parser.add_argument('--raw-dir', required=True, help='Raw data path, a local directory or s3://bucket/prefix')
+    parser.add_argument('--output-dir', required=True, help='Curated data path, a local directory or s3://bucket/prefix')
+    parser.add_argument('--start', required=True, help='First raw date, YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='Last raw date, YYYY-MM-DD')
+    parser.add_argument('--location', action='append', dest='locations',
+                        help='Raw location partition, e.g. Melbourne_VIC. Every location by default')
+    parser.add_argument('--workers', type=int, help='Processes, the number of CPUs by default')
+    parser.add_argument('--codec', default=parquet_layout.DEFAULT_CODEC, choices=parquet_layout.CODECS)
+    parser.add_argument('--state', help='Local checkpoint file, rerun with the same one to resume')
+    parser.add_argument('--endpoint-url', help='S3 endpoint, e.g. a local S3 stand-in')
+    args = parser.parse_args(argv)
+
+    summary = backfill(args.raw_dir, args.output_dir, args.start, args.end, args.locations, args.state,
+                       args.workers, args.codec, args.endpoint_url)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
+import raw_codec
+from incremental import split_s3_url
+
+# Compacts the hourly raw objects of a location and day into one gzipped,
+# line-delimited file stored in the hour=all partition of that day:
+#
+#   {raw}/location=X/date=D/hour=HH/{event time}.json   (hourly objects)
+#   {raw}/location=X/date=D/hour=all/compacted-0001.jsonl.gz
+#
+# A manifest per location and day records the compacted sources and the
+# current output generation. Outputs are written before the manifest and
+# sources are only deleted after it, so an interrupted run can be re-run.
+COMPACTED_HOUR = 'all'
+
+# delete_objects accepts at most 1000 keys per call
+DELETE_BATCH_SIZE = 1000
+
+
+def compacted_key(raw_prefix, location, date, generation):
+    return f'{raw_prefix}/location={location}/date={date}/hour={COMPACTED_HOUR}/compacted-{generation:04d}.jsonl.gz'
+
+
+def manifest_key(manifest_prefix, location, date):
+    return f'{manifest_prefix}/location={location}/date={date}.json'
+
+
+def list_locations(s3, bucket, raw_prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=f'{raw_prefix}/location=', Delimiter='/'):
+        for common_prefix in page.get('CommonPrefixes', []):
+            yield common_prefix['Prefix'].rstrip('/').split('location=', 1)[1]
+
+
+def list_hourly_keys(s3, bucket, raw_prefix, location, date):
+    paginator = s3.get_paginator('list_objects_v2')
+    prefix = f'{raw_prefix}/location={location}/date={date}/'
+    compacted_prefix = f'{prefix}hour={COMPACTED_HOUR}/'
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for s3_object in page.get('Contents', []):
+            if not s3_object['Key'].startswith(compacted_prefix):
+                yield s3_object['Key']
+
+
+def read_records(body):
+    # Hourly objects hold one (pretty printed) document, compacted objects
+    # one document per line, both compressed with any of the raw codecs
+    text = raw_codec.decode(body).decode('utf-8').strip()
+    if not text:
+        return []
+
+    try:
+        return [json.loads(text)]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def load_manifest(s3, bucket, key):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return {'generation': 0, 'output': None, 'sources': []}
+
+    return json.loads(response['Body'].read())
+
+
+def delete_keys(s3, bucket, keys):
+    keys = list(keys)
+
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        s3.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + DELETE_BATCH_SIZE]],
+                    'Quiet': True},
+        )
+
+
+def compact_partition(s3, bucket, raw_prefix, manifest_prefix, location, date):
+    hourly_keys = sorted(list_hourly_keys(s3, bucket, raw_prefix, location, date))
+    manifest_object_key = manifest_key(manifest_prefix, location, date)
+    manifest = load_manifest(s3, bucket, manifest_object_key)
+
+    compacted_sources = set(manifest['sources'])
+    new_keys = [key for key in hourly_keys if key not in compacted_sources]
+
+    if new_keys:
+        lines = []
+
+        # Carry over the previous generation before appending the new sources
+        if manifest['output']:
+            previous = s3.get_object(Bucket=bucket, Key=manifest['output'])['Body'].read()
+            lines += [json.dumps(record) for record in read_records(previous)]
+
+        for key in new_keys:
+            body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+            lines += [json.dumps(record) for record in read_records(body)]
+
+        output = compacted_key(raw_prefix, location, date, manifest['generation'] + 1)
+        s3.put_object(
+            Bucket=bucket,
+            Key=output,
+            Body=raw_codec.encode(('\n'.join(lines) + '\n').encode('utf-8'), 'gzip'),
+            ContentType='application/x-ndjson',
+        )
+
+        previous_output = manifest['output']
+        manifest = {
+            'generation': manifest['generation'] + 1,
+            'output': output,
+            'sources': sorted(compacted_sources | set(new_keys)),
+            'records': len(lines),
+        }
+        s3.put_object(
+            Bucket=bucket,
+            Key=manifest_object_key,
+            Body=json.dumps(manifest).encode('utf-8'),
+            ContentType='application/json',
+        )
+
+        if previous_output:
+            delete_keys(s3, bucket, [previous_output])
+
+    # Sources left behind by an interrupted run are deleted as well
+    delete_keys(s3, bucket, [key for key in hourly_keys if key in set(manifest['sources'])])
+
+    return manifest
+
+
+def compaction_dates(today, lookback_days):
+    # Only completed days are compacted
+    return [(today - timedelta(days=days)).isoformat() for days in range(lookback_days, 0, -1)]
+
+
+def compact(s3, raw_dir, manifest_dir, lookback_days=1, today=None):
+    bucket, raw_prefix = split_s3_url(raw_dir.rstrip('/'))
+    _, manifest_prefix = split_s3_url(manifest_dir.rstrip('/'))
+    today = today or datetime.now(timezone.utc).date()
+
+    results = []
+    for location in list_locations(s3, bucket, raw_prefix):
+        for date in compaction_dates(today, lookback_days):
+            manifest = compact_partition(s3, bucket, raw_prefix, manifest_prefix, location, date)
+            if manifest['output']:
+                results.append((location, date, manifest['generation']))
+
+    return results
+
+
+if __name__ == '__main__':
+    import boto3
+    from awsglue.utils import getResolvedOptions
+
+    args = getResolvedOptions(sys.argv, ['rawDir', 'manifestDir', 'lookbackDays'])
+
+    for location, date, generation in compact(
+            boto3.client('s3'), args['rawDir'], args['manifestDir'], int(args['lookbackDays'])):
+        print(f'Compacted {location} {date} (generation {generation})')
@@ -0,0 +1,240 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+import arrow_flatten
+import parquet_layout
+import weather_schema
+
+# Time-series reads of the curated table, laid out by the ETL job and
+# backfill.py as {root}/areaName=A/localObsDate=D/*.parquet with the rows of
+# each file sorted by localObsTimeStamp:
+# - only the directory of the queried area is listed, and only the
+#   localObsDate partitions of the time range are read
+# - only the requested columns are decoded
+# - the localObsTimeStamp range is pushed down to the parquet reader, which
+#   skips the row groups outside of it from their statistics
+# - decoded results are kept in an LRU cache bounded by their size. A result
+#   is only served while the files of the partitions of its time range are
+#   those it was read from: new partitions or files, and files rewritten by
+#   the ETL job, backfill.py or a layout optimization make the next query read
+#   the table again.
+# Listings of an area are reused for refresh_seconds, so new partitions are
+# seen at most that long after they are written.
+
+TIMESTAMP_COLUMN = 'localObsTimeStamp'
+
+PARTITIONING = ds.partitioning(
+    pa.schema([arrow_flatten.CURATED_SCHEMA.field(name) for name in weather_schema.PARTITION_KEYS]),
+    flavor='hive')
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+DEFAULT_REFRESH_SECONDS = 60
+
+CacheEntry = namedtuple('CacheEntry', ['fingerprint', 'table'])
+
+
+class ResultCache:
+    # Least recently used tables, evicted once their total size is over
+    # max_bytes. Tables larger than max_bytes are not kept.
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, fingerprint):
+        # The table cached for the key, None when there is none or it was
+        # read from other files
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.fingerprint != fingerprint:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.table
+
+    def put(self, key, fingerprint, table):
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key).table.nbytes
+            if table.nbytes > self.max_bytes:
+                return
+
+            self.entries[key] = CacheEntry(fingerprint, table)
+            self.bytes += table.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.table.nbytes
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+def recent_window(hours, now):
+    # Start of a window covering at least the last hours before now, a local
+    # time of the area like localObsTimeStamp. The start is aligned to the
+    # hour, so the polls of the same window within an hour are the same query
+    # and share a cache entry.
+    return now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours)
+
+
+def time_filter(start, end):
+    # start <= localObsTimeStamp < end, None when the range is open
+    timestamp_type = arrow_flatten.CURATED_SCHEMA.field(TIMESTAMP_COLUMN).type
+    conditions = []
+    if start is not None:
+        conditions.append(ds.field(TIMESTAMP_COLUMN) >= pa.scalar(start, timestamp_type))
+    if end is not None:
+        conditions.append(ds.field(TIMESTAMP_COLUMN) < pa.scalar(end, timestamp_type))
+
+    condition = None
+    for part in conditions:
+        condition = part if condition is None else condition & part
+    return condition
+
+
+class CuratedTable:
+
+    def __init__(self, uri, endpoint_url=None, cache_bytes=DEFAULT_CACHE_BYTES,
+                 refresh_seconds=DEFAULT_REFRESH_SECONDS, clock=time.monotonic):
+        self.filesystem, self.root = parquet_layout.filesystem_from_uri(uri, endpoint_url)
+        self.cache = ResultCache(cache_bytes)
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        # {areaName: (listed at, {localObsDate: ((path, size, mtime_ns), ...)})}
+        self.listings = {}
+        self.lock = threading.Lock()
+
+    def area_dir(self, area):
+        return f'{self.root}/areaName={weather_schema.escape_partition_value(area)}'
+
+    def partitions(self, area, refresh=False):
+        # Files of each localObsDate partition of the area
+        with self.lock:
+            listing = self.listings.get(area)
+        if listing is not None and not refresh and self.clock() - listing[0] < self.refresh_seconds:
+            return listing[1]
+
+        area_dir = self.area_dir(area)
+        partitions = {}
+        for file_info in self.filesystem.get_file_info(fs.FileSelector(area_dir, recursive=True,
+                                                                        allow_not_found=True)):
+            if file_info.type != fs.FileType.File or not file_info.path.endswith('.parquet'):
+                continue
+            partition = file_info.path[len(area_dir) + 1:].split('/', 1)[0]
+            try:
+                day = date.fromisoformat(partition[len('localObsDate='):])
+            except ValueError:
+                # Rows without an observation time are not in a time range
+                continue
+            partitions.setdefault(day, []).append((file_info.path, file_info.size, file_info.mtime_ns))
+
+        partitions = {day: tuple(sorted(files)) for day, files in partitions.items()}
+        with self.lock:
+            self.listings[area] = (self.clock(), partitions)
+        return partitions
+
+    def query(self, area, start=None, end=None, columns=None, refresh=False):
+        # Rows of the area with start <= localObsTimeStamp < end, sorted by
+        # localObsTimeStamp, with the given columns (all curated columns by
+        # default). Times are the naive local times of the table.
+        columns = tuple(columns or arrow_flatten.CURATED_SCHEMA.names)
+        unknown = [column for column in columns if column not in arrow_flatten.CURATED_SCHEMA.names]
+        if unknown:
+            raise ValueError(f'Unknown curated columns {unknown}')
+
+        partitions = self.partitions(area, refresh)
+        days = sorted(day for day in partitions
+                      if (start is None or day >= start.date()) and (end is None or day <= end.date()))
+        fingerprint = tuple((day, partitions[day]) for day in days)
+
+        key = (area, start, end, columns)
+        table = self.cache.get(key, fingerprint)
+        if table is None:
+            table = self.read([path for day in days for path, _, _ in partitions[day]], start, end, columns)
+            self.cache.put(key, fingerprint, table)
+        return table
+
+    def latest_observation(self, area, refresh=False):
+        # localObsTimeStamp of the latest observation of the area, None when
+        # there is none. Only the newest localObsDate partition is read.
+        partitions = self.partitions(area, refresh)
+        if not partitions:
+            return None
+        newest = max(partitions)
+        timestamps = self.query(area, datetime(newest.year, newest.month, newest.day), None, [TIMESTAMP_COLUMN], refresh)
+        return timestamps.column(TIMESTAMP_COLUMN)[-1].as_py() if timestamps.num_rows else None
+
+    def recent(self, area, hours=24, columns=None, now=None):
+        # Rows of the last hours before now, the local time of the area.
+        # Local times of the areas differ from the time of this host, so now
+        # is the latest observation of the area by default.
+        now = now or self.latest_observation(area)
+        if now is None:
+            return self.query(area, columns=columns)
+        return self.query(area, recent_window(hours, now), None, columns)
+
+    def read(self, paths, start, end, columns):
+        read_columns = list(columns) if TIMESTAMP_COLUMN in columns else list(columns) + [TIMESTAMP_COLUMN]
+        if not paths:
+            return arrow_flatten.CURATED_SCHEMA.empty_table().select(list(columns))
+
+        # Files written by Spark and by pyarrow differ in their timestamp
+        # units, they are read as the curated schema
+        dataset = ds.dataset(paths, schema=arrow_flatten.CURATED_SCHEMA, format='parquet',
+                             filesystem=self.filesystem, partitioning=PARTITIONING,
+                             partition_base_dir=self.root)
+        table = dataset.to_table(columns=read_columns, filter=time_filter(start, end))
+
+        return table.sort_by([(TIMESTAMP_COLUMN, 'ascending')]).select(list(columns))
+
+
+def parse_time(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M') if 'T' in value else datetime.strptime(value, '%Y-%m-%d')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query the curated table of an area over a time range')
+    parser.add_argument('table', help='Curated table directory or s3:// URI')
+    parser.add_argument('--area', required=True, help='areaName, e.g. Melbourne')
+    parser.add_argument('--start', type=parse_time, help='YYYY-MM-DD or YYYY-MM-DDTHH:MM, local time')
+    parser.add_argument('--end', type=parse_time, help='Exclusive, YYYY-MM-DD or YYYY-MM-DDTHH:MM, local time')
+    parser.add_argument('--hours', type=int, help='Last hours instead of --start and --end')
+    parser.add_argument('--now', type=parse_time,
+                        help='End of --hours, local time. The latest observation of the area by default')
+    parser.add_argument('--columns', nargs='+', help='All curated columns by default')
+    parser.add_argument('--endpoint-url', help='S3 endpoint, e.g. a local stand-in')
+    args = parser.parse_args(argv)
+
+    table = CuratedTable(args.table, args.endpoint_url)
+    started = time.perf_counter()
+    if args.hours is not None:
+        rows = table.recent(args.area, args.hours, args.columns, args.now)
+    else:
+        rows = table.query(args.area, args.start, args.end, args.columns)
+
+    for row in rows.to_pylist():
+        print(json.dumps(row, default=str))
+    print(json.dumps({'rows': rows.num_rows, 'seconds': round(time.perf_counter() - started, 3)}),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import json
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+# Watermark persisted between ETL runs. Raw objects are immutable once written,
+# so everything modified after the high-water mark is new. Keys modified at
+# exactly the mark are remembered to avoid reprocessing them on the next run.
+EMPTY_WATERMARK = {
+    'high_water_mark': None,
+    'keys_at_mark': [],
+}
+
+
+def split_s3_url(url):
+    parsed = urlparse(url)
+    return parsed.netloc, parsed.path.lstrip('/')
+
+
+def load_watermark(s3, bucket, key):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return dict(EMPTY_WATERMARK)
+
+    return json.loads(response['Body'].read())
+
+
+def save_watermark(s3, bucket, key, watermark):
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(watermark).encode('utf-8'),
+        ContentType='application/json',
+    )
+
+
+def list_raw_objects(s3, bucket, prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for s3_object in page.get('Contents', []):
+            if not s3_object['Key'].endswith('/'):
+                yield s3_object
+
+
+def raw_connection_options(paths, raw_dir):
+    # S3 connection options of the raw objects to read: the given objects, or
+    # every object under raw_dir when paths is None. None without a raw_dir,
+    # the raw table of the catalog is read instead. Its partitions are not
+    # registered when Athena projects them, and Glue does not project them.
+    if paths is not None:
+        return {'paths': paths}
+    if raw_dir is None:
+        return None
+    return {'paths': [raw_dir], 'recurse': True}
+
+
+def _as_utc(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def select_new_objects(s3_objects, watermark, full_rebuild=False):
+    # Returns the objects to process and the watermark to save once they have
+    # been processed successfully
+    mark = None if full_rebuild or not watermark['high_water_mark'] else _as_utc(
+        watermark['high_water_mark'])
+    keys_at_mark = set() if full_rebuild else set(watermark['keys_at_mark'])
+
+    new_objects = []
+    new_mark = mark
+    new_keys_at_mark = set(keys_at_mark)
+
+    for s3_object in s3_objects:
+        last_modified = _as_utc(s3_object['LastModified'])
+
+        if mark is not None and (last_modified < mark or
+                                 (last_modified == mark and s3_object['Key'] in keys_at_mark)):
+            continue
+
+        new_objects.append(s3_object)
+
+        if new_mark is None or last_modified > new_mark:
+            new_mark = last_modified
+            new_keys_at_mark = {s3_object['Key']}
+        elif last_modified == new_mark:
+            new_keys_at_mark.add(s3_object['Key'])
+
+    new_watermark = {
+        'high_water_mark': new_mark.isoformat() if new_mark else None,
+        'keys_at_mark': sorted(new_keys_at_mark),
+    }
+
+    return new_objects, new_watermark
+
+
+def affected_partitions(rows, partition_keys=('areaName', 'localObsDate')):
+    return sorted({tuple(row[key] for key in partition_keys) for row in rows},
+                  key=lambda partition: tuple(str(value) for value in partition))
@@ -1,3 +1,4 @@
+import builtins
 import sys
 from awsglue.transforms import *
 from awsglue.utils import getResolvedOptions
@@ -6,6 +7,12 @@ from awsglue.context import GlueContext
 from awsglue.job import Job
 from pyspark.sql.functions import *
 from awsglue.dynamicframe import DynamicFrame
+from pyspark.sql.types import StructType
+
+import instrumentation
+import shards
+import spark_flatten
+import weather_schema
 
 sc = SparkContext.getOrCreate()
 glueContext = GlueContext(sc)
@@ -26,116 +33,470 @@ GLUE_TMP_STORAGE = args['tempDir']
 GLUE_OUTPUT_DIR = args['outputDir']
 
 
-# Read from Glue table
-wttrDf = glueContext.create_dynamic_frame.from_catalog(
-    database=GLUE_SRC_DB, table_name=GLUE_SRC_TBL)
-# wttrDf.printSchema()
-
-# Relationalize to flatten the schema
-dfc = wttrDf.relationalize('root', GLUE_TMP_STORAGE)
-dfc.keys()
-
-rootDf = dfc.select('root')
-currentConditionDf = dfc.select('root_current_condition')
-nearestAreaDf = dfc.select('root_nearest_area')
-
-# Flatten current_condition
-# Get weatherDesc
-currentConditionWeatherDesc = dfc.select(
-    'root_current_condition.val.weatherDesc')
-
-# Join current_condition and current_condition.val.weatherDesc
-flatCurrentConditionDf = Join.apply(currentConditionDf, currentConditionWeatherDesc, '`current_condition.val.weatherDesc`', 'id').drop_fields([
-    '`current_condition.val.weatherDesc`', '`current_condition.val.weatherIconUrl`'])
-
-# Flatten nearest_area
-# Get areaName
-nearestAreaAreaNameDf = dfc.select('root_nearest_area.val.areaName')
-
-# Get country
-nearestAreaCountryDf = dfc.select('root_nearest_area.val.country')
-
-# Get region
-nearestAreaRegionDf = dfc.select('root_nearest_area.val.region')
-
-# Join everything together
-flatNearestAreaDf = Join.apply(Join.apply(Join.apply(nearestAreaDf, nearestAreaAreaNameDf, '`nearest_area.val.areaName`', 'id'), nearestAreaCountryDf, '`nearest_area.val.country`', 'id'),
-                               nearestAreaRegionDf, '`nearest_area.val.region`', 'id').drop_fields(['`nearest_area.val.areaName`', '`nearest_area.val.country`', '`nearest_area.val.region`', '`nearest_area.val.weatherUrl`'])
-
-# Bring everything together to a flat df
-# Create root df
-rootDf = dfc.select('root')
-rootDf = rootDf.drop_fields(['request', 'weather'])
-
-# Join rootDf with flatCurrentConditionDf and flatNearestAreaDf
-flatRootDf = Join.apply(Join.apply(rootDf, flatCurrentConditionDf, 'current_condition',
-                        '`root_current_condition.id`'), flatNearestAreaDf, 'nearest_area', '`root_nearest_area.id`')
-flatRootDf.printSchema()
-
-cols_to_drop = [
-    'current_condition',
-    '`root_current_condition.id`',
-    '`root_current_condition.index`',
-    '`rootroot_current_conditionroot_current_condition.val.weatherDesc.id`',
-    '`rootroot_current_conditionroot_current_condition.val.weatherDesc.index`',
-    'nearest_area',
-    '`root_nearest_area.index`',
-    '`root_nearest_area.id`',
-    '`root_nearest_arearoot_nearest_area.val.areaName.id`',
-    '`root_nearest_arearoot_nearest_area.val.areaName.index`',
-    '`root_nearest_arearoot_nearest_area.val.areaNameroot_nearest_area.val.country.id`',
-    '`root_nearest_arearoot_nearest_area.val.areaNameroot_nearest_area.val.country.index`',
-]
+def optional_arg(name, default):
+    return getResolvedOptions(sys.argv, [name])[name] if f'--{name}' in sys.argv else default
 
 
-# Create timestamp column
-flatRootDf = flatRootDf.drop_fields(cols_to_drop).toDF()
-flatRootDf = flatRootDf.withColumn('localObsTimeStamp', to_timestamp(
-    flatRootDf['`current_condition.val.localObsDateTime`'], 'yyyy-MM-dd h:mm a'))
-flatRootDf = flatRootDf.withColumn(
-    'localObsDate', to_date('localObsTimeStamp'))
-
-flatRootDf = DynamicFrame.fromDF(flatRootDf, glueContext, name='curatedData')
-result = flatRootDf = ApplyMapping.apply(frame=flatRootDf, mappings=[
-    ("id", "`id`", "long"),
-    ("index", "`index`", "int"),
-    ("localObsTimeStamp", "`localObsTimeStamp`", "timestamp"),
-    ("localObsDate", "`localObsDate`", "date"),
-    ("`current_condition.val.FeelsLikeC`", "FeelsLikeC", "int"),
-    ("`current_condition.val.FeelsLikeF`", "FeelsLikeF", "int"),
-    ("`current_condition.val.cloudcover`", "cloudcover", "int"),
-    ("`current_condition.val.humidity`", "humidity", "int"),
-    ("`current_condition.val.precipInches`", "precipInches", "float"),
-    ("`current_condition.val.precipMM`", "precipMM", "float"),
-    ("`current_condition.val.pressure`", "pressure", "int"),
-    ("`current_condition.val.pressureInches`", "pressureInches", "int"),
-    ("`current_condition.val.temp_C`", "temp_C", "int"),
-    ("`current_condition.val.temp_F`", "temp_F", "int"),
-    ("`current_condition.val.uvIndex`", "uvIndex", "int"),
-    ("`current_condition.val.visibility`", "visibility", "int"),
-    ("`current_condition.val.visibilityMiles`", "visibilityMiles", "int"),
-    ("`current_condition.val.winddirDegree`", "winddirDegree", "int"),
-    ("`current_condition.val.windspeedKmph`", "windspeedKmph", "int"),
-    ("`current_condition.val.windspeedMiles`", "windspeedMiles", "int"),
-    ("`nearest_area.val.areaName.val.value`", "areaName", "string"),
-    ("`nearest_area.val.region.val.value`", "region", "string"),
-    ("`nearest_area.val.country.val.value`", "country", "string"),
-    ("`nearest_area.val.latitude`", "latitude", "float"),
-    ("`nearest_area.val.longitude`", "longitude", "float"),
-    ("`nearest_area.val.population`", "population", "long"),
-])
-
-# Write parquet files to s3 - partitioned by areaName
-glueContext.write_dynamic_frame.from_options(
-    frame=result,
-    connection_type='s3',
-    connection_options={
-        'path': GLUE_OUTPUT_DIR,
-        'partitionKeys': [
-            'areaName',
-            'localObsDate'
-        ]
-    },
-    format='parquet'
-)
+# Optional args, the relationalize engine is used unless --engine arrow or
+# --engine spark is passed
+ENGINE = optional_arg('engine', 'relationalize')
+GLUE_RAW_DIR = optional_arg('rawDir', None)
+
+# Incremental processing: only raw objects newer than the persisted watermark
+# are read, and only the partitions they touch are rewritten. Without a
+# watermark path, or with --fullRebuild true, everything is rebuilt.
+GLUE_WATERMARK_PATH = optional_arg('watermarkPath', None)
+FULL_REBUILD = GLUE_WATERMARK_PATH is None or optional_arg('fullRebuild', 'false').lower() == 'true'
+
+PARTITION_KEYS = weather_schema.PARTITION_KEYS
+
+# Sharded runs, see shards.py: only the partitions of the areas of the shard
+# are written, the areas being a hash range (--shardIndex of --shardCount) or
+# a list (--shardAreas, comma separated areaName values). Instead of moving
+# the watermark, a shard started by the workflow records a marker under
+# --shardStateDir for the final verify step.
+SHARD = shards.parse_shard(optional_arg('shardIndex', None), optional_arg('shardCount', None),
+                           optional_arg('shardAreas', None))
+GLUE_SHARD_STATE_DIR = optional_arg('shardStateDir', None)
+# Passed by Glue to the jobs started by a workflow
+WORKFLOW_RUN_ID = optional_arg('WORKFLOW_RUN_ID', None)
+
+# Output layout: parquet codec, target file and row group sizes, and whether
+# fragmented partitions are rewritten after the write
+PARQUET_CODEC = optional_arg('parquetCodec', 'snappy')
+TARGET_FILE_BYTES = int(optional_arg('targetFileSizeMb', '128')) * 1024 * 1024
+ROW_GROUP_BYTES = int(optional_arg('rowGroupSizeMb', '64')) * 1024 * 1024
+OPTIMIZE_LAYOUT = optional_arg('optimizeLayout', 'false').lower() == 'true'
+
+# Forecast fact table exploded from weather[].hourly[] in the same scan, only
+# written when an output dir is passed
+GLUE_FORECAST_OUTPUT_DIR = optional_arg('forecastOutputDir', None)
+
+# Daily and monthly rollups per areaName, see rollups.py. Only the months
+# touched by new observations are recomputed, a full rebuild or
+# --rollupsBackfill true recomputes every month from the curated table.
+GLUE_ROLLUP_DAILY_DIR = optional_arg('rollupDailyOutputDir', None)
+GLUE_ROLLUP_MONTHLY_DIR = optional_arg('rollupMonthlyOutputDir', None)
+ROLLUPS_BACKFILL = optional_arg('rollupsBackfill', 'false').lower() == 'true'
+
+# Every stage emits its duration as an EMF log line, see instrumentation.py.
+# With --detailedMetrics true the rows of each stage are counted inside its
+# phase: this forces Spark to evaluate the stage there, so its time is
+# attributed to it, at the cost of extra passes over the data. With
+# --profile true the driver is profiled with cProfile.
+METRICS_SERVICE = 'etl_job'
+DETAILED_METRICS = optional_arg('detailedMetrics', 'false').lower() == 'true'
+PROFILE = optional_arg('profile', 'false').lower() == 'true'
+
+
+def shard_condition():
+    # shards.owns as a condition on the areaName column
+    if SHARD.areas is not None:
+        return col('areaName').isin(list(SHARD.areas))
+    return crc32(encode(coalesce(col('areaName'), lit('')), 'UTF-8')) % SHARD.count == SHARD.index
+
+
+def overwrite_mode():
+    # A full rebuild replaces the whole output, unless other shards write parts of it
+    return 'static' if SHARD is None else 'dynamic'
+
+
+def count_rows(metrics, frame):
+    if DETAILED_METRICS:
+        metrics['Rows'] = frame.count()
+
+
+def flatten_with_relationalize(paths=None):
+    import incremental
+
+    connection_options = incremental.raw_connection_options(paths, GLUE_RAW_DIR)
+    with instrumentation.phase(METRICS_SERVICE, 'read') as metrics:
+        if connection_options is None:
+            # Read from Glue table
+            wttrDf = glueContext.create_dynamic_frame.from_catalog(
+                database=GLUE_SRC_DB, table_name=GLUE_SRC_TBL)
+        else:
+            # Read the given raw objects, or every raw object on a full rebuild
+            wttrDf = glueContext.create_dynamic_frame.from_options(
+                connection_type='s3',
+                connection_options=connection_options,
+                format='json')
+        count_rows(metrics, wttrDf)
+    # wttrDf.printSchema()
+
+    # The raw rows are kept so the forecast table is built from the same read
+    forecastDf = None
+    if GLUE_FORECAST_OUTPUT_DIR is not None:
+        rawDf = wttrDf.toDF().persist()
+        wttrDf = DynamicFrame.fromDF(rawDf, glueContext, name='rawData')
+        forecastDf = spark_flatten.forecast_df(rawDf)
+
+    # Relationalize to flatten the schema
+    with instrumentation.phase(METRICS_SERVICE, 'relationalize') as metrics:
+        dfc = wttrDf.relationalize('root', GLUE_TMP_STORAGE)
+        metrics['Tables'] = len(dfc.keys())
+
+    rootDf = dfc.select('root')
+    currentConditionDf = dfc.select('root_current_condition')
+    nearestAreaDf = dfc.select('root_nearest_area')
+
+    # Flatten current_condition
+    # Get weatherDesc
+    currentConditionWeatherDesc = dfc.select(
+        'root_current_condition.val.weatherDesc')
+
+    # Join current_condition and current_condition.val.weatherDesc
+    with instrumentation.phase(METRICS_SERVICE, 'join_current_condition') as metrics:
+        flatCurrentConditionDf = Join.apply(currentConditionDf, currentConditionWeatherDesc, '`current_condition.val.weatherDesc`', 'id').drop_fields([
+            '`current_condition.val.weatherDesc`', '`current_condition.val.weatherIconUrl`'])
+        count_rows(metrics, flatCurrentConditionDf)
+
+    # Flatten nearest_area
+    # Get areaName
+    nearestAreaAreaNameDf = dfc.select('root_nearest_area.val.areaName')
+
+    # Get country
+    nearestAreaCountryDf = dfc.select('root_nearest_area.val.country')
+
+    # Get region
+    nearestAreaRegionDf = dfc.select('root_nearest_area.val.region')
+
+    # Join everything together
+    with instrumentation.phase(METRICS_SERVICE, 'join_nearest_area') as metrics:
+        flatNearestAreaDf = Join.apply(Join.apply(Join.apply(nearestAreaDf, nearestAreaAreaNameDf, '`nearest_area.val.areaName`', 'id'), nearestAreaCountryDf, '`nearest_area.val.country`', 'id'),
+                                       nearestAreaRegionDf, '`nearest_area.val.region`', 'id').drop_fields(['`nearest_area.val.areaName`', '`nearest_area.val.country`', '`nearest_area.val.region`', '`nearest_area.val.weatherUrl`'])
+        count_rows(metrics, flatNearestAreaDf)
+
+    # Bring everything together to a flat df
+    # Create root df
+    rootDf = dfc.select('root')
+    rootDf = rootDf.drop_fields(['request', 'weather'])
+
+    # Join rootDf with flatCurrentConditionDf and flatNearestAreaDf
+    with instrumentation.phase(METRICS_SERVICE, 'join_root') as metrics:
+        flatRootDf = Join.apply(Join.apply(rootDf, flatCurrentConditionDf, 'current_condition',
+                                '`root_current_condition.id`'), flatNearestAreaDf, 'nearest_area', '`root_nearest_area.id`')
+        count_rows(metrics, flatRootDf)
+    flatRootDf.printSchema()
+
+    cols_to_drop = [
+        'current_condition',
+        '`root_current_condition.id`',
+        '`root_current_condition.index`',
+        '`rootroot_current_conditionroot_current_condition.val.weatherDesc.id`',
+        '`rootroot_current_conditionroot_current_condition.val.weatherDesc.index`',
+        'nearest_area',
+        '`root_nearest_area.index`',
+        '`root_nearest_area.id`',
+        '`root_nearest_arearoot_nearest_area.val.areaName.id`',
+        '`root_nearest_arearoot_nearest_area.val.areaName.index`',
+        '`root_nearest_arearoot_nearest_area.val.areaNameroot_nearest_area.val.country.id`',
+        '`root_nearest_arearoot_nearest_area.val.areaNameroot_nearest_area.val.country.index`',
+    ]
+
+
+    # Create timestamp column
+    flatRootDf = flatRootDf.drop_fields(cols_to_drop).toDF()
+    flatRootDf = flatRootDf.withColumn('localObsTimeStamp', to_timestamp(
+        flatRootDf['`current_condition.val.localObsDateTime`'], 'yyyy-MM-dd h:mm a'))
+    flatRootDf = flatRootDf.withColumn(
+        'localObsDate', to_date('localObsTimeStamp'))
+
+    flatRootDf = DynamicFrame.fromDF(flatRootDf, glueContext, name='curatedData')
+    with instrumentation.phase(METRICS_SERVICE, 'apply_mapping') as metrics:
+        curated = apply_mapping(flatRootDf)
+        count_rows(metrics, curated)
+
+    return curated, forecastDf
+
+
+def apply_mapping(flatRootDf):
+    # The mappings are generated from the curated columns of weather_schema.py
+    return ApplyMapping.apply(frame=flatRootDf, mappings=weather_schema.apply_mapping())
+
+
+def raw_input_paths(paths):
+    # The given raw objects, or the whole raw zone when everything is read
+    if paths:
+        return paths
+    if GLUE_RAW_DIR is None:
+        raise ValueError(f'The {ENGINE} engine reads the raw objects from --rawDir, which is not set')
+    return [GLUE_RAW_DIR]
+
+
+def flatten_with_arrow(paths=None):
+    # Flatten every raw object in one pass with PyArrow, without
+    # relationalize, its temp dir or any joins
+    import arrow_flatten
+
+    def flatten_partition(files):
+        records = (record for _, content in files
+                   for record in arrow_flatten.load_records(content))
+        for record_id, record in enumerate(records, start=1):
+            if GLUE_FORECAST_OUTPUT_DIR is None:
+                row, forecast_rows = arrow_flatten.flatten_record(record, record_id), []
+            else:
+                row, forecast_rows = arrow_flatten.flatten_record_with_forecast(record, record_id)
+            yield 'current', row
+            for forecast_row in forecast_rows:
+                yield 'forecast', forecast_row
+
+    # Read raw bytes so both hourly and gzipped compacted objects can be
+    # decoded. Rows of both tables come from this single, persisted scan.
+    with instrumentation.phase(METRICS_SERVICE, 'read_flatten') as metrics:
+        # Raw objects sit in location=/date=/hour= directories under the raw
+        # zone, which binaryFiles only lists with recursive input directories
+        sc._jsc.hadoopConfiguration().set('mapreduce.input.fileinputformat.input.dir.recursive', 'true')
+        rows = sc.binaryFiles(','.join(raw_input_paths(paths))).mapPartitions(flatten_partition).persist()
+        count_rows(metrics, rows)
+
+    def table_df(table, schema):
+        return spark.createDataFrame(
+            rows.filter(lambda row: row[0] == table).map(lambda row: row[1]),
+            StructType.fromJson(spark_flatten.arrow_schema_to_spark_json(schema)))
+
+    curatedDf = table_df('current', arrow_flatten.CURATED_SCHEMA)
+    forecastDf = None
+    if GLUE_FORECAST_OUTPUT_DIR is not None:
+        forecastDf = table_df('forecast', arrow_flatten.FORECAST_SCHEMA)
+
+    return DynamicFrame.fromDF(curatedDf, glueContext, name='curatedData'), forecastDf
+
+
+def flatten_with_spark(paths=None):
+    # Parse the raw objects with the explicit schema of spark_flatten.py and
+    # select the curated columns from the nested fields, without crawler
+    # schema inference, relationalize or joins
+    with instrumentation.phase(METRICS_SERVICE, 'read') as metrics:
+        rawDf = spark_flatten.read_raw(spark, raw_input_paths(paths))
+        if GLUE_FORECAST_OUTPUT_DIR is not None:
+            rawDf = rawDf.persist()
+        count_rows(metrics, rawDf)
+
+    curatedDf = spark_flatten.curated_df(rawDf)
+    forecastDf = None
+    if GLUE_FORECAST_OUTPUT_DIR is not None:
+        forecastDf = spark_flatten.forecast_df(rawDf)
+
+    return DynamicFrame.fromDF(curatedDf, glueContext, name='curatedData'), forecastDf
+
+
+def select_raw_paths():
+    # Returns the raw object urls to process (None meaning everything) and the
+    # watermark to persist after a successful write
+    import boto3
+    import incremental
+
+    s3 = boto3.client('s3')
+    raw_bucket, raw_prefix = incremental.split_s3_url(GLUE_RAW_DIR)
+
+    with instrumentation.phase(METRICS_SERVICE, 'select_raw_paths') as metrics:
+        watermark = incremental.EMPTY_WATERMARK
+        if not FULL_REBUILD:
+            watermark = incremental.load_watermark(
+                s3, *incremental.split_s3_url(GLUE_WATERMARK_PATH))
+
+        new_objects, new_watermark = incremental.select_new_objects(
+            incremental.list_raw_objects(s3, raw_bucket, raw_prefix), watermark, FULL_REBUILD)
+        metrics['Objects'] = len(new_objects)
+        # pyspark.sql.functions shadows the builtin sum
+        metrics['RawBytes'] = builtins.sum(s3_object.get('Size', 0) for s3_object in new_objects)
+    print(f'{len(new_objects)} raw objects to process')
+
+    if FULL_REBUILD:
+        return None, new_watermark
+    return [f's3://{raw_bucket}/{s3_object["Key"]}' for s3_object in new_objects], new_watermark
+
+
+def merge_affected_partitions(newDf, output_dir, unique_keys):
+    # Union the new rows with the rows already stored in the partitions they
+    # touch, so those partitions can be rewritten without duplicates. This
+    # also replaces the small files appended by transform_raw.py.
+    import incremental
+
+    with instrumentation.phase(METRICS_SERVICE, 'affected_partitions', {'OutputDir': output_dir}) as metrics:
+        partitions = incremental.affected_partitions(
+            newDf.select(*PARTITION_KEYS).distinct().collect(), PARTITION_KEYS)
+        metrics['Partitions'] = len(partitions)
+    print(f'Rewriting {len(partitions)} partitions')
+
+    try:
+        existingDf = spark.read.parquet(output_dir)
+    except Exception:
+        # Nothing has been written yet
+        return newDf.dropDuplicates(unique_keys), partitions
+
+    affectedDf = spark.createDataFrame(partitions, PARTITION_KEYS)
+    existingDf = existingDf.join(broadcast(affectedDf), PARTITION_KEYS, 'inner')
+    mergedDf = existingDf.unionByName(newDf.select(*existingDf.columns)).dropDuplicates(unique_keys)
+
+    # Materialise the merged rows before their source files are overwritten
+    return mergedDf.localCheckpoint(), partitions
+
+
+def write_incremental(newDf, output_dir, unique_keys):
+    # Returns the (areaName, localObsDate) partitions that were rewritten
+    if newDf.rdd.isEmpty():
+        print(f'No new rows to write to {output_dir}')
+        return []
+
+    spark.conf.set('spark.sql.sources.partitionOverwriteMode', 'dynamic')
+    mergedDf, partitions = merge_affected_partitions(newDf, output_dir, unique_keys)
+    write_output(mergedDf, output_dir, unique_keys[1:])
+
+    return partitions
+
+
+def write_output(df, output_dir, sort_columns):
+    # One task per partition writes files of about TARGET_FILE_BYTES, sorted
+    # by the sort columns
+    import parquet_layout
+    import pyarrow as pa
+
+    sample = df.limit(10000).collect()
+    row_bytes = parquet_layout.estimate_row_bytes(
+        pa.Table.from_pylist([row.asDict() for row in sample]), PARQUET_CODEC) if sample else parquet_layout.DEFAULT_ROW_BYTES
+
+    spark.conf.set('parquet.block.size', str(ROW_GROUP_BYTES))
+    with instrumentation.phase(METRICS_SERVICE, 'write', {'OutputDir': output_dir}) as metrics:
+        count_rows(metrics, df)
+        metrics['EstimatedRowBytes'] = row_bytes
+        df.repartition(*PARTITION_KEYS) \
+            .sortWithinPartitions(*PARTITION_KEYS, *sort_columns) \
+            .write.mode('overwrite') \
+            .option('compression', PARQUET_CODEC) \
+            .option('maxRecordsPerFile', parquet_layout.rows_per_file(row_bytes, TARGET_FILE_BYTES)) \
+            .partitionBy(*PARTITION_KEYS) \
+            .parquet(output_dir)
+
+
+def update_rollups(months=None):
+    # Recomputes the daily and monthly rollups of the given (areaName,
+    # localObsMonth) pairs from the curated table, or of every month
+    import functools
+    import rollups
+
+    curatedDf = spark.read.parquet(GLUE_OUTPUT_DIR)
+
+    if months is None:
+        if SHARD is not None:
+            curatedDf = curatedDf.where(shard_condition())
+        spark.conf.set('spark.sql.sources.partitionOverwriteMode', overwrite_mode())
+    else:
+        # Filters on the partition columns, so only the affected months are read
+        conditions = []
+        for area_name, month in months:
+            first_day, next_first_day = rollups.month_bounds(month)
+            conditions.append((col('areaName') == area_name) &
+                              (col('localObsDate') >= lit(first_day)) &
+                              (col('localObsDate') < lit(next_first_day)))
+        curatedDf = curatedDf.where(functools.reduce(lambda left, right: left | right, conditions))
+        spark.conf.set('spark.sql.sources.partitionOverwriteMode', 'dynamic')
+
+    with instrumentation.phase(METRICS_SERVICE, 'rollups') as metrics:
+        dailyDf = rollups.daily_rollup(curatedDf).persist()
+        monthlyDf = rollups.monthly_rollup(dailyDf)
+
+        for df, output_dir, keys in ((dailyDf, GLUE_ROLLUP_DAILY_DIR, rollups.DAILY_KEYS),
+                                     (monthlyDf, GLUE_ROLLUP_MONTHLY_DIR, rollups.MONTHLY_KEYS)):
+            df.repartition(*rollups.PARTITION_KEYS) \
+                .sortWithinPartitions(*keys) \
+                .write.mode('overwrite') \
+                .option('compression', PARQUET_CODEC) \
+                .partitionBy(*rollups.PARTITION_KEYS) \
+                .parquet(output_dir)
+
+        metrics['Months'] = len(months) if months is not None else monthlyDf.count()
+        count_rows(metrics, dailyDf)
+        dailyDf.unpersist()
+
+
+def optimize_layout(output_dir):
+    # Rewrite partitions left fragmented by earlier runs
+    import parquet_layout
+    from pyarrow import fs
+
+    filesystem, root = fs.FileSystem.from_uri(output_dir)
+    with instrumentation.phase(METRICS_SERVICE, 'optimize_layout', {'OutputDir': output_dir}) as metrics:
+        partition_dirs = None
+        if SHARD is not None:
+            partition_dirs = {partition_dir for partition_dir in parquet_layout.list_partition_files(
+                filesystem, root.rstrip('/')) if shards.owns(SHARD, shards.partition_area(partition_dir))}
+        optimized = parquet_layout.optimize(
+            filesystem, root.rstrip('/'), PARQUET_CODEC, TARGET_FILE_BYTES, ROW_GROUP_BYTES, partition_dirs)
+        metrics['Partitions'] = len(optimized)
+    print(f'Optimized {len(optimized)} fragmented partitions')
+
+
+# Output dirs with the columns that identify a row: the fetch, plus the
+# forecast time for the forecast table
+outputs = [(GLUE_OUTPUT_DIR, ['areaName', 'localObsTimeStamp'])]
+if GLUE_FORECAST_OUTPUT_DIR is not None:
+    outputs.append((GLUE_FORECAST_OUTPUT_DIR, ['areaName', 'localObsTimeStamp', 'forecastTime']))
+
+with instrumentation.phase(METRICS_SERVICE, 'job', {'Engine': ENGINE}), \
+        instrumentation.profiled(PROFILE, 'job_script'):
+    raw_paths, new_watermark = (None, None) if GLUE_RAW_DIR is None else select_raw_paths()
+
+    if raw_paths == []:
+        result = None
+    elif ENGINE == 'arrow':
+        result, forecastDf = flatten_with_arrow(raw_paths)
+    elif ENGINE == 'spark':
+        result, forecastDf = flatten_with_spark(raw_paths)
+    else:
+        result, forecastDf = flatten_with_relationalize(raw_paths)
+
+    # Curated partitions rewritten by an incremental run
+    curated_partitions = []
+
+    if result is None:
+        print('No new raw objects since the last run')
+    else:
+        for (output_dir, unique_keys), df in zip(outputs, [result.toDF(), forecastDf]):
+            if SHARD is not None:
+                # The rows of other areas are written by their shards
+                df = df.where(shard_condition())
+            if FULL_REBUILD:
+                if output_dir == GLUE_OUTPUT_DIR and df.rdd.isEmpty():
+                    # A static overwrite would replace the curated table with nothing
+                    raise RuntimeError('The full rebuild read no raw rows, the curated output is left as is')
+                # Write parquet files to s3 - partitioned by areaName
+                # Historical raw data can hold the same observation several times
+                spark.conf.set('spark.sql.sources.partitionOverwriteMode', overwrite_mode())
+                write_output(df.dropDuplicates(unique_keys), output_dir, unique_keys[1:])
+            else:
+                partitions = write_incremental(df, output_dir, unique_keys)
+                if output_dir == GLUE_OUTPUT_DIR:
+                    curated_partitions = partitions
+
+    if GLUE_ROLLUP_DAILY_DIR is not None and GLUE_ROLLUP_MONTHLY_DIR is not None:
+        import rollups
+
+        if FULL_REBUILD or ROLLUPS_BACKFILL:
+            update_rollups()
+        elif curated_partitions:
+            update_rollups(rollups.affected_months(curated_partitions))
+
+    if OPTIMIZE_LAYOUT:
+        for output_dir, _ in outputs:
+            optimize_layout(output_dir)
+
+if SHARD is not None:
+    if GLUE_SHARD_STATE_DIR is not None and WORKFLOW_RUN_ID is not None:
+        import boto3
+        import incremental
+
+        state_bucket, state_prefix = incremental.split_s3_url(GLUE_SHARD_STATE_DIR)
+        shards.save_marker(boto3.client('s3'), state_bucket, shards.marker_key(state_prefix, WORKFLOW_RUN_ID, SHARD),
+                           SHARD, new_watermark, curated_partitions)
+    else:
+        print(f'Shard {shards.shard_name(SHARD)} ran outside of a workflow, the watermark is not moved')
+elif GLUE_WATERMARK_PATH is not None and new_watermark is not None:
+    import boto3
+    import incremental
+
+    incremental.save_watermark(boto3.client('s3'), *incremental.split_s3_url(GLUE_WATERMARK_PATH),
+                               new_watermark)
+
 job.commit()
@@ -0,0 +1,139 @@
+import io
+import os
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+# Layout of the curated parquet data: files of roughly TARGET_FILE_BYTES with
+# rows sorted by SORT_COLUMN inside each areaName/localObsDate partition
+TARGET_FILE_BYTES = 128 * 1024 * 1024
+ROW_GROUP_BYTES = 64 * 1024 * 1024
+SORT_COLUMN = 'localObsTimeStamp'
+CODECS = ('snappy', 'zstd', 'gzip', 'none')
+DEFAULT_CODEC = 'snappy'
+
+# Used when there are no rows to measure
+DEFAULT_ROW_BYTES = 64
+
+
+def estimate_row_bytes(table, codec=DEFAULT_CODEC):
+    # Measure the encoded size of the rows with the given codec
+    if table.num_rows == 0:
+        return DEFAULT_ROW_BYTES
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=codec)
+
+    return max(1, buffer.tell() // table.num_rows)
+
+
+def rows_per_file(row_bytes, target_file_bytes=TARGET_FILE_BYTES):
+    return max(1, target_file_bytes // row_bytes)
+
+
+def sort_rows(table):
+    if SORT_COLUMN not in table.column_names:
+        return table
+    return table.sort_by([(SORT_COLUMN, 'ascending')])
+
+
+def microsecond_timestamps(table):
+    # Spark's INT96 timestamps are read as nanoseconds, which Spark 3.1 and
+    # Athena cannot read back once written as INT64
+    schema = pa.schema([field.with_type(pa.timestamp('us', field.type.tz))
+                        if pa.types.is_timestamp(field.type) else field for field in table.schema])
+    return table if schema == table.schema else table.cast(schema)
+
+
+def write_partition(table, filesystem, partition_dir, codec=DEFAULT_CODEC,
+                    target_file_bytes=TARGET_FILE_BYTES, row_group_bytes=ROW_GROUP_BYTES, run_id=None):
+    # Writes the sorted rows as evenly sized files and returns their paths.
+    # The run id is part of the file names, a random one is used by default.
+    if codec not in CODECS:
+        raise ValueError(f'Unsupported parquet codec {codec}, expected one of {CODECS}')
+
+    table = sort_rows(table)
+    row_bytes = estimate_row_bytes(table, codec)
+    file_rows = rows_per_file(row_bytes, target_file_bytes)
+    row_group_rows = min(file_rows, rows_per_file(row_bytes, row_group_bytes))
+
+    filesystem.create_dir(partition_dir, recursive=True)
+    run_id = run_id or uuid.uuid4().hex
+    paths = []
+
+    for number, offset in enumerate(range(0, max(table.num_rows, 1), file_rows)):
+        path = f'{partition_dir}/part-{number:05d}-{run_id}.{codec}.parquet'
+        with filesystem.open_output_stream(path) as stream:
+            pq.write_table(table.slice(offset, file_rows), stream,
+                           compression=codec, row_group_size=row_group_rows,
+                           coerce_timestamps='us', allow_truncated_timestamps=True)
+        paths.append(path)
+
+    return paths
+
+
+def filesystem_from_uri(uri, endpoint_url=None):
+    # Local paths and s3:// URIs, endpoint_url points S3 at a local stand-in
+    if endpoint_url and uri.startswith('s3://'):
+        scheme, _, endpoint = endpoint_url.partition('://')
+        filesystem = fs.S3FileSystem(endpoint_override=endpoint, scheme=scheme)
+        return filesystem, uri[len('s3://'):].rstrip('/')
+
+    filesystem, path = fs.FileSystem.from_uri(uri if '://' in uri else os.path.abspath(uri))
+    return filesystem, path.rstrip('/')
+
+
+def list_partition_files(filesystem, root):
+    # Groups the parquet files under root by the directory they are in
+    partitions = {}
+
+    for file_info in filesystem.get_file_info(fs.FileSelector(root, recursive=True)):
+        if file_info.type == fs.FileType.File and file_info.path.endswith('.parquet'):
+            partition_dir = file_info.path.rsplit('/', 1)[0]
+            partitions.setdefault(partition_dir, []).append(file_info)
+
+    return partitions
+
+
+def is_fragmented(file_infos, target_file_bytes=TARGET_FILE_BYTES):
+    # More files than the partition's size needs
+    total_bytes = sum(file_info.size for file_info in file_infos)
+    needed_files = max(1, -(-total_bytes // target_file_bytes))
+
+    return len(file_infos) > needed_files
+
+
+def optimize_partition(filesystem, partition_dir, file_infos, codec=DEFAULT_CODEC,
+                       target_file_bytes=TARGET_FILE_BYTES, row_group_bytes=ROW_GROUP_BYTES):
+    # The new files are written before the old ones are deleted, so readers
+    # never see a partition without its rows
+    old_paths = [file_info.path for file_info in file_infos]
+    table = pa.concat_tables(
+        [microsecond_timestamps(pq.read_table(path, filesystem=filesystem)) for path in old_paths])
+
+    new_paths = write_partition(table, filesystem, partition_dir, codec,
+                                target_file_bytes, row_group_bytes)
+
+    for path in old_paths:
+        filesystem.delete_file(path)
+
+    return new_paths
+
+
+def optimize(filesystem, root, codec=DEFAULT_CODEC, target_file_bytes=TARGET_FILE_BYTES,
+             row_group_bytes=ROW_GROUP_BYTES, partition_dirs=None):
+    # Rewrites the fragmented partitions under root, optionally limited to
+    # the given partition directories
+    optimized = []
+
+    for partition_dir, file_infos in sorted(list_partition_files(filesystem, root).items()):
+        if partition_dirs is not None and partition_dir not in partition_dirs:
+            continue
+        if is_fragmented(file_infos, target_file_bytes):
+            optimize_partition(filesystem, partition_dir, file_infos, codec,
+                               target_file_bytes, row_group_bytes)
+            optimized.append(partition_dir)
+
+    return optimized
@@ -0,0 +1,85 @@
+from datetime import date
+
+# Daily and monthly rollups of the curated observations per areaName. Both
+# tables are partitioned by areaName and localObsMonth, so new observations
+# only cause the months they fall in to be recomputed.
+PARTITION_KEYS = ['areaName', 'localObsMonth']
+DAILY_KEYS = ['areaName', 'localObsMonth', 'localObsDate']
+MONTHLY_KEYS = ['areaName', 'localObsMonth']
+
+# (rollup column, aggregate, curated column) of the daily rollup. Sums and
+# counts are stored next to the means so monthly rollups (and rollups of any
+# other range) can be computed from the daily rows without the observations.
+DAILY_AGGREGATES = [
+    ('observations', 'count', 'localObsTimeStamp'),
+    ('minTempC', 'min', 'temp_C'),
+    ('maxTempC', 'max', 'temp_C'),
+    ('sumTempC', 'sum', 'temp_C'),
+    ('countTempC', 'count', 'temp_C'),
+    ('totalPrecipMM', 'sum', 'precipMM'),
+    ('sumHumidity', 'sum', 'humidity'),
+    ('countHumidity', 'count', 'humidity'),
+    ('minWindspeedKmph', 'min', 'windspeedKmph'),
+    ('maxWindspeedKmph', 'max', 'windspeedKmph'),
+    ('sumWindspeedKmph', 'sum', 'windspeedKmph'),
+    ('countWindspeedKmph', 'count', 'windspeedKmph'),
+]
+
+# How each daily aggregate is rolled up again
+REAGGREGATE = {'min': 'min', 'max': 'max', 'sum': 'sum', 'count': 'sum'}
+
+MONTHLY_AGGREGATES = [(column, REAGGREGATE[aggregate], column)
+                      for column, aggregate, _ in DAILY_AGGREGATES]
+
+# (mean column, sum column, count column), computed after each rollup
+MEANS = [
+    ('meanTempC', 'sumTempC', 'countTempC'),
+    ('meanHumidity', 'sumHumidity', 'countHumidity'),
+    ('meanWindspeedKmph', 'sumWindspeedKmph', 'countWindspeedKmph'),
+]
+
+
+def affected_months(partitions):
+    # (areaName, localObsMonth) pairs of the (areaName, localObsDate)
+    # partitions of the curated table
+    return sorted({(area_name, obs_date.strftime('%Y-%m')) for area_name, obs_date in partitions
+                   if area_name is not None and obs_date is not None})
+
+
+def month_bounds(month):
+    # First day of the month and of the next month, so filters on the
+    # localObsDate partitions of the curated table prune the other days
+    year, month_number = (int(part) for part in month.split('-'))
+    next_year, next_month = (year + 1, 1) if month_number == 12 else (year, month_number + 1)
+
+    return date(year, month_number, 1), date(next_year, next_month, 1)
+
+
+def spark_rollup(df, keys, aggregates):
+    # Only the ETL job and its tests have pyspark, the other users of this
+    # module only need the keys and months
+    from pyspark.sql import functions
+
+    rollup_df = df.groupBy(*keys).agg(*[
+        getattr(functions, function)(functions.col(source)).alias(column)
+        for column, function, source in aggregates])
+
+    for mean, total, count in MEANS:
+        rollup_df = rollup_df.withColumn(
+            mean, functions.col(total).cast('double') / functions.col(count).cast('double'))
+
+    return rollup_df
+
+
+def daily_rollup(curated_df):
+    # curated_df holds the observations of whole months
+    from pyspark.sql.functions import col, date_format
+
+    curated_df = curated_df.where(col('localObsDate').isNotNull()) \
+        .withColumn('localObsMonth', date_format('localObsDate', 'yyyy-MM'))
+
+    return spark_rollup(curated_df, DAILY_KEYS, DAILY_AGGREGATES)
+
+
+def monthly_rollup(daily_df):
+    return spark_rollup(daily_df, MONTHLY_KEYS, MONTHLY_AGGREGATES)
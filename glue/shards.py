@@ -0,0 +1,119 @@
+import json
+import zlib
+from collections import namedtuple
+from urllib.parse import unquote
+
+import weather_schema
+
+# Sharded ETL runs: each shard owns a set of areaName values, given either as
+# an explicit list or as a bucket of a stable hash of the name, and only
+# writes the curated, forecast and rollup partitions of those areas. Every
+# shard reads the new raw objects (a location's areaName is only known once
+# it is flattened) and drops the rows of other areas right away.
+#
+# Shards run concurrently, so none of them moves the raw watermark. Each one
+# records a marker with the watermark it processed up to, and a final step
+# checks that every shard of the workflow run completed before it saves the
+# earliest of those watermarks: raw objects only some shards saw are read
+# again by the next run, and deduplicated by the merge.
+Shard = namedtuple('Shard', ['index', 'count', 'areas'])
+
+
+def parse_shard(index=None, count=None, areas=None):
+    # None when the job is not sharded
+    if areas:
+        return Shard(None, None, tuple(sorted(area.strip() for area in areas.split(',') if area.strip())))
+    if index is None and count is None:
+        return None
+
+    if index is None or count is None:
+        raise ValueError('A hash shard needs both a shard index and a shard count')
+    index, count = int(index), int(count)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f'Invalid shard {index} of {count}, the index must be in [0, count)')
+
+    return Shard(index, count, None)
+
+
+def area_hash(area_name):
+    # Same value as crc32(encode(coalesce(areaName, ''), 'UTF-8')) in Spark SQL
+    return zlib.crc32((area_name or '').encode('utf-8'))
+
+
+def shard_of(area_name, count):
+    return area_hash(area_name) % count
+
+
+def owns(shard, area_name):
+    if shard is None:
+        return True
+    if shard.areas is not None:
+        return area_name in shard.areas
+    return shard_of(area_name, shard.count) == shard.index
+
+
+def shard_name(shard):
+    if shard.areas is not None:
+        # Explicit area lists are ad hoc runs, named after their areas
+        return 'areas-' + format(zlib.crc32('\n'.join(shard.areas).encode('utf-8')), '08x')
+    return f'shard-{shard.index:03d}-of-{shard.count:03d}'
+
+
+def partition_area(partition_dir):
+    # areaName of a curated partition directory written by Spark, None for the default partition
+    for part in partition_dir.split('/'):
+        if part.startswith('areaName='):
+            value = part.split('=', 1)[1]
+            return None if value == weather_schema.NULL_PARTITION else unquote(value)
+    return None
+
+
+def marker_key(prefix, run_id, shard):
+    return f'{prefix.rstrip("/")}/{run_id}/{shard_name(shard)}.json'
+
+
+def save_marker(s3, bucket, key, shard, watermark, partitions):
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps({
+            'shard': shard._asdict(),
+            'watermark': watermark,
+            'partitions': [[str(value) for value in partition] for partition in partitions],
+        }).encode('utf-8'),
+        ContentType='application/json',
+    )
+
+
+def load_markers(s3, bucket, prefix, run_id):
+    markers = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f'{prefix.rstrip("/")}/{run_id}/'):
+        for s3_object in page.get('Contents', []):
+            body = s3.get_object(Bucket=bucket, Key=s3_object['Key'])['Body'].read()
+            markers[s3_object['Key'].rsplit('/', 1)[-1][:-len('.json')]] = json.loads(body)
+    return markers
+
+
+def missing_shards(markers, count):
+    return [name for name in (shard_name(Shard(index, count, None)) for index in range(count))
+            if name not in markers]
+
+
+def earliest_watermark(watermarks):
+    # Raw objects up to the earliest mark were seen by every shard. Shards
+    # that stopped at the same mark only share the keys they all saw.
+    marks = [watermark['high_water_mark'] for watermark in watermarks]
+    if None in marks:
+        return {'high_water_mark': None, 'keys_at_mark': []}
+
+    # UTC isoformat() strings, with six digit microseconds when they are not
+    # zero, so they sort chronologically once the offset is set aside
+    earliest = min(marks, key=lambda mark: mark.replace('+00:00', ''))
+    keys_at_mark = None
+    for watermark in watermarks:
+        if watermark['high_water_mark'] == earliest:
+            keys = set(watermark['keys_at_mark'])
+            keys_at_mark = keys if keys_at_mark is None else keys_at_mark & keys
+
+    return {'high_water_mark': earliest, 'keys_at_mark': sorted(keys_at_mark)}
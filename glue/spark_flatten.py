@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import (
+    array, coalesce, col, concat_ws, explode, from_json, input_file_name, lit, lpad, monotonically_increasing_id,
+    posexplode, split, to_date, to_timestamp, trim, when)
+from pyspark.sql.types import ArrayType, StringType, StructField, StructType
+
+import weather_schema
+
+# Spark-native flattening: raw objects are read as text and parsed with an
+# explicit schema generated from weather_schema.py, and the curated columns
+# are selected straight from the nested fields. There is no crawler schema
+# inference, relationalize temp dir or join, and nothing here needs
+# awsglue, so it runs with a local SparkSession (see main).
+
+# Spark datetime pattern of weather_schema.LOCAL_OBS_DATETIME_FORMAT
+LOCAL_OBS_DATETIME_PATTERN = 'yyyy-MM-dd h:mm a'
+
+# Compacted raw objects (see compact_raw.py) hold one document per line,
+# hourly raw objects a single pretty printed document
+COMPACTED_HOUR_DIR = '/hour=all/'
+
+# Spark names of the weather_schema column types
+SPARK_TYPES = {'long': 'long', 'int': 'integer', 'float': 'float', 'string': 'string',
+               'timestamp': 'timestamp', 'date': 'date'}
+
+
+def field_type(field):
+    # Fields of weather_schema.py are strings, value arrays or nested sections
+    if isinstance(field, str):
+        return StringType()
+    if field[1] == weather_schema.VALUE_ARRAY:
+        return ArrayType(StructType([StructField('value', StringType())]))
+    return array_of_struct(field[1])
+
+
+def array_of_struct(fields):
+    return ArrayType(StructType([StructField(weather_schema.field_name(field), field_type(field))
+                                 for field in fields]))
+
+
+def raw_schema(sections=None):
+    # Only the given j1 sections are parsed, every section by default
+    return StructType([StructField(section, array_of_struct(fields))
+                       for section, fields in weather_schema.J1_SECTIONS
+                       if sections is None or section in sections])
+
+
+RAW_SCHEMA = raw_schema()
+CURATED_SCHEMA = StructType.fromJson({
+    'type': 'struct',
+    'fields': [{'name': column.name, 'type': SPARK_TYPES[column.type], 'nullable': True, 'metadata': {}}
+               for column in weather_schema.CURATED_COLUMNS],
+})
+
+
+def read_raw(spark, paths, schema=RAW_SCHEMA):
+    # One row per raw document, documents that cannot be parsed are dropped.
+    # Objects are read whole, so hourly and gzipped compacted objects are
+    # decoded alike; zstd objects need the Hadoop native zstd codec, use the
+    # arrow engine otherwise.
+    textDf = spark.read.option('wholetext', 'true').option('recursiveFileLookup', 'true').text(paths)
+    documents = when(input_file_name().contains(COMPACTED_HOUR_DIR), split(trim('value'), '\n')) \
+        .otherwise(array('value'))
+
+    return textDf.select(explode(documents).alias('document')) \
+        .where(trim('document') != '') \
+        .select(from_json('document', schema).alias('record')) \
+        .where(coalesce(*[col(f'record.{name}') for name in schema.names]).isNotNull()) \
+        .select('record.*')
+
+
+def source_column(source):
+    # 'nearest_area[].areaName[].value' -> col('nearest_area')[0]['areaName'][0]['value'],
+    # null when any step is missing or empty
+    steps = weather_schema.source_steps(source)
+    name, is_array = steps[0]
+    column = col(name)[0] if is_array else col(name)
+    for name, is_array in steps[1:]:
+        column = column[name][0] if is_array else column[name]
+    return column
+
+
+def cast(column, column_type):
+    # Empty strings are null, and integers are read like int(float(value))
+    # as in weather_schema.cast
+    column = when(column != '', column)
+    if column_type in ('int', 'long'):
+        return column.cast('double').cast(SPARK_TYPES[column_type])
+    return column.cast(SPARK_TYPES[column_type])
+
+
+def curated_df(rawDf):
+    # The curated columns of weather_schema.CURATED_COLUMNS, in order
+    local_obs_timestamp = to_timestamp(source_column(weather_schema.LOCAL_OBS_DATETIME_SOURCE),
+                                       LOCAL_OBS_DATETIME_PATTERN)
+    computed = {
+        # Unique but not consecutive, like the ids of the other engines they only identify the row
+        'id': monotonically_increasing_id() + 1,
+        'index': lit(0).cast('integer'),
+        'localObsTimeStamp': local_obs_timestamp,
+        'localObsDate': to_date(local_obs_timestamp),
+    }
+
+    return rawDf.select(*[
+        (computed[column.name] if column.source is None else cast(source_column(column.source), column.type))
+        .alias(column.name)
+        for column in weather_schema.CURATED_COLUMNS])
+
+
+def arrow_to_spark_type(arrow_type):
+    import pyarrow as pa
+
+    if pa.types.is_int64(arrow_type):
+        return 'long'
+    if pa.types.is_integer(arrow_type):
+        return 'integer'
+    if pa.types.is_float32(arrow_type):
+        return 'float'
+    if pa.types.is_floating(arrow_type):
+        return 'double'
+    if pa.types.is_timestamp(arrow_type):
+        return 'timestamp'
+    if pa.types.is_date(arrow_type):
+        return 'date'
+    return 'string'
+
+
+def arrow_schema_to_spark_json(schema):
+    return {
+        'type': 'struct',
+        'fields': [{'name': field.name, 'type': arrow_to_spark_type(field.type), 'nullable': True, 'metadata': {}}
+                   for field in schema]
+    }
+
+
+def forecast_df(rawDf):
+    # Explode weather[] and weather[].hourly[] of each raw row, no joins needed
+    import arrow_flatten
+
+    daysDf = rawDf.select(
+        to_timestamp(col('current_condition')[0]['localObsDateTime'],
+                     LOCAL_OBS_DATETIME_PATTERN).alias('localObsTimeStamp'),
+        col('nearest_area')[0]['areaName'][0]['value'].alias('areaName'),
+        posexplode('weather').alias('forecastDayIndex', 'day'))
+    hoursDf = daysDf.select('*', explode('day.hourly').alias('hour'))
+
+    forecastHour = (col('hour.time').cast('int') / 100).cast('int')
+    columns = {
+        'localObsTimeStamp': col('localObsTimeStamp'),
+        'localObsDate': to_date('localObsTimeStamp'),
+        'areaName': col('areaName'),
+        'forecastDayIndex': col('forecastDayIndex'),
+        'forecastDate': to_date(col('day.date')),
+        'forecastHour': forecastHour,
+        'forecastTime': to_timestamp(concat_ws(' ', col('day.date'), lpad(forecastHour.cast('string'), 2, '0')),
+                                     'yyyy-MM-dd HH'),
+        'weatherDesc': col('hour.weatherDesc')[0]['value'],
+    }
+    for field in arrow_flatten.FORECAST_DAY_FIELDS:
+        columns[field] = col('day')[field]
+    for field in arrow_flatten.FORECAST_HOURLY_FIELDS:
+        columns[field] = col('hour')[field]
+
+    return hoursDf.select(*[
+        columns[field.name].cast(arrow_to_spark_type(field.type)).alias(field.name)
+        for field in arrow_flatten.FORECAST_SCHEMA])
+
+
+def local_session(shuffle_partitions=None):
+    builder = SparkSession.builder.master('local[*]').appName('wttr_in_data_local')
+    if shuffle_partitions is not None:
+        builder = builder.config('spark.sql.shuffle.partitions', str(shuffle_partitions))
+    return builder.getOrCreate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Flatten raw objects into the curated table with a local SparkSession')
+    parser.add_argument('--raw', nargs='+',
+                        default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_raw_data.json')],
+                        help='Raw objects or directories, glue/sample_raw_data.json by default')
+    parser.add_argument('--output-dir', help='Write the curated rows as parquet partitioned like the job')
+    parser.add_argument('--forecast-output-dir', help='Also write the forecast rows')
+    parser.add_argument('--shuffle-partitions', type=int, help='spark.sql.shuffle.partitions')
+    parser.add_argument('--explain', action='store_true', help='Print the physical plans')
+    args = parser.parse_args(argv)
+
+    spark = local_session(args.shuffle_partitions)
+    rawDf = read_raw(spark, args.raw).persist()
+    outputs = [(curated_df(rawDf), args.output_dir, 'curated')]
+    if args.forecast_output_dir:
+        outputs.append((forecast_df(rawDf), args.forecast_output_dir, 'forecast'))
+
+    report = {}
+    for df, output_dir, name in outputs:
+        if args.explain:
+            df.explain()
+        started = time.perf_counter()
+        if output_dir:
+            df.repartition(*weather_schema.PARTITION_KEYS) \
+                .sortWithinPartitions(*weather_schema.PARTITION_KEYS, 'localObsTimeStamp') \
+                .write.mode('overwrite') \
+                .partitionBy(*weather_schema.PARTITION_KEYS) \
+                .parquet(output_dir)
+            report[name] = {'rows': spark.read.parquet(output_dir).count()}
+        else:
+            df.show(truncate=False)
+            report[name] = {'rows': df.count()}
+        report[name]['seconds'] = round(time.perf_counter() - started, 3)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    spark.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import sys
+
+import incremental
+import shards
+
+# Final step of a sharded ETL run (see shards.py): checks that every shard of
+# the workflow run recorded its marker and that no partition was rewritten by
+# two shards, then saves the earliest watermark the shards processed up to.
+# A failure stops the workflow before the crawler, and leaves the watermark
+# where it was so the next run reprocesses the same raw objects.
+
+
+def verify(s3, shard_state_dir, run_id, shard_count, watermark_path=None):
+    bucket, prefix = incremental.split_s3_url(shard_state_dir)
+    markers = shards.load_markers(s3, bucket, prefix, run_id)
+
+    missing = shards.missing_shards(markers, shard_count)
+    if missing:
+        raise RuntimeError(f'{len(missing)} of {shard_count} shards did not complete in workflow run '
+                           f'{run_id}: {", ".join(missing)}')
+
+    # Only the hash shards of the run, ad hoc area runs are not part of it
+    names = [shards.shard_name(shards.Shard(index, shard_count, None)) for index in range(shard_count)]
+    owners = {}
+    for name in names:
+        for partition in markers[name]['partitions']:
+            owners.setdefault(tuple(partition), []).append(name)
+    overlapping = {partition: shard_names for partition, shard_names in owners.items() if len(shard_names) > 1}
+    if overlapping:
+        raise RuntimeError(f'Partitions rewritten by more than one shard: {overlapping}')
+
+    watermarks = [markers[name]['watermark'] for name in names]
+    watermark = None
+    if None not in watermarks:
+        watermark = shards.earliest_watermark(watermarks)
+        if watermark_path is not None:
+            incremental.save_watermark(s3, *incremental.split_s3_url(watermark_path), watermark)
+
+    return watermark, len(owners)
+
+
+if __name__ == '__main__':
+    import boto3
+    from awsglue.utils import getResolvedOptions
+
+    args = getResolvedOptions(sys.argv, ['shardStateDir', 'shardCount', 'watermarkPath', 'WORKFLOW_RUN_ID'])
+
+    watermark, partitions = verify(boto3.client('s3'), args['shardStateDir'], args['WORKFLOW_RUN_ID'],
+                                   int(args['shardCount']), args['watermarkPath'])
+    print(f'All {args["shardCount"]} shards completed, {partitions} partitions rewritten, watermark {watermark}')
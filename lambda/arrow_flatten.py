@@ -0,0 +1,208 @@
+import json
+from datetime import datetime
+
+import pyarrow as pa
+
+import raw_codec
+import weather_schema
+
+ARROW_TYPES = {
+    'long': pa.int64(),
+    'int': pa.int32(),
+    'float': pa.float32(),
+    'string': pa.string(),
+    'timestamp': pa.timestamp('us'),
+    'date': pa.date32(),
+}
+
+# Output columns of the curated table, generated from weather_schema.py like
+# the ApplyMapping step of job_script.py
+CURATED_SCHEMA = pa.schema([(column.name, ARROW_TYPES[column.type])
+                            for column in weather_schema.CURATED_COLUMNS])
+
+# Forecast fact table: one row per fetch, forecast day and forecast hour of
+# the weather[].hourly[] arrays, partitioned like the curated table
+FORECAST_SCHEMA = pa.schema([
+    ('localObsTimeStamp', pa.timestamp('us')),
+    ('localObsDate', pa.date32()),
+    ('areaName', pa.string()),
+    ('forecastDayIndex', pa.int32()),
+    ('forecastDate', pa.date32()),
+    ('forecastHour', pa.int32()),
+    ('forecastTime', pa.timestamp('us')),
+    ('maxtempC', pa.int32()),
+    ('mintempC', pa.int32()),
+    ('avgtempC', pa.int32()),
+    ('sunHour', pa.float32()),
+    ('totalSnow_cm', pa.float32()),
+    ('tempC', pa.int32()),
+    ('tempF', pa.int32()),
+    ('FeelsLikeC', pa.int32()),
+    ('DewPointC', pa.int32()),
+    ('HeatIndexC', pa.int32()),
+    ('WindChillC', pa.int32()),
+    ('WindGustKmph', pa.int32()),
+    ('windspeedKmph', pa.int32()),
+    ('winddirDegree', pa.int32()),
+    ('winddir16Point', pa.string()),
+    ('cloudcover', pa.int32()),
+    ('humidity', pa.int32()),
+    ('pressure', pa.int32()),
+    ('visibility', pa.int32()),
+    ('uvIndex', pa.int32()),
+    ('precipMM', pa.float32()),
+    ('chanceofrain', pa.int32()),
+    ('chanceofsnow', pa.int32()),
+    ('chanceofthunder', pa.int32()),
+    ('chanceofsunshine', pa.int32()),
+    ('chanceoffog', pa.int32()),
+    ('chanceofwindy', pa.int32()),
+    ('weatherCode', pa.int32()),
+    ('weatherDesc', pa.string()),
+])
+
+# Scalar fields copied from weather[d] and weather[d].hourly[h]
+FORECAST_DAY_FIELDS = weather_schema.FORECAST_DAY_FIELDS
+FORECAST_HOURLY_FIELDS = weather_schema.FORECAST_HOURLY_FIELDS
+
+# weather_schema column types of these fields, they are cast like the
+# curated columns
+SCHEMA_TYPES = {arrow_type: column_type for column_type, arrow_type in ARROW_TYPES.items()}
+FORECAST_FIELD_TYPES = {field: SCHEMA_TYPES[FORECAST_SCHEMA.field(field).type]
+                        for field in FORECAST_DAY_FIELDS + FORECAST_HOURLY_FIELDS}
+
+
+def _first(items):
+    return items[0] if items else {}
+
+
+def _value(items):
+    return _first(items).get('value')
+
+
+parse_local_obs_datetime = weather_schema.parse_local_obs_datetime
+
+
+def flatten_record(record, record_id=1):
+    row = {'id': record_id, 'index': 0}
+    row.update(weather_schema.convert(record))
+
+    return row
+
+
+def forecast_hour(time):
+    # Forecast times are given as hours * 100, e.g. '0', '300', '2100'
+    return int(time) // 100
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _forecast_time(forecast_date, hour):
+    return datetime.combine(forecast_date, datetime.min.time()).replace(hour=hour)
+
+
+def _parse_or_null(parse, *values):
+    # Values that cannot be parsed are null, like in the spark engine
+    try:
+        return parse(*values)
+    except weather_schema.CAST_ERRORS:
+        return None
+
+
+def flatten_forecast(record, local_obs_timestamp=None, area_name=None):
+    # The fetch identity is passed in when the record has already been
+    # flattened, so the current condition is only parsed once
+    if local_obs_timestamp is None:
+        local_obs_timestamp = _parse_or_null(
+            parse_local_obs_datetime, _first(record.get('current_condition')).get('localObsDateTime'))
+    if area_name is None:
+        area_name = _value(_first(record.get('nearest_area')).get('areaName'))
+
+    for day_index, day in enumerate(record.get('weather') or []):
+        forecast_date = _parse_or_null(_parse_date, day.get('date'))
+
+        for hour in day.get('hourly') or []:
+            hour_of_day = _parse_or_null(forecast_hour, hour.get('time'))
+            forecast_time = _parse_or_null(_forecast_time, forecast_date, hour_of_day)
+
+            row = {
+                'localObsTimeStamp': local_obs_timestamp,
+                'localObsDate': local_obs_timestamp.date() if local_obs_timestamp else None,
+                'areaName': area_name,
+                'forecastDayIndex': day_index,
+                'forecastDate': forecast_date,
+                'forecastHour': hour_of_day,
+                'forecastTime': forecast_time,
+                'weatherDesc': _value(hour.get('weatherDesc')),
+            }
+
+            for field in FORECAST_DAY_FIELDS:
+                row[field] = weather_schema.cast_or_null(day.get(field), FORECAST_FIELD_TYPES[field])
+
+            for field in FORECAST_HOURLY_FIELDS:
+                row[field] = weather_schema.cast_or_null(hour.get(field), FORECAST_FIELD_TYPES[field])
+
+            yield row
+
+
+def flatten_forecast_records(records):
+    columns = {name: [] for name in FORECAST_SCHEMA.names}
+
+    for record in records:
+        for row in flatten_forecast(record):
+            for name, value in row.items():
+                columns[name].append(value)
+
+    return pa.Table.from_pydict(columns, schema=FORECAST_SCHEMA)
+
+
+def flatten_record_with_forecast(record, record_id=1):
+    # Current conditions and forecast rows of one record from a single parse
+    row = flatten_record(record, record_id)
+
+    return row, list(flatten_forecast(record, row['localObsTimeStamp'], row['areaName']))
+
+
+def flatten_records(records, first_id=1):
+    # Columns are filled in a single pass over the records, with no
+    # relationalize temp dir or joins
+    columns = {name: [] for name in CURATED_SCHEMA.names}
+
+    for record_id, record in enumerate(records, start=first_id):
+        for name, value in flatten_record(record, record_id).items():
+            columns[name].append(value)
+
+    return pa.Table.from_pydict(columns, schema=CURATED_SCHEMA)
+
+
+def iter_flattened_batches(records, batch_size=10000):
+    batch = []
+    first_id = 1
+
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield from flatten_records(batch, first_id).to_batches()
+            first_id += len(batch)
+            batch = []
+
+    if batch:
+        yield from flatten_records(batch, first_id).to_batches()
+
+
+def load_records(data):
+    # Raw objects hold either a single (pretty printed) j1 document or one
+    # document per line, compressed with any of the raw codecs
+    if isinstance(data, bytes):
+        data = raw_codec.decode(data).decode('utf-8')
+
+    data = data.strip()
+    if not data:
+        return []
+
+    try:
+        return [json.loads(data)]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
@@ -0,0 +1,50 @@
+import json
+import hashlib
+
+# Deduplication of unchanged observations at ingest. A compact index stores the
+# fingerprint of the last payload saved for each location:
+# - 'observation': the current_condition.localObsDateTime of the payload
+# - 'content': a hash of the whole payload, ignoring key order and whitespace
+# - 'off': every payload is saved
+DEDUP_MODES = ('observation', 'content', 'off')
+
+
+def fingerprint(content, mode):
+    if mode == 'off':
+        return None
+    if mode not in DEDUP_MODES:
+        raise ValueError(f'Unsupported dedup mode {mode}, expected one of {DEDUP_MODES}')
+
+    payload = json.loads(content)
+
+    if mode == 'observation':
+        current_condition = (payload.get('current_condition') or [{}])[0]
+        return current_condition.get('localObsDateTime')
+
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def is_duplicate(index, location, location_fingerprint):
+    if location_fingerprint is None:
+        return False
+
+    return index.get(location, {}).get('fingerprint') == location_fingerprint
+
+
+def load_index(s3, bucket, key):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return {}
+
+    return json.loads(response['Body'].read())
+
+
+def save_index(s3, bucket, key, index):
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(index, sort_keys=True, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json',
+    )
@@ -0,0 +1,272 @@
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import urllib3
+
+# Upstream fetches bounded by the time left in the invocation:
+# - every request gets connect and read timeouts, capped by a deadline taken
+#   from the remaining Lambda time, and the caller stops waiting at the
+#   deadline whatever the socket is doing
+# - timeouts, connection errors and retryable statuses are retried with
+#   jittered exponential backoff (honouring Retry-After), as long as the
+#   deadline allows it
+# - optionally, a second identical request is sent when the first one is
+#   slower than a percentile of the recent latencies of the host, and the
+#   first good response wins
+# - a per-host circuit breaker fails fetches fast after consecutive failures,
+#   and lets a single trial request through once the reset time has passed
+# Breakers and latencies live as long as the Fetcher, so across the warm
+# invocations of a Lambda container.
+
+# Throttling and server errors that may succeed when tried again
+RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+Response = namedtuple('Response', ['status_code', 'content'])
+
+FetchPolicy = namedtuple('FetchPolicy', [
+    'connect_timeout', 'read_timeout', 'max_attempts', 'backoff_base', 'backoff_cap',
+    'hedge_percentile', 'hedge_min_samples', 'latency_window', 'failure_threshold', 'reset_seconds'])
+
+# Seconds, except hedge_percentile (0-100, None disables hedging)
+DEFAULT_POLICY = FetchPolicy(
+    connect_timeout=2.0,
+    read_timeout=6.0,
+    max_attempts=3,
+    backoff_base=0.2,
+    backoff_cap=2.0,
+    hedge_percentile=None,
+    # Hedging starts once this many latencies of the host were seen
+    hedge_min_samples=20,
+    latency_window=200,
+    failure_threshold=5,
+    reset_seconds=30.0,
+)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def deadline_from_context(context, reserve_seconds=0.0):
+    # time.monotonic() value by which fetches must be done, keeping
+    # reserve_seconds of the invocation for the work after them. None
+    # without a Lambda context.
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - reserve_seconds
+
+
+def remaining_seconds(deadline):
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded('Fetch deadline exceeded')
+    return remaining
+
+
+def backoff_seconds(attempt, base, cap):
+    # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_seconds(value):
+    # Only the delay-seconds form of Retry-After is honoured
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+class LatencyWindow:
+    # Latencies of the most recent successful requests to a host
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent, min_samples):
+        with self.lock:
+            samples = list(self.samples)
+        if len(samples) < min_samples:
+            return None
+        return percentile(samples, percent / 100)
+
+
+class CircuitBreaker:
+    # closed: requests go through, consecutive failures are counted
+    # open: fetches fail fast until reset_seconds have passed
+    # half-open: one trial request, its outcome closes or opens the circuit
+
+    def __init__(self, failure_threshold, reset_seconds, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_seconds:
+                self.state = 'half-open'
+                return True
+            return False
+
+    def record(self, success):
+        with self.lock:
+            if success:
+                self.state = 'closed'
+                self.failures = 0
+                return
+
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = self.clock()
+
+    def cancel(self):
+        # A request ended without an outcome, a trial request is made again
+        # by the next fetch
+        with self.lock:
+            if self.state == 'half-open':
+                self.state = 'open'
+
+
+class Fetcher:
+
+    def __init__(self, pool, policy=DEFAULT_POLICY, max_workers=16):
+        self.pool = pool
+        self.policy = policy
+        # Requests run in these threads so the caller can stop waiting at the
+        # deadline and hedge a slow request
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+        self.breakers = {}
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def breaker(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(self.policy.failure_threshold, self.policy.reset_seconds)
+            return self.breakers[host]
+
+    def latency_window(self, host):
+        with self.lock:
+            if host not in self.latencies:
+                self.latencies[host] = LatencyWindow(self.policy.latency_window)
+            return self.latencies[host]
+
+    def hedge_delay(self, host):
+        if self.policy.hedge_percentile is None:
+            return None
+        return self.latency_window(host).percentile(self.policy.hedge_percentile, self.policy.hedge_min_samples)
+
+    def fetch(self, url, deadline=None, metrics=None):
+        # Response of the last attempt that got one. Raises CircuitOpenError
+        # when the host's circuit is open, DeadlineExceeded when the deadline
+        # passes and the last error when no attempt got a response.
+        metrics = {} if metrics is None else metrics
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        last_response = error = None
+
+        for attempt in range(self.policy.max_attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(f'Circuit open for {host}')
+            metrics['Attempts'] = attempt + 1
+
+            try:
+                response, retry_after = self.attempt(url, host, deadline, metrics)
+            except DeadlineExceeded:
+                # Our own time ran out, which says nothing about the host
+                breaker.cancel()
+                raise
+            except urllib3.exceptions.HTTPError as attempt_error:
+                # Timeouts and connection errors
+                breaker.record(False)
+                retry_after, error = None, attempt_error
+            else:
+                retryable = response.status_code in RETRYABLE_STATUSES
+                breaker.record(not retryable)
+                if not retryable:
+                    return response
+                last_response = response
+
+            if attempt + 1 == self.policy.max_attempts:
+                break
+            delay = max(backoff_seconds(attempt, self.policy.backoff_base, self.policy.backoff_cap),
+                        retry_after or 0)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                break
+            time.sleep(delay)
+
+        if last_response is None:
+            raise error
+        return last_response
+
+    def attempt(self, url, host, deadline, metrics):
+        # The first good response of the request and its hedge, otherwise the
+        # last response or error
+        futures = [self.executor.submit(self.request, url, host, deadline)]
+
+        hedge_after = self.hedge_delay(host)
+        remaining = remaining_seconds(deadline)
+        if hedge_after is not None and (remaining is None or hedge_after < remaining):
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                futures.append(self.executor.submit(self.request, url, host, deadline))
+                metrics['Hedged'] = metrics.get('Hedged', 0) + 1
+
+        result = error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=remaining_seconds(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f'Fetch deadline exceeded waiting for {host}')
+            for future in done:
+                try:
+                    result = future.result()
+                except urllib3.exceptions.HTTPError as request_error:
+                    error = request_error
+                    continue
+                if result[0].status_code not in RETRYABLE_STATUSES:
+                    return result
+
+        if result is None:
+            raise error
+        return result
+
+    def request(self, url, host, deadline):
+        remaining = remaining_seconds(deadline)
+        timeout = urllib3.Timeout(
+            connect=self.policy.connect_timeout if remaining is None else min(self.policy.connect_timeout, remaining),
+            read=self.policy.read_timeout if remaining is None else min(self.policy.read_timeout, remaining))
+
+        started = time.perf_counter()
+        http_response = self.pool.request('GET', url, timeout=timeout)
+        if http_response.status not in RETRYABLE_STATUSES:
+            self.latency_window(host).add(time.perf_counter() - started)
+
+        return (Response(http_response.status, http_response.data),
+                retry_after_seconds(http_response.headers.get('Retry-After')))
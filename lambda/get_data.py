@@ -1,7 +1,15 @@
 import os
-import boto3
-import requests
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import urllib3
+
+import dedup
+import fetcher
+import instrumentation
+import raw_codec
 
 import logging
 logger = logging.getLogger()
@@ -10,56 +18,398 @@ logger.setLevel(logging.INFO)
 INGEST_BUCKET = os.environ['INGEST_BUCKET']
 RAW_DATA_PATH = os.environ['RAW_DATA_PATH']
 LOCATION_QUERY_STRING = os.environ['LOCATION_QUERY_STRING']
+# Base url of the weather service, overridable to point at a local stand-in
+WTTR_IN_URL = os.environ.get('WTTR_IN_URL', 'https://wttr.in')
+# Maximum number of locations fetched and uploaded at the same time
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', '8'))
+
+# Timeouts, retries, hedging and circuit breaking of the wttr.in requests,
+# see fetcher.py. Fetches stop FETCH_RESERVE_SECONDS before the function
+# times out, leaving time to store what was fetched.
+FETCH_POLICY = fetcher.DEFAULT_POLICY._replace(
+    connect_timeout=float(os.environ.get('FETCH_CONNECT_TIMEOUT_SECONDS', '2')),
+    read_timeout=float(os.environ.get('FETCH_READ_TIMEOUT_SECONDS', '6')),
+    max_attempts=int(os.environ.get('FETCH_MAX_ATTEMPTS', '3')),
+    # e.g. 95 to hedge requests slower than the p95 latency, empty to disable
+    hedge_percentile=float(os.environ['FETCH_HEDGE_PERCENTILE']) if os.environ.get('FETCH_HEDGE_PERCENTILE') else None,
+)
+FETCH_RESERVE_SECONDS = float(os.environ.get('FETCH_RESERVE_SECONDS', '1.5'))
+
+# Compression codec of raw payloads, see raw_codec.py
+RAW_CODEC = os.environ.get('RAW_CODEC', 'gzip')
+
+# Unchanged observations are not saved again, see dedup.py for the modes
+DEDUP_MODE = os.environ.get('DEDUP_MODE', 'observation')
+LAST_SEEN_INDEX_KEY = os.environ.get('LAST_SEEN_INDEX_KEY', 'ingest_state/last_seen.json')
+
+# Payloads are checked against weather_schema.py before they are stored:
+# 'quarantine' stores invalid payloads under QUARANTINE_DATA_PATH instead of
+# the raw data path, 'reject' drops them and 'off' stores every payload
+VALIDATION_MODES = ('quarantine', 'reject', 'off')
+VALIDATION_MODE = os.environ.get('VALIDATION_MODE', 'off')
+QUARANTINE_DATA_PATH = os.environ.get('QUARANTINE_DATA_PATH', 'weather_data_quarantine')
+# Problems returned per invalid payload
+MAX_PROBLEMS = 10
+
+# 'pipeline' stores payloads projected to the fields the pipeline reads (see
+# weather_schema.PIPELINE_SOURCES), 'off' stores them as received. With
+# AUDIT_DATA_PATH set, projected payloads are also stored as received under
+# that path with the raw data layout.
+PROJECTION_MODES = ('pipeline', 'off')
+PROJECTION_MODE = os.environ.get('PROJECTION_MODE', 'off')
+AUDIT_DATA_PATH = os.environ.get('AUDIT_DATA_PATH', '')
+
+# 'fixed' fetches every location on each scheduled invocation, 'adaptive'
+# only fetches the locations due a new observation, see poll_schedule.py
+POLL_MODE = os.environ.get('POLL_MODE', 'fixed')
+POLL_STATE_KEY = os.environ.get('POLL_STATE_KEY', 'ingest_state/poll_schedule.json')
+# Most locations fetched by one adaptive invocation, 0 for no limit. It is
+# raised to what the cadences of the locations need at one invocation every
+# POLL_TICK_MINUTES, see poll_schedule.fetch_budget.
+POLL_MAX_FETCHES = int(os.environ.get('POLL_MAX_FETCHES', '0')) or None
+POLL_TICK_MINUTES = int(os.environ.get('POLL_TICK_MINUTES', '5'))
+
+# Service name of the emitted metrics, and optional cProfile capture of the
+# handler, see instrumentation.py
+METRICS_SERVICE = 'get_data'
+PROFILE = os.environ.get('PROFILE', 'false').lower() == 'true'
+
+# Multiple locations can be configured by separating them with ';'
+LOCATION_SEPARATOR = ';'
+
+# The S3 client and the HTTP connection pool are created on first use and
+# reused by every warm invocation of the container, so only a cold start pays
+# for the client setup and the TLS handshakes. S3 is called through botocore:
+# boto3 would only add its import time (resources and s3transfer) to each cold
+# start, and urllib3 ships with botocore so the function has no dependency
+# outside of the Lambda runtime.
+_s3_client = None
+_http_pool = None
+_fetcher = None
+
+
+def s3_client():
+    global _s3_client
+    if _s3_client is None:
+        import botocore.session
+        _s3_client = botocore.session.get_session().create_client('s3')
+    return _s3_client
+
+
+def http_pool():
+    global _http_pool
+    if _http_pool is None:
+        # One kept-alive connection per concurrent fetch and its hedge.
+        # Redirects are followed, retries are left to fetcher.py.
+        _http_pool = urllib3.PoolManager(
+            maxsize=MAX_CONCURRENCY * (1 if FETCH_POLICY.hedge_percentile is None else 2),
+            retries=urllib3.Retry(connect=0, read=0, status=0, redirect=3))
+    return _http_pool
+
+
+def http_fetcher():
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = fetcher.Fetcher(http_pool(), FETCH_POLICY, max_workers=2 * MAX_CONCURRENCY)
+    return _fetcher
+
+
+def get_locations(event):
+    # Locations passed in the event payload take precedence over the env var
+    locations = event.get('locations') if isinstance(event, dict) else None
+
+    if not locations:
+        locations = LOCATION_QUERY_STRING.split(LOCATION_SEPARATOR)
 
+    return [location.strip() for location in locations if location.strip()]
 
-def get_weather_data(query_string):
+
+def get_event_time(event):
+    # Scheduled events carry their time, direct invocations use the current
+    # time in the same format, e.g. 2022-06-23T14:00:00Z
+    event_time = event.get('time') if isinstance(event, dict) else None
+
+    return event_time or datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def location_slug(location):
+    return '_'.join(location.split()).replace('/', '_')
+
+
+def raw_object_key(location, event_time, prefix=None):
+    # Hive-style layout so new partitions can be registered as objects land,
+    # event_time is the ISO 8601 time of the scheduled event
+    return (f'{prefix or RAW_DATA_PATH}/location={location_slug(location)}'
+            f'/date={event_time[:10]}/hour={event_time[11:13]}/{event_time}.json'
+            f'{raw_codec.get_codec(RAW_CODEC).suffix}')
+
+
+def get_weather_data(query_string, deadline=None):
     logger.info('Get weather data from wttr.in')
-    data_request = requests.get(f'https://wttr.in/{query_string}?format=j1')
+    with instrumentation.phase(METRICS_SERVICE, 'fetch', {'Location': query_string}) as metrics:
+        try:
+            data_request = http_fetcher().fetch(f'{WTTR_IN_URL}/{query_string}?format=j1', deadline, metrics)
+        except fetcher.CircuitOpenError as error:
+            # Not sent, wttr.in failed too often lately
+            metrics['CircuitOpen'] = 1
+            data_request = fetcher.Response(503, str(error).encode('utf-8'))
+        metrics['Bytes'] = len(data_request.content)
+        metrics['Status5xx'] = int(data_request.status_code >= 500)
 
-    try:
-        data_request.raise_for_status()
-    except requests.exceptions.HTTPError:
-        logger.exception('Failed to get weather data')
+    if data_request.status_code >= 400:
+        logger.error(f'Failed to get weather data: HTTP {data_request.status_code}')
     else:
         logger.info('Successfully got weather data')
 
     return data_request
 
 
-def save_to_s3(data, event_time):
+def payload_problems(content, mode):
+    if mode == 'off':
+        return []
+    if mode not in VALIDATION_MODES:
+        raise ValueError(f'Unsupported validation mode {mode}, expected one of {VALIDATION_MODES}')
+
+    try:
+        record = json.loads(content)
+    except ValueError as error:
+        return [f'Invalid JSON: {error}']
+
+    # Only imported when payloads are validated
+    import weather_schema
+    return weather_schema.validate(record)
+
+
+def project_payload(content, mode):
+    # Content to store for a payload
+    if mode == 'off':
+        return content
+    if mode not in PROJECTION_MODES:
+        raise ValueError(f'Unsupported projection mode {mode}, expected one of {PROJECTION_MODES}')
+
+    import weather_schema
+    with instrumentation.phase(METRICS_SERVICE, 'project', {'Mode': mode}) as metrics:
+        projected = json.dumps(weather_schema.project(json.loads(content)), separators=(',', ':')).encode('utf-8')
+        metrics['RawBytes'] = len(content)
+        metrics['ProjectedBytes'] = len(projected)
+
+    return projected
+
+
+def save_to_s3(data, key, s3=None):
     logger.info('Saving data to s3')
-    s3 = boto3.client('s3')
+    s3 = s3 or s3_client()
+
+    with instrumentation.phase(METRICS_SERVICE, 'encode', {'Codec': RAW_CODEC}) as metrics:
+        body = raw_codec.encode(data, RAW_CODEC)
+        metrics['RawBytes'] = len(data)
+        metrics['StoredBytes'] = len(body)
 
-    s3.put_object(
-        Bucket=INGEST_BUCKET,
-        Body=data,
-        Key=f'{RAW_DATA_PATH}/{event_time}.json',
-        ContentType='application/json',
-    )
+    with instrumentation.phase(METRICS_SERVICE, 'put', {'Key': key}) as metrics:
+        s3.put_object(
+            Bucket=INGEST_BUCKET,
+            Body=body,
+            Key=key,
+            ContentType='application/json',
+            Metadata={'codec': RAW_CODEC},
+        )
+        metrics['Bytes'] = len(body)
 
     logger.info('Data saved to s3')
 
 
+def ingest_location(location, event_time, s3, index, updates, deadline=None):
+    try:
+        weather_data = get_weather_data(location.replace(' ', '+'), deadline)
+
+        if weather_data.status_code != 200:
+            return {
+                'location': location,
+                'statusCode': weather_data.status_code,
+                'uploaded': 'false',
+                'error': weather_data.content.decode('utf-8', 'replace')
+            }
+
+        problems = payload_problems(weather_data.content, VALIDATION_MODE)
+        if problems:
+            return invalid_payload(location, event_time, weather_data.content, problems, s3)
+
+        # Validated as received, deduplicated and stored as projected
+        content = project_payload(weather_data.content, PROJECTION_MODE)
+        location_fingerprint = dedup.fingerprint(content, DEDUP_MODE)
+
+        # The adaptive scheduler learns from the observation times
+        observation = {}
+        if POLL_MODE == 'adaptive':
+            observation['observation'] = location_fingerprint if DEDUP_MODE == 'observation' else \
+                dedup.fingerprint(content, 'observation')
+
+        if dedup.is_duplicate(index, location, location_fingerprint):
+            logger.info(f'Skipping unchanged observation for {location}')
+            return {
+                'location': location,
+                'statusCode': 200,
+                'uploaded': 'false',
+                'duplicate': 'true',
+                'path': index[location].get('key'),
+                **observation
+            }
+
+        key = raw_object_key(location, event_time)
+        save_to_s3(content, key, s3)
+        if AUDIT_DATA_PATH and content is not weather_data.content:
+            save_to_s3(weather_data.content, raw_object_key(location, event_time, AUDIT_DATA_PATH), s3)
+
+        if location_fingerprint is not None:
+            updates[location] = {'fingerprint': location_fingerprint, 'key': key}
+
+    except Exception as error:
+        logger.exception(f'Failed to ingest {location}')
+        return failed_result(location, error)
+
+    return {
+        'location': location,
+        'statusCode': 200,
+        'uploaded': 'true',
+        'bucket': INGEST_BUCKET,
+        'path': key,
+        **observation
+    }
+
+
+def failed_result(location, error):
+    return {
+        'location': location,
+        'statusCode': 500,
+        'uploaded': 'false',
+        'error': str(error)
+    }
+
+
+def invalid_payload(location, event_time, content, problems, s3):
+    logger.warning(f'Invalid payload for {location}: {problems}')
+    result = {
+        'location': location,
+        'statusCode': 422,
+        'uploaded': 'false',
+        'invalid': 'true',
+        'problems': problems[:MAX_PROBLEMS]
+    }
+
+    if VALIDATION_MODE == 'quarantine':
+        key = raw_object_key(location, event_time, QUARANTINE_DATA_PATH)
+        save_to_s3(content, key, s3)
+        result.update({'quarantined': 'true', 'path': key})
+
+    return result
+
+
+def ingest_locations(locations, event_time, s3, deadline=None):
+    try:
+        with instrumentation.phase(METRICS_SERVICE, 'load_index'):
+            index = {} if DEDUP_MODE == 'off' else dedup.load_index(s3, INGEST_BUCKET, LAST_SEEN_INDEX_KEY)
+    except Exception as error:
+        # Without the index every location would be saved again
+        logger.exception('Failed to load the last seen index')
+        return [failed_result(location, error) for location in locations]
+    updates = {}
+
+    def ingest(location):
+        return ingest_location(location, event_time, s3, index, updates, deadline)
+
+    if PROFILE:
+        # cProfile only sees the thread it runs in, so locations are ingested
+        # one after the other while profiling
+        results = [ingest(location) for location in locations]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENCY, len(locations)))) as executor:
+            results = list(executor.map(ingest, locations))
+
+    # The index is only updated for payloads that were saved
+    if updates:
+        with instrumentation.phase(METRICS_SERVICE, 'save_index'):
+            index.update(updates)
+            dedup.save_index(s3, INGEST_BUCKET, LAST_SEEN_INDEX_KEY, index)
+
+    return results
+
+
+def update_poll_schedule(schedule, results, now):
+    import poll_schedule
+
+    for result in results:
+        schedule[result['location']] = poll_schedule.record_fetch(
+            schedule.get(result['location']), result['location'], now,
+            poll_schedule.fetch_outcome(result), result.get('observation'))
+
+
 def handler(event, context):
 
-    weather_data = get_weather_data(LOCATION_QUERY_STRING.replace(' ', '+'))
+    locations = get_locations(event)
+    deadline = fetcher.deadline_from_context(context, FETCH_RESERVE_SECONDS)
+    # botocore clients are thread safe, so one client is shared by all workers
+    s3 = s3_client()
+
+    # Scheduled invocations only fetch the locations that are due, locations
+    # passed in the event are always fetched
+    adaptive = POLL_MODE == 'adaptive' and not (isinstance(event, dict) and event.get('locations'))
+    skipped = 0
+    schedule_error = None
+    if adaptive:
+        # Only imported by adaptive polling
+        import poll_schedule
+
+        now = time.time()
+        try:
+            schedule = dedup.load_index(s3, INGEST_BUCKET, POLL_STATE_KEY)
+        except Exception as error:
+            # Which locations are due is unknown, they are reported as failed
+            logger.exception('Failed to load the poll schedule')
+            schedule_error = error
+        else:
+            budget = poll_schedule.fetch_budget(locations, schedule, POLL_TICK_MINUTES * 60, POLL_MAX_FETCHES)
+            due = poll_schedule.due_locations(locations, schedule, now, budget)
+            logger.info(f'{len(due)} of {len(locations)} locations are due')
+            skipped, locations = len(locations) - len(due), due
+
+    with instrumentation.phase(METRICS_SERVICE, 'handler') as metrics:
+        with instrumentation.profiled(PROFILE, 'get_data.handler'):
+            if schedule_error is None:
+                results = ingest_locations(locations, get_event_time(event), s3, deadline)
+            else:
+                results = [failed_result(location, schedule_error) for location in locations]
+
+        if adaptive and schedule_error is None:
+            update_poll_schedule(schedule, results, now)
+            dedup.save_index(s3, INGEST_BUCKET, POLL_STATE_KEY, schedule)
 
-    if weather_data.status_code == 200:
-        save_to_s3(weather_data.content, event['time'])
+        uploaded = sum(result['uploaded'] == 'true' for result in results)
+        duplicates = sum(result.get('duplicate') == 'true' for result in results)
+        invalid = sum(result.get('invalid') == 'true' for result in results)
+        succeeded = uploaded + duplicates
 
-        body = {
-            'uploaded': 'true',
-            'bucket': INGEST_BUCKET,
-            'path': f'{RAW_DATA_PATH}/{event["time"]}.json'
-        }
+        metrics['Locations'] = len(locations)
+        metrics['Uploaded'] = uploaded
+        metrics['Duplicates'] = duplicates
+        metrics['Failed'] = len(results) - succeeded
+        metrics['Invalid'] = invalid
+        metrics['Skipped'] = skipped
 
+    if succeeded == len(results):
+        status_code = 200
+    elif succeeded:
+        status_code = 207
     else:
-        body = {
-            'uploaded': 'false',
-            'error': weather_data.text
-        }
+        status_code = 502
 
     return {
-        'statusCode': weather_data.status_code,
-        'body': json.dumps(body)
+        'statusCode': status_code,
+        'body': json.dumps({
+            'uploaded': uploaded,
+            'duplicates': duplicates,
+            'failed': len(results) - succeeded,
+            'invalid': invalid,
+            'skipped': skipped,
+            'results': results
+        })
     }
@@ -0,0 +1,102 @@
+import io
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# Timing and volume metrics are written as CloudWatch embedded metric format
+# (EMF) log lines: one JSON document per line holding the metric values and
+# the metadata CloudWatch needs to extract them. Lambda log lines are turned
+# into metrics by CloudWatch Logs, and every line can be queried with Logs
+# Insights wherever it ends up (Glue driver logs included).
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'WttrInData')
+
+DIMENSIONS = ['Service', 'Phase']
+DURATION_METRIC = 'DurationMs'
+
+# Number of functions printed by a profile, sorted by cumulative time
+PROFILE_LIMIT = 30
+
+
+def metric_unit(name):
+    if name == DURATION_METRIC:
+        return 'Milliseconds'
+    if name.endswith('Bytes'):
+        return 'Bytes'
+    return 'Count'
+
+
+def write_line(document):
+    # print rather than logging, so the line is not prefixed and CloudWatch
+    # can parse it as EMF
+    print(json.dumps(document, default=str), flush=True)
+
+
+def metric_document(service, phase, metrics, properties=None, timestamp=None):
+    # Metrics are numbers, properties are logged alongside them without
+    # becoming metrics or dimensions (so they can have high cardinality)
+    timestamp = time.time() if timestamp is None else timestamp
+
+    document = dict(properties or {})
+    document.update(metrics)
+    document.update({
+        '_aws': {
+            'Timestamp': int(timestamp * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [DIMENSIONS],
+                'Metrics': [{'Name': name, 'Unit': metric_unit(name)} for name in metrics],
+            }],
+        },
+        'Service': service,
+        'Phase': phase,
+    })
+
+    return document
+
+
+def emit(service, phase, metrics, properties=None, write=write_line):
+    write(metric_document(service, phase, metrics, properties))
+
+
+@contextmanager
+def phase(service, name, properties=None, write=write_line):
+    # Times the block and emits its duration together with the counts the
+    # block adds to the yielded dict. Failed phases are emitted with Errors=1
+    # before the exception propagates.
+    metrics = {}
+    started = time.perf_counter()
+
+    try:
+        yield metrics
+    except Exception:
+        metrics['Errors'] = 1
+        raise
+    finally:
+        metrics[DURATION_METRIC] = round((time.perf_counter() - started) * 1000, 3)
+        metrics.setdefault('Errors', 0)
+        emit(service, name, metrics, properties, write)
+
+
+@contextmanager
+def profiled(enabled, label, limit=PROFILE_LIMIT, write=write_line):
+    # Optional cProfile capture of the block, written as one log line with
+    # the top functions by cumulative time
+    if not enabled:
+        yield None
+        return
+
+    # Only imported when profiling, they are not needed on every cold start
+    import cProfile
+    import pstats
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+
+        stats_text = io.StringIO()
+        pstats.Stats(profile, stream=stats_text).sort_stats('cumulative').print_stats(limit)
+        write({'Profile': label, 'Stats': stats_text.getvalue()})
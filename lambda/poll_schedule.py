@@ -0,0 +1,162 @@
+import math
+import random
+import statistics
+from datetime import datetime, timezone
+
+import weather_schema
+
+# Adaptive polling: instead of fetching every location at minute 0 of every
+# hour, the function runs every few minutes and only fetches the locations
+# that are due. The state of each location records its recent observations:
+#
+# - the cadence is the median interval between localObsDateTime values
+# - the delay between an observation time and the time it becomes visible
+#   upstream (it absorbs the location's UTC offset and the publishing lag).
+#   A fetch that sees a new observation bounds it from above, an earlier
+#   successful fetch that did not see it bounds it from below. Until a lower
+#   bound is known, fetches probe RECHECK_SECONDS earlier than the upper one.
+#
+# so the next observation is expected at last observation + cadence + delay.
+# Fetches without a new observation are retried at growing intervals, errors
+# or rate limiting back off exponentially with jitter, and at most
+# max_fetches due locations are fetched per invocation (the most overdue
+# first) so new or simultaneously due locations are spread over several
+# invocations instead of hitting the upstream at once. max_fetches is raised
+# to what the cadences of all locations need (see fetch_budget), so a fixed
+# cap cannot fall behind and starve the locations that are due last.
+LOCAL_OBS_DATETIME_FORMAT = weather_schema.LOCAL_OBS_DATETIME_FORMAT
+
+HISTORY = 8
+# Until two observations have been seen the cadence is assumed to be the
+# shortest one: polling slower than the real cadence would only ever see
+# every other observation and learn the wrong cadence
+MIN_CADENCE_SECONDS = 15 * 60
+# A location is never left unfetched for longer than this
+MAX_INTERVAL_SECONDS = 3 * 3600
+
+RECHECK_SECONDS = 5 * 60
+BACKOFF_SECONDS = 5 * 60
+MAX_BACKOFF_SECONDS = 2 * 3600
+# Rate limiting backs off harder than other errors
+THROTTLED_BACKOFF_FACTOR = 2
+
+OUTCOMES = ('ok', 'throttled', 'error')
+
+# Rechecks of late observations and retries of errors come on top of one
+# fetch per cadence
+BUDGET_HEADROOM = 1.5
+
+
+def parse_observation(local_obs_datetime):
+    # Observation times are local to the location, they are only compared
+    # with each other and with the delay learned for the same location
+    observed_at = datetime.strptime(local_obs_datetime, LOCAL_OBS_DATETIME_FORMAT)
+    return observed_at.replace(tzinfo=timezone.utc).timestamp()
+
+
+def cadence_seconds(state):
+    observations = sorted(parse_observation(observation) for observation in state.get('observations', []))
+    intervals = [later - earlier for earlier, later in zip(observations, observations[1:]) if later > earlier]
+    if not intervals:
+        return MIN_CADENCE_SECONDS
+
+    return min(MAX_INTERVAL_SECONDS, max(MIN_CADENCE_SECONDS, statistics.median(intervals)))
+
+
+def visibility_delay(state):
+    upper = min(state['upper_delays'])
+    lowers = [delay for delay in state['lower_delays'] if delay < upper]
+    if lowers:
+        return (max(lowers) + upper) / 2
+    return upper - RECHECK_SECONDS
+
+
+def is_due(state, now):
+    return state is None or now >= state.get('next_fetch_at', 0)
+
+
+def due_locations(locations, states, now, max_fetches=None):
+    # Locations never fetched come first, then the most overdue
+    due = sorted((location for location in locations if is_due(states.get(location), now)),
+                 key=lambda location: (states.get(location) or {}).get('next_fetch_at', 0))
+    return due if max_fetches is None else due[:max_fetches]
+
+
+def fetch_budget(locations, states, tick_seconds, max_fetches=None):
+    # Fetches per invocation, every tick_seconds, that keep up with one fetch
+    # per cadence of every location, and at least max_fetches. Locations not
+    # fetched yet count with the shortest cadence. None without max_fetches.
+    if max_fetches is None:
+        return None
+
+    needed = math.fsum(tick_seconds / cadence_seconds(states.get(location) or {}) for location in locations)
+    return max(max_fetches, math.ceil(needed * BUDGET_HEADROOM))
+
+
+def backoff_seconds(failures, factor=1, rng=random):
+    # Equal jitter: half of the exponential backoff plus a random share of the rest
+    backoff = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * factor * 2 ** (failures - 1))
+    return backoff / 2 + rng.random() * backoff / 2
+
+
+def record_fetch(state, location, now, outcome, observation=None, rng=random):
+    # Returns the new state of a location after a fetch at now (epoch seconds)
+    if outcome not in OUTCOMES:
+        raise ValueError(f'Unsupported fetch outcome {outcome}, expected one of {OUTCOMES}')
+
+    state = dict(state or {})
+    for history in ('observations', 'upper_delays', 'lower_delays'):
+        state.setdefault(history, [])
+    previous_fetch_at = state.get('last_fetch_at') if state.get('last_outcome') == 'ok' else None
+    state.update({'last_fetch_at': now, 'last_outcome': outcome})
+
+    if outcome != 'ok':
+        state['failures'] = state.get('failures', 0) + 1
+        factor = THROTTLED_BACKOFF_FACTOR if outcome == 'throttled' else 1
+        state['next_fetch_at'] = now + backoff_seconds(state['failures'], factor, rng)
+        return state
+
+    state['failures'] = 0
+    observed_at = None
+    if observation is not None and observation not in state['observations']:
+        try:
+            observed_at = parse_observation(observation)
+        except (TypeError, ValueError):
+            # Payloads are not validated in every mode, a malformed time
+            # counts as no new observation and keeps the cadence learned
+            pass
+
+    if observed_at is not None:
+        state['observations'] = (state['observations'] + [observation])[-HISTORY:]
+        state['upper_delays'] = (state['upper_delays'] + [now - observed_at])[-HISTORY:]
+        if previous_fetch_at is not None and previous_fetch_at > observed_at:
+            state['lower_delays'] = (state['lower_delays'] + [previous_fetch_at - observed_at])[-HISTORY:]
+        state['misses'] = 0
+    else:
+        state['misses'] = state.get('misses', 0) + 1
+
+    cadence = cadence_seconds(state)
+    if state['observations']:
+        latest = max(parse_observation(observation) for observation in state['observations'])
+        expected = latest + cadence + visibility_delay(state)
+    else:
+        expected = now + cadence
+
+    if expected <= now:
+        # The next observation is late, skipped or the cadence changed: check
+        # again at growing intervals, but no later than the following slot
+        following_slot = expected + (math.floor((now - expected) / cadence) + 1) * cadence
+        expected = min(following_slot, now + RECHECK_SECONDS * 2 ** max(0, state['misses'] - 1))
+
+    state['next_fetch_at'] = min(expected, now + MAX_INTERVAL_SECONDS)
+
+    return state
+
+
+def fetch_outcome(result):
+    # Outcome of a get_data.ingest_location result
+    if result['statusCode'] == 429:
+        return 'throttled'
+    if result['statusCode'] != 200:
+        return 'error'
+    return 'ok'
@@ -0,0 +1,68 @@
+import gzip
+import io
+from collections import namedtuple
+
+# zstandard is optional, only needed when the zstd codec is used
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression codecs for raw payloads. The codec is recorded in the key suffix
+# and in the object metadata, and is also recognised from the magic bytes of
+# the data so readers can decode any raw object without knowing how it was
+# written.
+Codec = namedtuple('Codec', ['name', 'suffix', 'magic'])
+
+CODECS = {
+    'none': Codec('none', '', b''),
+    'gzip': Codec('gzip', '.gz', b'\x1f\x8b'),
+    'zstd': Codec('zstd', '.zst', b'\x28\xb5\x2f\xfd'),
+}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def get_codec(name):
+    if name not in CODECS:
+        raise ValueError(f'Unsupported raw codec {name}, expected one of {list(CODECS)}')
+    if name == 'zstd' and zstandard is None:
+        raise ValueError('The zstd codec requires the zstandard package')
+
+    return CODECS[name]
+
+
+def detect_codec(data):
+    for codec in CODECS.values():
+        if codec.magic and data[:len(codec.magic)] == codec.magic:
+            return codec.name
+
+    return 'none'
+
+
+def encode(data, name):
+    get_codec(name)
+
+    if name == 'gzip':
+        # mtime=0 keeps the output identical for identical payloads
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as gzip_file:
+            gzip_file.write(data)
+        return buffer.getvalue()
+    if name == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def decode(data, name=None):
+    name = name or detect_codec(data)
+    get_codec(name)
+
+    if name == 'gzip':
+        return gzip.decompress(data)
+    if name == 'zstd':
+        # Frames written by compress() carry their content size, streamed
+        # frames do not, so always decompress through a reader
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
@@ -0,0 +1,119 @@
+import os
+import copy
+import boto3
+from urllib.parse import unquote_plus
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+GLUE_DATABASE = os.environ['GLUE_DATABASE']
+GLUE_TABLE = os.environ['GLUE_TABLE']
+RAW_DATA_PATH = os.environ['RAW_DATA_PATH']
+
+# Must match the raw key layout written by get_data.py
+PARTITION_KEYS = ['location', 'date', 'hour']
+
+# batch_create_partition accepts at most 100 partitions per call
+BATCH_SIZE = 100
+
+# Partitions registered by this container, so warm invocations skip the catalog
+registered_partitions = set()
+
+
+def parse_partition(key):
+    prefix = f'{RAW_DATA_PATH}/'
+    if not key.startswith(prefix):
+        return None
+
+    values = {}
+    for part in key[len(prefix):].split('/')[:-1]:
+        name, separator, value = part.partition('=')
+        if separator:
+            values[name] = value
+
+    if any(name not in values for name in PARTITION_KEYS):
+        return None
+
+    return tuple(values[name] for name in PARTITION_KEYS)
+
+
+def partition_location(bucket, values):
+    return f's3://{bucket}/{RAW_DATA_PATH}/' + ''.join(
+        f'{name}={value}/' for name, value in zip(PARTITION_KEYS, values))
+
+
+def partition_input(storage_descriptor, bucket, values):
+    partition_storage_descriptor = copy.deepcopy(storage_descriptor)
+    partition_storage_descriptor['Location'] = partition_location(bucket, values)
+
+    return {
+        'Values': list(values),
+        'StorageDescriptor': partition_storage_descriptor,
+    }
+
+
+def register_partitions(glue, bucket, partitions):
+    new_partitions = sorted({values for values in partitions
+                             if (bucket, values) not in registered_partitions})
+    if not new_partitions:
+        return []
+
+    table = glue.get_table(DatabaseName=GLUE_DATABASE, Name=GLUE_TABLE)['Table']
+    storage_descriptor = table['StorageDescriptor']
+
+    created = []
+    failed_partitions = []
+    for start in range(0, len(new_partitions), BATCH_SIZE):
+        batch = new_partitions[start:start + BATCH_SIZE]
+        response = glue.batch_create_partition(
+            DatabaseName=GLUE_DATABASE,
+            TableName=GLUE_TABLE,
+            PartitionInputList=[partition_input(storage_descriptor, bucket, values)
+                                for values in batch],
+        )
+
+        failed = set()
+        for error in response.get('Errors', []):
+            values = tuple(error['PartitionValues'])
+            if error['ErrorDetail']['ErrorCode'] == 'AlreadyExistsException':
+                registered_partitions.add((bucket, values))
+            else:
+                logger.error(f'Failed to register partition {values}: {error["ErrorDetail"]}')
+                failed_partitions.append(values)
+            failed.add(values)
+
+        for values in batch:
+            if values not in failed:
+                registered_partitions.add((bucket, values))
+                created.append(values)
+
+    logger.info(f'Registered {len(created)} new partitions')
+
+    # Raising lets the asynchronous S3 invocation be retried
+    if failed_partitions:
+        raise RuntimeError(f'Failed to register partitions: {failed_partitions}')
+
+    return created
+
+
+def handler(event, context):
+    partitions = {}
+
+    for record in event.get('Records', []):
+        bucket = record['s3']['bucket']['name']
+        key = unquote_plus(record['s3']['object']['key'])
+        values = parse_partition(key)
+
+        if values is None:
+            logger.info(f'Skipping {key}, not a partitioned raw object')
+            continue
+
+        partitions.setdefault(bucket, set()).add(values)
+
+    glue = boto3.client('glue')
+    created = []
+    for bucket, bucket_partitions in partitions.items():
+        created += register_partitions(glue, bucket, bucket_partitions)
+
+    return {'registered': [list(values) for values in created]}
@@ -0,0 +1,214 @@
+import os
+import io
+import json
+import hashlib
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import arrow_flatten
+import instrumentation
+import weather_schema
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Near-real-time path: the Object Created events of raw objects are queued by
+# EventBridge in SQS, and each invocation flattens a micro-batch of them into
+# the curated schema and appends one parquet file per areaName/localObsDate
+# partition. The nightly ETL job rewrites every partition its raw objects
+# touch (merging and deduplicating these files), so it remains the
+# compaction and consistency pass.
+# Messages whose objects cannot be read or written are reported as batch
+# item failures, so SQS only redelivers those. A redelivered object whose
+# rows were partly written appends them again, until the ETL job
+# deduplicates them.
+# Like the batch engines, id numbers the records read by one invocation, so
+# it is unique within a batch but not across batches or runs. Rows are
+# identified by areaName and localObsTimeStamp.
+RAW_DATA_PATH = os.environ['RAW_DATA_PATH']
+PARQUET_DATA_PATH = os.environ['PARQUET_DATA_PATH']
+GLUE_DATABASE = os.environ['GLUE_DATABASE']
+# The parquet crawler names the curated table after its folder
+CURATED_TABLE = os.environ.get('CURATED_TABLE', PARQUET_DATA_PATH)
+PARQUET_CODEC = os.environ.get('PARQUET_CODEC', 'snappy')
+
+METRICS_SERVICE = 'transform_raw'
+
+PARTITION_KEYS = weather_schema.PARTITION_KEYS
+
+# Compacted objects (see compact_raw.py) only repack hourly objects that have
+# already been transformed
+COMPACTED_HOUR_PREFIX = 'hour=all/'
+
+NULL_PARTITION = weather_schema.NULL_PARTITION
+
+# batch_create_partition accepts at most 100 partitions per call
+BATCH_SIZE = 100
+
+# Partitions registered by this container, so warm invocations skip the catalog
+registered_partitions = set()
+
+
+def raw_object(record):
+    # (bucket, key) of the raw object of an SQS message holding an
+    # EventBridge Object Created event, None for other objects
+    detail = json.loads(record['body'])['detail']
+    key = detail['object']['key']
+
+    if not key.startswith(f'{RAW_DATA_PATH}/') or f'/{COMPACTED_HOUR_PREFIX}' in key:
+        logger.info(f'Skipping {key}, not an hourly raw object')
+        return None
+
+    return detail['bucket']['name'], key
+
+
+def partition_dir(values):
+    return f'{PARQUET_DATA_PATH}/{weather_schema.partition_path(values)}'
+
+
+def read_rows(s3, bucket, key, first_id=1):
+    body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    return [arrow_flatten.flatten_record(record, record_id)
+            for record_id, record in enumerate(arrow_flatten.load_records(body), start=first_id)]
+
+
+def group_rows(rows):
+    partitions = {}
+    for row in rows:
+        values = tuple(row[name] for name in PARTITION_KEYS)
+        partitions.setdefault(values, []).append(row)
+    return partitions
+
+
+def partition_table(rows):
+    # Partition values are stored in the directory names, like Spark does
+    table = pa.Table.from_pylist(rows, schema=arrow_flatten.CURATED_SCHEMA)
+    table = table.drop(PARTITION_KEYS)
+    return table.sort_by([('localObsTimeStamp', 'ascending')])
+
+
+def file_name(source_keys):
+    # Named after the source objects, so a retried batch overwrites its own files
+    digest = hashlib.sha1('\n'.join(sorted(source_keys)).encode('utf-8')).hexdigest()[:20]
+    return f'part-nrt-{digest}.{PARQUET_CODEC}.parquet'
+
+
+def write_partition(s3, bucket, values, rows, source_keys):
+    buffer = io.BytesIO()
+    pq.write_table(partition_table(rows), buffer, compression=PARQUET_CODEC)
+    key = f'{partition_dir(values)}/{file_name(source_keys)}'
+
+    s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+
+    return key
+
+
+def catalog_values(values):
+    # Partition values as the crawler registers them
+    return [NULL_PARTITION if value is None else str(value) for value in values]
+
+
+def register_partitions(glue, bucket, partitions):
+    new_partitions = sorted((values for values in partitions
+                             if (bucket, values) not in registered_partitions), key=catalog_values)
+    if not new_partitions:
+        return []
+
+    try:
+        table = glue.get_table(DatabaseName=GLUE_DATABASE, Name=CURATED_TABLE)['Table']
+    except glue.exceptions.EntityNotFoundException:
+        # Deployed without the table definition, it only exists once the parquet crawler has run
+        logger.info(f'Table {CURATED_TABLE} does not exist yet, not registering partitions')
+        return []
+
+    created = []
+    for start in range(0, len(new_partitions), BATCH_SIZE):
+        batch = new_partitions[start:start + BATCH_SIZE]
+        partition_inputs = []
+        for values in batch:
+            storage_descriptor = dict(table['StorageDescriptor'])
+            storage_descriptor['Location'] = f's3://{bucket}/{partition_dir(values)}/'
+            partition_inputs.append({'Values': catalog_values(values), 'StorageDescriptor': storage_descriptor})
+
+        response = glue.batch_create_partition(
+            DatabaseName=GLUE_DATABASE, TableName=CURATED_TABLE, PartitionInputList=partition_inputs)
+
+        failed = set()
+        for error in response.get('Errors', []):
+            values = tuple(error['PartitionValues'])
+            # The crawler registers anything left over, so other errors are only logged
+            if error['ErrorDetail']['ErrorCode'] != 'AlreadyExistsException':
+                logger.error(f'Failed to register partition {values}: {error["ErrorDetail"]}')
+                failed.add(values)
+
+        for values in batch:
+            if tuple(catalog_values(values)) not in failed:
+                registered_partitions.add((bucket, values))
+                created.append(values)
+
+    return created
+
+
+def handler(event, context):
+    s3 = boto3.client('s3')
+    records = event.get('Records', [])
+    failed = set()
+
+    with instrumentation.phase(METRICS_SERVICE, 'transform') as metrics:
+        # rows, source keys and message ids per (bucket, partition values)
+        partitions = {}
+        objects = 0
+        next_id = 1
+        for record in records:
+            try:
+                raw = raw_object(record)
+                if raw is None:
+                    continue
+                bucket, key = raw
+                rows = read_rows(s3, bucket, key, next_id)
+                grouped = group_rows(rows)
+            except Exception:
+                logger.exception(f'Failed to transform message {record["messageId"]}')
+                failed.add(record['messageId'])
+                continue
+
+            objects += 1
+            next_id += len(rows)
+            for values, rows in grouped.items():
+                partition_rows, source_keys, message_ids = partitions.setdefault((bucket, values), ([], set(), set()))
+                partition_rows.extend(rows)
+                source_keys.add(key)
+                message_ids.add(record['messageId'])
+
+        metrics['Objects'] = objects
+        metrics['Rows'] = sum(len(rows) for rows, _, _ in partitions.values())
+        metrics['Partitions'] = len(partitions)
+
+    with instrumentation.phase(METRICS_SERVICE, 'write') as metrics:
+        written = {}
+        for (bucket, values), (rows, source_keys, message_ids) in partitions.items():
+            try:
+                written[(bucket, values)] = write_partition(s3, bucket, values, rows, source_keys)
+            except Exception:
+                logger.exception(f'Failed to write partition {values}')
+                failed.update(message_ids)
+        metrics['Failed'] = len(failed)
+
+    with instrumentation.phase(METRICS_SERVICE, 'register_partitions') as metrics:
+        glue = boto3.client('glue')
+        created = []
+        for bucket in {bucket for bucket, _ in written}:
+            created += register_partitions(glue, bucket, [values for partition_bucket, values in written
+                                                          if partition_bucket == bucket])
+        metrics['Registered'] = len(created)
+
+    logger.info(f'Transformed {objects} raw objects into {len(written)} files, {len(failed)} messages failed')
+
+    return {
+        'objects': objects,
+        'written': list(written.values()),
+        'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in records
+                              if record['messageId'] in failed],
+    }
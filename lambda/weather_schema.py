@@ -0,0 +1,313 @@
+from collections import namedtuple
+from datetime import datetime
+
+# Schema of the wttr.in j1 documents and of the curated table built from
+# them. Everything that depends on it is generated from here: the raw and
+# curated Glue tables of the stack, the ApplyMapping of job_script.py, the
+# PyArrow schema of arrow_flatten.py and the payload validation of
+# get_data.py.
+
+# Format of current_condition.localObsDateTime, e.g. '2022-06-23 11:59 PM'
+LOCAL_OBS_DATETIME_FORMAT = '%Y-%m-%d %I:%M %p'
+
+# Fields of the j1 document. Each section is an array of objects whose fields
+# are strings, [{'value': ...}] arrays (VALUE_ARRAY) or nested sections.
+VALUE_ARRAY = 'value_array'
+
+CURRENT_CONDITION_FIELDS = [
+    'FeelsLikeC', 'FeelsLikeF', 'cloudcover', 'humidity', 'localObsDateTime',
+    'observation_time', 'precipInches', 'precipMM', 'pressure',
+    'pressureInches', 'temp_C', 'temp_F', 'uvIndex', 'visibility',
+    'visibilityMiles', 'weatherCode', ('weatherDesc', VALUE_ARRAY),
+    ('weatherIconUrl', VALUE_ARRAY), 'winddir16Point', 'winddirDegree',
+    'windspeedKmph', 'windspeedMiles',
+]
+
+NEAREST_AREA_FIELDS = [
+    ('areaName', VALUE_ARRAY), ('country', VALUE_ARRAY), 'latitude',
+    'longitude', 'population', ('region', VALUE_ARRAY),
+    ('weatherUrl', VALUE_ARRAY),
+]
+
+REQUEST_FIELDS = ['query', 'type']
+
+ASTRONOMY_FIELDS = [
+    'moon_illumination', 'moon_phase', 'moonrise', 'moonset', 'sunrise',
+    'sunset',
+]
+
+HOURLY_FIELDS = [
+    'DewPointC', 'DewPointF', 'FeelsLikeC', 'FeelsLikeF', 'HeatIndexC',
+    'HeatIndexF', 'WindChillC', 'WindChillF', 'WindGustKmph', 'WindGustMiles',
+    'chanceoffog', 'chanceoffrost', 'chanceofhightemp', 'chanceofovercast',
+    'chanceofrain', 'chanceofremdry', 'chanceofsnow', 'chanceofsunshine',
+    'chanceofthunder', 'chanceofwindy', 'cloudcover', 'humidity',
+    'precipInches', 'precipMM', 'pressure', 'pressureInches', 'tempC', 'tempF',
+    'time', 'uvIndex', 'visibility', 'visibilityMiles', 'weatherCode',
+    ('weatherDesc', VALUE_ARRAY), ('weatherIconUrl', VALUE_ARRAY),
+    'winddir16Point', 'winddirDegree', 'windspeedKmph', 'windspeedMiles',
+]
+
+WEATHER_FIELDS = [
+    ('astronomy', ASTRONOMY_FIELDS), 'avgtempC', 'avgtempF', 'date',
+    ('hourly', HOURLY_FIELDS), 'maxtempC', 'maxtempF', 'mintempC', 'mintempF',
+    'sunHour', 'totalSnow_cm', 'uvIndex',
+]
+
+J1_SECTIONS = [
+    ('current_condition', CURRENT_CONDITION_FIELDS),
+    ('nearest_area', NEAREST_AREA_FIELDS),
+    ('request', REQUEST_FIELDS),
+    ('weather', WEATHER_FIELDS),
+]
+
+# Sections the curated columns are read from, validated at ingest
+VALIDATED_SECTIONS = ['current_condition', 'nearest_area']
+
+# Columns of the curated table, in order. The source is the path of the j1
+# field the column is read from, [] marks arrays of which the first element
+# is used. Columns without a source are computed by the ETL job: row ids and
+# the parsed observation time.
+Column = namedtuple('Column', ['name', 'type', 'source'])
+
+CURATED_COLUMNS = [
+    Column('id', 'long', None),
+    Column('index', 'int', None),
+    Column('localObsTimeStamp', 'timestamp', None),
+    Column('localObsDate', 'date', None),
+    Column('FeelsLikeC', 'int', 'current_condition[].FeelsLikeC'),
+    Column('FeelsLikeF', 'int', 'current_condition[].FeelsLikeF'),
+    Column('cloudcover', 'int', 'current_condition[].cloudcover'),
+    Column('humidity', 'int', 'current_condition[].humidity'),
+    Column('precipInches', 'float', 'current_condition[].precipInches'),
+    Column('precipMM', 'float', 'current_condition[].precipMM'),
+    Column('pressure', 'int', 'current_condition[].pressure'),
+    Column('pressureInches', 'int', 'current_condition[].pressureInches'),
+    Column('temp_C', 'int', 'current_condition[].temp_C'),
+    Column('temp_F', 'int', 'current_condition[].temp_F'),
+    Column('uvIndex', 'int', 'current_condition[].uvIndex'),
+    Column('visibility', 'int', 'current_condition[].visibility'),
+    Column('visibilityMiles', 'int', 'current_condition[].visibilityMiles'),
+    Column('winddirDegree', 'int', 'current_condition[].winddirDegree'),
+    Column('windspeedKmph', 'int', 'current_condition[].windspeedKmph'),
+    Column('windspeedMiles', 'int', 'current_condition[].windspeedMiles'),
+    Column('areaName', 'string', 'nearest_area[].areaName[].value'),
+    Column('region', 'string', 'nearest_area[].region[].value'),
+    Column('country', 'string', 'nearest_area[].country[].value'),
+    Column('latitude', 'float', 'nearest_area[].latitude'),
+    Column('longitude', 'float', 'nearest_area[].longitude'),
+    Column('population', 'long', 'nearest_area[].population'),
+]
+
+# The observation time the computed columns are parsed from
+LOCAL_OBS_DATETIME_SOURCE = 'current_condition[].localObsDateTime'
+
+# Payloads missing these cannot be placed in a curated partition
+REQUIRED_SOURCES = [LOCAL_OBS_DATETIME_SOURCE, 'nearest_area[].areaName[].value']
+
+# Scalar fields of the forecast table copied from weather[d] and weather[d].hourly[h]
+FORECAST_DAY_FIELDS = ['maxtempC', 'mintempC', 'avgtempC', 'sunHour', 'totalSnow_cm']
+FORECAST_HOURLY_FIELDS = [
+    'tempC', 'tempF', 'FeelsLikeC', 'DewPointC', 'HeatIndexC', 'WindChillC',
+    'WindGustKmph', 'windspeedKmph', 'winddirDegree', 'winddir16Point',
+    'cloudcover', 'humidity', 'pressure', 'visibility', 'uvIndex', 'precipMM',
+    'chanceofrain', 'chanceofsnow', 'chanceofthunder', 'chanceofsunshine',
+    'chanceoffog', 'chanceofwindy', 'weatherCode',
+]
+
+# Every field the pipeline reads: the sources of the curated and forecast
+# columns, and the value arrays the relationalize flattening of job_script.py
+# joins on. Payloads projected to these (see project) are read by the ETL
+# like full payloads, the other fields are null. [] keeps every element of
+# an array.
+PIPELINE_SOURCES = (
+    [column.source for column in CURATED_COLUMNS if column.source is not None]
+    + [LOCAL_OBS_DATETIME_SOURCE, 'current_condition[].weatherDesc[].value']
+    + [f'nearest_area[].{name}[].value' for name in ('areaName', 'country', 'region')]
+    + [f'weather[].{field}' for field in ['date'] + FORECAST_DAY_FIELDS]
+    + [f'weather[].hourly[].{field}' for field in ['time', 'weatherDesc[].value'] + FORECAST_HOURLY_FIELDS]
+)
+
+PARTITION_KEYS = ['areaName', 'localObsDate']
+
+# Spark percent-encodes these characters in partition directory names, and
+# writes nulls to the Hive default partition
+ESCAPED_CHARACTERS = set('"#%\'*/:=?\\{[]^\x7f') | {chr(code) for code in range(0x20)}
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Glue Data Catalog (Hive) names of the column types
+CATALOG_TYPES = {'long': 'bigint', 'int': 'int', 'float': 'float', 'string': 'string',
+                 'timestamp': 'timestamp', 'date': 'date'}
+
+
+def field_name(field):
+    return field if isinstance(field, str) else field[0]
+
+
+def source_steps(source):
+    # 'nearest_area[].areaName[].value' -> [('nearest_area', True), ('areaName', True), ('value', False)]
+    return [(step[:-2], True) if step.endswith('[]') else (step, False) for step in source.split('.')]
+
+
+def relationalize_path(source):
+    # Relationalize names the element of an array column '{column}.val'
+    return '.'.join(f'{name}.val' if is_array else name for name, is_array in source_steps(source))
+
+
+# Parsed once, converting a record only walks these
+SOURCED_COLUMNS = [(column.name, column.type, source_steps(column.source))
+                   for column in CURATED_COLUMNS if column.source is not None]
+LOCAL_OBS_DATETIME_STEPS = source_steps(LOCAL_OBS_DATETIME_SOURCE)
+REQUIRED_STEPS = [(source, source_steps(source)) for source in REQUIRED_SOURCES]
+SECTION_FIELD_NAMES = [(section, [field_name(field) for field in fields])
+                       for section, fields in J1_SECTIONS if section in VALIDATED_SECTIONS]
+
+
+def projection(sources):
+    # {field: nested projection, or None to keep the whole value} of the paths
+    tree = {}
+    for source in sources:
+        node = tree
+        *parents, (leaf, _) = source_steps(source)
+        for name, _ in parents:
+            if name in node and node[name] is None:
+                break
+            node = node.setdefault(name, {})
+        else:
+            node.setdefault(leaf, None)
+    return tree
+
+
+PIPELINE_PROJECTION = projection(PIPELINE_SOURCES)
+
+
+def project(value, tree=PIPELINE_PROJECTION):
+    # Copy of the document with only the fields of the projection, arrays are
+    # projected element by element
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {name: project(value[name], subtree) for name, subtree in tree.items() if name in value}
+    return value
+
+
+def extract(record, steps):
+    # Value at the path, or None when any step is missing or empty
+    value = record
+    for name, is_array in steps:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+        if is_array:
+            value = value[0] if isinstance(value, list) and value else None
+    return value
+
+
+def parse_local_obs_datetime(value):
+    if not value:
+        return None
+    return datetime.strptime(value, LOCAL_OBS_DATETIME_FORMAT)
+
+
+# Errors of values that cannot be parsed or cast to their column type
+CAST_ERRORS = (TypeError, ValueError, OverflowError)
+
+
+def cast(value, column_type):
+    # wttr.in returns every scalar as a string, empty strings are treated as null
+    if value is None or value == '':
+        return None
+    if column_type in ('int', 'long'):
+        return int(float(value))
+    if column_type == 'float':
+        return float(value)
+    return value
+
+
+def cast_or_null(value, column_type):
+    # Values that cannot be cast are null, like the casts of ApplyMapping and Spark
+    try:
+        return cast(value, column_type)
+    except CAST_ERRORS:
+        return None
+
+
+def convert(record):
+    # Typed values of the curated columns read from the record, the ETL job
+    # adds the row ids. Values that cannot be parsed or cast are null, like
+    # in the other engines, validate reports them.
+    try:
+        local_obs_timestamp = parse_local_obs_datetime(extract(record, LOCAL_OBS_DATETIME_STEPS))
+    except CAST_ERRORS:
+        local_obs_timestamp = None
+    row = {
+        'localObsTimeStamp': local_obs_timestamp,
+        'localObsDate': local_obs_timestamp.date() if local_obs_timestamp else None,
+    }
+
+    for name, column_type, steps in SOURCED_COLUMNS:
+        row[name] = cast_or_null(extract(record, steps), column_type)
+
+    return row
+
+
+def validate(record):
+    # Problems that would break or poison the ETL, an empty list when the
+    # record is valid. Fields added upstream are not problems.
+    if not isinstance(record, dict):
+        return [f'Expected a j1 document, got {type(record).__name__}']
+
+    problems = []
+    for section, names in SECTION_FIELD_NAMES:
+        items = record.get(section)
+        if not isinstance(items, list) or not items or not isinstance(items[0], dict):
+            problems.append(f'Missing section {section}')
+            continue
+        missing = [name for name in names if name not in items[0]]
+        if missing:
+            problems.append(f'Missing fields in {section}: {", ".join(missing)}')
+
+    for source, steps in REQUIRED_STEPS:
+        if extract(record, steps) in (None, ''):
+            problems.append(f'Missing required value {source}')
+
+    try:
+        parse_local_obs_datetime(extract(record, LOCAL_OBS_DATETIME_STEPS))
+    except CAST_ERRORS:
+        problems.append(f'Invalid {LOCAL_OBS_DATETIME_SOURCE}, expected {LOCAL_OBS_DATETIME_FORMAT}')
+
+    for name, column_type, steps in SOURCED_COLUMNS:
+        try:
+            cast(extract(record, steps), column_type)
+        except CAST_ERRORS:
+            problems.append(f'Invalid {column_type} value for {name}')
+
+    return problems
+
+
+def escape_partition_value(value):
+    if value is None or value == '':
+        return NULL_PARTITION
+
+    return ''.join(f'%{ord(character):02X}' if character in ESCAPED_CHARACTERS else character
+                   for character in str(value))
+
+
+def partition_path(values):
+    # Directory of a curated partition relative to the table, as Spark writes it
+    return '/'.join(f'{name}={escape_partition_value(value)}' for name, value in zip(PARTITION_KEYS, values))
+
+
+def apply_mapping():
+    # (source, output column, type) mappings of ApplyMapping, for the frame
+    # built by relationalizing the raw table
+    return [(f'`{relationalize_path(column.source)}`', column.name, column.type) if column.source
+            else (column.name, f'`{column.name}`', column.type)
+            for column in CURATED_COLUMNS]
+
+
+def catalog_columns(columns):
+    # (name, catalog type) of the columns
+    return [(column.name, CATALOG_TYPES[column.type]) for column in columns]
@@ -0,0 +1,16 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The lambda and glue directories are deployed as flat assets, so add them to
+# the import path the same way the runtimes see them
+for asset_dir in ('lambda', 'glue'):
+    sys.path.insert(0, os.path.join(ROOT_DIR, asset_dir))
+
+os.environ.setdefault('INGEST_BUCKET', 'test-ingest-bucket')
+os.environ.setdefault('RAW_DATA_PATH', 'weather_data_raw')
+os.environ.setdefault('LOCATION_QUERY_STRING', 'Melbourne VIC')
+os.environ.setdefault('GLUE_DATABASE', 'wttr_in_data')
+os.environ.setdefault('GLUE_TABLE', 'weather_data_raw')
+os.environ.setdefault('PARQUET_DATA_PATH', 'weather_data_parquet')
@@ -0,0 +1,112 @@
+import gzip
+import json
+import os
+from datetime import date, datetime
+
+import arrow_flatten
+import weather_schema
+
+SAMPLE_RAW_DATA = os.path.join(os.path.dirname(__file__), '..', '..', 'glue', 'sample_raw_data.json')
+
+
+def load_sample():
+    with open(SAMPLE_RAW_DATA, 'rb') as sample:
+        return arrow_flatten.load_records(sample.read())
+
+
+def test_flatten_sample_matches_apply_mapping_columns():
+    table = arrow_flatten.flatten_records(load_sample())
+
+    assert table.schema == arrow_flatten.CURATED_SCHEMA
+    assert table.num_rows == 1
+
+    row = table.to_pylist()[0]
+    assert row['id'] == 1
+    assert row['index'] == 0
+    assert row['localObsTimeStamp'] == datetime(2022, 6, 23, 23, 59)
+    assert row['localObsDate'] == date(2022, 6, 23)
+    assert row['temp_C'] == 12
+    assert row['windspeedKmph'] == 41
+    assert row['precipMM'] == 0.0
+    assert row['areaName'] == 'Melbourne'
+    assert row['region'] == 'Victoria'
+    assert row['country'] == 'Australia'
+    assert row['population'] == 4246375
+    assert abs(row['latitude'] - -37.817) < 1e-4
+
+
+def test_missing_and_empty_values_are_null():
+    record = {
+        'current_condition': [{'temp_C': '', 'localObsDateTime': '2022-06-24 1:05 AM'}],
+        'nearest_area': [],
+    }
+
+    row = arrow_flatten.flatten_records([record]).to_pylist()[0]
+
+    assert row['temp_C'] is None
+    assert row['areaName'] is None
+    assert row['localObsTimeStamp'] == datetime(2022, 6, 24, 1, 5)
+
+
+def test_malformed_values_are_null():
+    # ApplyMapping and the spark engine cast these to null rather than failing the run
+    record, = load_sample()
+    record['current_condition'][0]['temp_C'] = 'abc'
+    record['current_condition'][0]['localObsDateTime'] = 'yesterday'
+    record['weather'][0]['hourly'][0]['tempC'] = 'n/a'
+
+    row, forecast = arrow_flatten.flatten_record_with_forecast(record)
+
+    assert (row['temp_C'], row['localObsTimeStamp'], row['localObsDate']) == (None, None, None)
+    assert row['windspeedKmph'] == 41
+    assert forecast[0]['tempC'] is None
+    assert weather_schema.validate(record) == [
+        'Invalid current_condition[].localObsDateTime, expected %Y-%m-%d %I:%M %p', 'Invalid int value for temp_C']
+
+
+def test_batches_and_line_delimited_input():
+    record = load_sample()[0]
+    lines = '\n'.join(json.dumps(record) for _ in range(5))
+
+    records = arrow_flatten.load_records(lines)
+    batches = list(arrow_flatten.iter_flattened_batches(records, batch_size=2))
+
+    assert len(records) == 5
+    assert [batch.num_rows for batch in batches] == [2, 2, 1]
+    assert batches[-1].column(0).to_pylist() == [5]
+
+
+def test_gzipped_compacted_input():
+    record = load_sample()[0]
+    compacted = gzip.compress('\n'.join(json.dumps(record) for _ in range(3)).encode())
+
+    assert arrow_flatten.flatten_records(arrow_flatten.load_records(compacted)).num_rows == 3
+
+
+def test_forecast_rows_from_same_parse():
+    record = load_sample()[0]
+
+    row, forecast_rows = arrow_flatten.flatten_record_with_forecast(record)
+    table = arrow_flatten.flatten_forecast_records([record])
+
+    # 3 forecast days of 8 three-hourly forecasts
+    assert len(forecast_rows) == 24
+    assert table.schema == arrow_flatten.FORECAST_SCHEMA
+    assert table.column('forecastTime').to_pylist() == [
+        forecast_row['forecastTime'] for forecast_row in forecast_rows]
+
+    last = forecast_rows[-1]
+    assert last['localObsTimeStamp'] == row['localObsTimeStamp']
+    assert last['areaName'] == 'Melbourne'
+    assert last['forecastDayIndex'] == 2
+    assert last['forecastTime'] == datetime(2022, 6, 25, 21, 0)
+    assert isinstance(last['tempC'], int)
+    assert isinstance(last['weatherDesc'], str)
+
+
+def test_projected_payloads_flatten_like_full_payloads():
+    record = load_sample()[0]
+    projected = weather_schema.project(record)
+
+    assert arrow_flatten.flatten_record(projected) == arrow_flatten.flatten_record(record)
+    assert list(arrow_flatten.flatten_forecast(projected)) == list(arrow_flatten.flatten_forecast(record))
@@ -0,0 +1,148 @@
+import json
+import os
+from datetime import datetime
+from urllib.parse import unquote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import backfill
+import parquet_layout
+
+SAMPLE_RAW_DATA = os.path.join(os.path.dirname(__file__), '..', '..', 'glue', 'sample_raw_data.json')
+
+
+def sample_record(area_name, local_obs_datetime, temp_c=12):
+    with open(SAMPLE_RAW_DATA) as sample:
+        record = json.load(sample)
+    record['nearest_area'][0]['areaName'] = [{'value': area_name}]
+    record['current_condition'][0]['localObsDateTime'] = local_obs_datetime
+    record['current_condition'][0]['temp_C'] = str(temp_c)
+    return record
+
+
+def put_raw(raw_dir, location, day, hour, record):
+    directory = raw_dir / f'location={location}' / f'date={day}' / f'hour={hour:02d}'
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / f'{day}T{hour:02d}:00:00Z.json').write_text(json.dumps(record))
+
+
+def read_curated(output_dir):
+    rows = []
+    for path in sorted(output_dir.rglob('*.parquet')):
+        partition = dict(unquote(part).split('=', 1) for part in path.relative_to(output_dir).parts[:-1])
+        rows += [dict(row, **partition) for row in pq.read_table(path).to_pylist()]
+    return sorted((row['areaName'], row['localObsTimeStamp'].isoformat(), row['temp_C']) for row in rows)
+
+
+@pytest.fixture
+def raw_dir(tmp_path):
+    raw_dir = tmp_path / 'raw'
+    put_raw(raw_dir, 'Melbourne_VIC', '2022-06-23', 13, sample_record('Melbourne', '2022-06-23 01:00 PM'))
+    put_raw(raw_dir, 'Melbourne_VIC', '2022-06-23', 14, sample_record('Melbourne', '2022-06-23 02:00 PM'))
+    put_raw(raw_dir, 'Melbourne_VIC', '2022-06-24', 0, sample_record('Melbourne', '2022-06-23 11:59 PM'))
+    put_raw(raw_dir, 'St_Kilda', '2022-06-24', 1, sample_record('St: Kilda', '2022-06-24 01:00 AM'))
+    # Outside of the date range
+    put_raw(raw_dir, 'St_Kilda', '2022-06-25', 1, sample_record('St: Kilda', '2022-06-25 01:00 AM'))
+    return raw_dir
+
+
+def run(raw_dir, output_dir, state, **kwargs):
+    return backfill.backfill(str(raw_dir), str(output_dir), '2022-06-23', '2022-06-24',
+                             state_path=str(state), progress=lambda message: None, **kwargs)
+
+
+def test_backfill_merges_into_partitions(tmp_path, raw_dir):
+    output_dir = tmp_path / 'curated'
+    # Stored rows, one of them reprocessed with a corrected temperature
+    stored = pa.Table.from_pylist([
+        {'localObsTimeStamp': datetime.fromisoformat('2022-06-23T09:00:00'), 'temp_C': 5},
+        {'localObsTimeStamp': datetime.fromisoformat('2022-06-23T13:00:00'), 'temp_C': 99},
+    ], schema=backfill.PARTITION_SCHEMA)
+    parquet_layout.write_partition(stored, backfill.fs.LocalFileSystem(),
+                                   f'{output_dir}/areaName=Melbourne/localObsDate=2022-06-23')
+
+    summary = run(raw_dir, output_dir, tmp_path / 'state.json', workers=1)
+
+    assert summary['units'] == 4
+    assert summary['objects'] == 4
+    assert summary['rows'] == 4
+    assert summary['partitions'] == 2
+    assert summary['stale_rollup_months'] == [['Melbourne', '2022-06'], ['St: Kilda', '2022-06']]
+    assert read_curated(output_dir) == [
+        ('Melbourne', '2022-06-23T09:00:00', 5),
+        ('Melbourne', '2022-06-23T13:00:00', 12),
+        ('Melbourne', '2022-06-23T14:00:00', 12),
+        ('Melbourne', '2022-06-23T23:59:00', 12),
+        ('St: Kilda', '2022-06-24T01:00:00', 12),
+    ]
+    assert [path.name for path in (output_dir / 'areaName=St%3A Kilda').iterdir()] == ['localObsDate=2022-06-24']
+    assert not os.path.exists(f'{tmp_path / "state.json"}.staging')
+
+
+def test_merged_rows_are_unique_per_observation():
+    def rows(*values):
+        return pa.Table.from_pylist([{'localObsTimeStamp': datetime(2022, 6, 23, hour), 'temp_C': temp_c}
+                                     for hour, temp_c in values], schema=backfill.PARTITION_SCHEMA)
+
+    # The hourly and compacted raw objects of an hour both hold its observation
+    merged = backfill.merge_rows(rows((13, 12), (14, 12), (13, 12)), rows((9, 5), (13, 99)))
+
+    assert [(row['localObsTimeStamp'].hour, row['temp_C']) for row in merged.to_pylist()] == [
+        (13, 12), (14, 12), (9, 5)]
+    assert merged.schema == backfill.PARTITION_SCHEMA
+
+
+def test_backfill_is_idempotent(tmp_path, raw_dir):
+    output_dir = tmp_path / 'curated'
+
+    run(raw_dir, output_dir, tmp_path / 'first.json', workers=1)
+    first = read_curated(output_dir)
+    run(raw_dir, output_dir, tmp_path / 'second.json', workers=1)
+
+    assert read_curated(output_dir) == first
+    assert len(list(output_dir.rglob('*.parquet'))) == 2
+
+
+def test_backfill_resumes_after_an_interruption(tmp_path, raw_dir, monkeypatch):
+    output_dir = tmp_path / 'curated'
+    state = tmp_path / 'state.json'
+    write_partition = parquet_layout.write_partition
+    calls = []
+
+    def interrupted(table, filesystem, partition_dir, *args, **kwargs):
+        # The second partition is interrupted after writing part of its files
+        calls.append(partition_dir)
+        paths = write_partition(table, filesystem, partition_dir, *args, **kwargs)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return paths
+
+    monkeypatch.setattr(parquet_layout, 'write_partition', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run(raw_dir, output_dir, state, workers=1)
+    monkeypatch.setattr(parquet_layout, 'write_partition', write_partition)
+
+    summary = run(raw_dir, output_dir, state, workers=1)
+
+    assert summary['partitions'] == 2
+    assert len(read_curated(output_dir)) == 4
+    assert len(list(output_dir.rglob('*.parquet'))) == 2
+
+
+def test_backfill_in_a_process_pool(tmp_path, raw_dir):
+    output_dir = tmp_path / 'curated'
+
+    summary = run(raw_dir, output_dir, tmp_path / 'state.json', workers=2, locations=['Melbourne_VIC'])
+
+    assert summary['units'] == 2
+    assert [row[0] for row in read_curated(output_dir)] == ['Melbourne'] * 3
+
+
+def test_state_belongs_to_its_settings(tmp_path, raw_dir):
+    state = tmp_path / 'state.json'
+    run(raw_dir, tmp_path / 'curated', state, workers=1)
+
+    with pytest.raises(ValueError):
+        run(raw_dir, tmp_path / 'other', state, workers=1)
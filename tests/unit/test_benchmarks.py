@@ -0,0 +1,54 @@
+import importlib
+import json
+import os
+
+from benchmarks import run, simulate_polling
+from benchmarks.generate_payloads import generate_payloads
+
+
+def test_generated_payloads_vary_by_location_and_hour():
+    payloads = list(generate_payloads(locations=3, hours=2))
+
+    assert len(payloads) == 6
+    assert {(location, event_time) for location, event_time, _ in payloads} == {
+        (f'Location {number:04d}', f'2022-06-23T{hour:02d}:00:00Z')
+        for number in range(3) for hour in range(2)}
+
+    observations = {payload['current_condition'][0]['localObsDateTime'] for _, _, payload in payloads}
+    assert len(observations) == 2
+    assert payloads[0][2]['nearest_area'][0]['areaName'] == [{'value': 'Location 0000'}]
+
+
+def test_run_reports_json(tmp_path):
+    output = tmp_path / 'report.json'
+
+    # The handler benchmark reconfigures get_data through the environment
+    environ = dict(os.environ)
+    try:
+        run.main(['--locations', '2', '--hours', '2', '--invocations', '1', '--repeat', '1',
+                  '--cold-starts', '1', '--output', str(output)])
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        import get_data
+        importlib.reload(get_data)
+
+    report = json.loads(output.read_text())
+    assert report['transform']['flatten_current_condition']['records'] == 4
+    assert report['transform']['flatten_forecast']['peak_memory_bytes'] > 0
+    assert report['codecs']['gzip']['stored_bytes'] < report['codecs']['none']['stored_bytes']
+    assert report['handler']['uploaded_objects'] == 2
+    assert report['handler']['phases']['fetch']['count'] == 2
+    assert report['cold_start']['median_import_seconds'] > 0
+    assert report['cold_start']['median_first_invocation_seconds'] > 0
+    assert 'boto3' not in report['cold_start']['imports_ms']
+
+
+def test_simulate_polling_compares_policies():
+    recording = simulate_polling.synthetic_recording(locations=4, hours=12)
+    report = simulate_polling.compare(recording, max_fetches=2)
+
+    assert report['fixed']['observations'] == report['adaptive']['observations']
+    assert report['adaptive']['captured'] >= report['fixed']['captured']
+    assert report['adaptive']['mean_staleness_minutes'] < report['fixed']['mean_staleness_minutes']
+    assert report['adaptive']['peak_fetches_per_tick'] <= 2
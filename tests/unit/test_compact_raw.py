@@ -0,0 +1,100 @@
+import gzip
+import io
+import json
+from datetime import date
+
+import compact_raw
+
+
+class LocalS3:
+    # Minimal local stand-in for the S3 client calls used by compact_raw
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        if Delimiter is None:
+            yield {'Contents': [{'Key': key} for key in keys]}
+        else:
+            prefixes = sorted({Prefix + key[len(Prefix):].split(Delimiter)[0] + Delimiter
+                               for key in keys if Delimiter in key[len(Prefix):]})
+            yield {'CommonPrefixes': [{'Prefix': prefix} for prefix in prefixes]}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def delete_objects(self, Bucket, Delete):
+        for s3_object in Delete['Objects']:
+            self.objects.pop(s3_object['Key'], None)
+
+
+def hourly_key(location, hour):
+    return f'raw/location={location}/date=2022-06-23/hour={hour:02d}/2022-06-23T{hour:02d}:00:00Z.json'
+
+
+def put_hourly(s3, location, hour):
+    s3.objects[hourly_key(location, hour)] = json.dumps(
+        {'hour': hour, 'location': location}, indent=4).encode()
+
+
+def compacted_records(s3, key):
+    return [json.loads(line) for line in gzip.decompress(s3.objects[key]).decode().splitlines()]
+
+
+def test_compaction_rolls_up_day_and_is_rerunnable():
+    s3 = LocalS3()
+    for hour in range(3):
+        put_hourly(s3, 'Melbourne', hour)
+        put_hourly(s3, 'Sydney', hour)
+
+    results = compact_raw.compact(s3, 's3://bucket/raw/', 's3://bucket/state/', today=date(2022, 6, 24))
+
+    assert results == [('Melbourne', '2022-06-23', 1), ('Sydney', '2022-06-23', 1)]
+    output = 'raw/location=Melbourne/date=2022-06-23/hour=all/compacted-0001.jsonl.gz'
+    assert [record['hour'] for record in compacted_records(s3, output)] == [0, 1, 2]
+    assert hourly_key('Melbourne', 0) not in s3.objects
+
+    # Re-running without new objects changes nothing
+    before = dict(s3.objects)
+    compact_raw.compact(s3, 's3://bucket/raw/', 's3://bucket/state/', today=date(2022, 6, 24))
+    assert s3.objects == before
+
+    # A late object produces the next generation
+    put_hourly(s3, 'Melbourne', 23)
+    compact_raw.compact(s3, 's3://bucket/raw/', 's3://bucket/state/', today=date(2022, 6, 24))
+
+    assert output not in s3.objects
+    records = compacted_records(
+        s3, 'raw/location=Melbourne/date=2022-06-23/hour=all/compacted-0002.jsonl.gz')
+    assert [record['hour'] for record in records] == [0, 1, 2, 23]
+
+
+def test_interrupted_run_deletes_leftover_sources():
+    s3 = LocalS3()
+    put_hourly(s3, 'Melbourne', 0)
+    compact_raw.compact(s3, 's3://bucket/raw', 's3://bucket/state', today=date(2022, 6, 24))
+
+    # The source survived a failed delete
+    put_hourly(s3, 'Melbourne', 0)
+    compact_raw.compact(s3, 's3://bucket/raw', 's3://bucket/state', today=date(2022, 6, 24))
+
+    manifest = json.loads(s3.objects['state/location=Melbourne/date=2022-06-23.json'])
+    assert manifest['generation'] == 1
+    assert manifest['records'] == 1
+    assert hourly_key('Melbourne', 0) not in s3.objects
+
+
+def test_today_is_not_compacted():
+    assert compact_raw.compaction_dates(date(2022, 6, 24), 2) == ['2022-06-22', '2022-06-23']
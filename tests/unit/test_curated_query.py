@@ -0,0 +1,164 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytest
+from pyarrow import fs
+
+import arrow_flatten
+import curated_query
+import parquet_layout
+import weather_schema
+
+SAMPLE_RAW_DATA = os.path.join(os.path.dirname(__file__), '..', '..', 'glue', 'sample_raw_data.json')
+
+PARTITION_COLUMNS = [name for name in arrow_flatten.CURATED_SCHEMA.names if name not in weather_schema.PARTITION_KEYS]
+
+
+def observations(area, start, hours):
+    with open(SAMPLE_RAW_DATA) as sample_file:
+        sample = json.load(sample_file)
+
+    records = []
+    for hour in range(hours):
+        observed_at = start + timedelta(hours=hour)
+        record = json.loads(json.dumps(sample))
+        record['current_condition'][0]['localObsDateTime'] = observed_at.strftime(weather_schema.LOCAL_OBS_DATETIME_FORMAT)
+        record['current_condition'][0]['temp_C'] = str(hour)
+        record['nearest_area'][0]['areaName'] = [{'value': area}]
+        records.append(record)
+    return arrow_flatten.flatten_records(records)
+
+
+def write_table(root, table):
+    # One set of files per partition, without the partition columns like Spark
+    for day in sorted(set(table.column('localObsDate').to_pylist())):
+        rows = table.filter(pc.equal(table.column('localObsDate'), pa.scalar(day, pa.date32())))
+        area = rows.column('areaName')[0].as_py()
+        parquet_layout.write_partition(rows.select(PARTITION_COLUMNS), fs.LocalFileSystem(),
+                                       f'{root}/{weather_schema.partition_path([area, day])}')
+
+
+@pytest.fixture
+def table_dir(tmp_path):
+    # Two days of hourly observations of two areas
+    write_table(tmp_path, observations('Melbourne', datetime(2022, 6, 22, 0, 0), 48))
+    write_table(tmp_path, observations('Sydney/CBD', datetime(2022, 6, 22, 0, 0), 48))
+    return tmp_path
+
+
+def test_time_range_of_an_area(table_dir):
+    table = curated_query.CuratedTable(str(table_dir))
+
+    rows = table.query('Melbourne', datetime(2022, 6, 22, 20, 0), datetime(2022, 6, 23, 2, 0), ['temp_C', 'areaName'])
+
+    assert rows.column_names == ['temp_C', 'areaName']
+    assert rows.column('temp_C').to_pylist() == [20, 21, 22, 23, 24, 25]
+    assert set(rows.column('areaName').to_pylist()) == {'Melbourne'}
+
+
+def test_partitions_outside_the_range_are_not_read(table_dir, monkeypatch):
+    table = curated_query.CuratedTable(str(table_dir))
+    read = []
+    original_read = table.read
+    monkeypatch.setattr(table, 'read', lambda paths, *args: read.append(paths) or original_read(paths, *args))
+
+    rows = table.query('Sydney/CBD', datetime(2022, 6, 23, 22, 0))
+
+    assert [os.path.basename(os.path.dirname(path)) for path in read[0]] == ['localObsDate=2022-06-23']
+    assert '%2F' in read[0][0]
+    assert rows.column('localObsTimeStamp').to_pylist() == [datetime(2022, 6, 23, 22, 0), datetime(2022, 6, 23, 23, 0)]
+    assert rows.column('areaName').to_pylist() == ['Sydney/CBD'] * 2
+    assert rows.schema == arrow_flatten.CURATED_SCHEMA
+
+
+def test_files_with_nanosecond_timestamps(tmp_path):
+    # Spark writes timestamps as INT96, read back with nanoseconds
+    rows = observations('Melbourne', datetime(2022, 6, 23, 0, 0), 3).select(PARTITION_COLUMNS)
+    rows = rows.set_column(rows.schema.get_field_index('localObsTimeStamp'), 'localObsTimeStamp',
+                           rows.column('localObsTimeStamp').cast(pa.timestamp('ns')))
+    partition_dir = tmp_path / weather_schema.partition_path(['Melbourne', '2022-06-23'])
+    partition_dir.mkdir(parents=True)
+    pq.write_table(rows, partition_dir / 'part-00000-spark.c000.snappy.parquet')
+
+    result = curated_query.CuratedTable(str(tmp_path)).query('Melbourne', datetime(2022, 6, 23, 1, 0))
+
+    assert result.column('temp_C').to_pylist() == [1, 2]
+
+
+def test_unknown_areas_and_columns(table_dir):
+    table = curated_query.CuratedTable(str(table_dir))
+
+    assert table.query('Nowhere', columns=['temp_C']).column_names == ['temp_C']
+    assert table.query('Nowhere').num_rows == 0
+    with pytest.raises(ValueError):
+        table.query('Melbourne', columns=['tempC'])
+
+
+def test_results_are_cached_until_new_partitions_appear(table_dir):
+    now = [0.0]
+    table = curated_query.CuratedTable(str(table_dir), refresh_seconds=60, clock=lambda: now[0])
+
+    first = table.recent('Melbourne', hours=6, columns=['temp_C'], now=datetime(2022, 6, 23, 23, 40))
+    second = table.recent('Melbourne', hours=6, columns=['temp_C'], now=datetime(2022, 6, 23, 23, 55))
+    assert second is first
+    assert first.column('temp_C').to_pylist() == [41, 42, 43, 44, 45, 46, 47]
+    assert table.cache.stats()['hits'] == 1
+
+    # A new day lands, it is seen once the listing is refreshed
+    write_table(table_dir, observations('Melbourne', datetime(2022, 6, 24, 0, 0), 2))
+    assert table.recent('Melbourne', hours=6, columns=['temp_C'], now=datetime(2022, 6, 23, 23, 59)) is first
+
+    now[0] = 61
+    third = table.recent('Melbourne', hours=6, columns=['temp_C'], now=datetime(2022, 6, 23, 23, 59))
+    assert third.column('temp_C').to_pylist() == [41, 42, 43, 44, 45, 46, 47, 0, 1]
+
+    # Partitions outside of a range do not invalidate it
+    historical = table.query('Melbourne', datetime(2022, 6, 22), datetime(2022, 6, 23))
+    write_table(table_dir, observations('Melbourne', datetime(2022, 6, 25, 0, 0), 1))
+    assert table.query('Melbourne', datetime(2022, 6, 22), datetime(2022, 6, 23), refresh=True) is historical
+
+
+def test_recent_rows_end_at_the_latest_observation_of_the_area(table_dir):
+    table = curated_query.CuratedTable(str(table_dir))
+
+    assert table.latest_observation('Melbourne') == datetime(2022, 6, 23, 23, 0)
+    assert table.recent('Melbourne', hours=3, columns=['temp_C']).column('temp_C').to_pylist() == [44, 45, 46, 47]
+    assert table.latest_observation('Nowhere') is None
+    assert table.recent('Nowhere', columns=['temp_C']).num_rows == 0
+
+
+def test_rewritten_partitions_invalidate_cached_results(table_dir):
+    table = curated_query.CuratedTable(str(table_dir), refresh_seconds=0)
+    before = table.query('Melbourne', datetime(2022, 6, 23), columns=['temp_C'])
+
+    partition_dir = f'{table_dir}/{weather_schema.partition_path(["Melbourne", "2022-06-23"])}'
+    for name in os.listdir(partition_dir):
+        os.remove(os.path.join(partition_dir, name))
+    write_table(table_dir, observations('Melbourne', datetime(2022, 6, 23, 0, 0), 1))
+
+    after = table.query('Melbourne', datetime(2022, 6, 23), columns=['temp_C'])
+    assert before.num_rows == 24
+    assert after.column('temp_C').to_pylist() == [0]
+
+
+def test_cache_evicts_least_recently_used_results():
+    cache = curated_query.ResultCache(max_bytes=200)
+    tables = {key: pa.table({'value': pa.array(range(10), pa.int64())}) for key in 'abc'}
+
+    cache.put('a', 1, tables['a'])
+    cache.put('b', 1, tables['b'])
+    assert cache.get('a', 1) is tables['a']
+    cache.put('c', 1, tables['c'])
+
+    assert cache.get('b', 1) is None
+    assert cache.get('a', 1) is tables['a']
+    assert cache.get('a', 2) is None
+    assert cache.stats() == {'entries': 2, 'bytes': 160, 'hits': 2, 'misses': 2, 'evictions': 1}
+
+    # Results larger than the cache are not kept
+    cache.put('d', 1, pa.table({'value': pa.array(range(100), pa.int64())}))
+    assert cache.get('d', 1) is None
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+import dedup
+
+
+def payload(**current_condition):
+    return {'current_condition': [dict({'localObsDateTime': '2022-06-23 11:59 PM'}, **current_condition)]}
+
+
+def test_observation_fingerprint_ignores_other_fields():
+    first = json.dumps(payload(temp_C='12')).encode()
+    second = json.dumps(payload(temp_C='13')).encode()
+
+    assert dedup.fingerprint(first, 'observation') == '2022-06-23 11:59 PM'
+    assert dedup.fingerprint(first, 'observation') == dedup.fingerprint(second, 'observation')
+
+
+def test_content_fingerprint_ignores_formatting_only():
+    compact = json.dumps(payload(temp_C='12'), separators=(',', ':')).encode()
+    indented = json.dumps(payload(temp_C='12'), indent=4).encode()
+    changed = json.dumps(payload(temp_C='13')).encode()
+
+    assert dedup.fingerprint(compact, 'content') == dedup.fingerprint(indented, 'content')
+    assert dedup.fingerprint(compact, 'content') != dedup.fingerprint(changed, 'content')
+
+
+def test_off_and_unknown_modes():
+    assert dedup.fingerprint(b'not json', 'off') is None
+    assert not dedup.is_duplicate({}, 'Melbourne VIC', None)
+
+    with pytest.raises(ValueError):
+        dedup.fingerprint(b'{}', 'sometimes')
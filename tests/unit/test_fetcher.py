@@ -0,0 +1,181 @@
+import time
+
+import pytest
+import urllib3
+
+import fetcher
+from benchmarks.local_services import scripted_service
+
+# Short timeouts and backoff so the tests run fast
+POLICY = fetcher.DEFAULT_POLICY._replace(
+    connect_timeout=0.5, read_timeout=0.3, backoff_base=0.01, backoff_cap=0.02)
+
+
+def new_fetcher(policy=POLICY):
+    return fetcher.Fetcher(urllib3.PoolManager(retries=False), policy)
+
+
+def test_retryable_statuses_are_retried():
+    with scripted_service([(503, 0), (429, 0), (200, 0)], body=b'{"ok": true}') as service:
+        metrics = {}
+        response = new_fetcher().fetch(f'{service.url}/Melbourne?format=j1', metrics=metrics)
+
+    assert response == fetcher.Response(200, b'{"ok": true}')
+    assert metrics['Attempts'] == 3
+    assert len(service.requests) == 3
+
+
+def test_other_statuses_are_returned_right_away():
+    with scripted_service([(404, 0), (200, 0)]) as service:
+        response = new_fetcher().fetch(f'{service.url}/Nowhere?format=j1')
+
+    assert response.status_code == 404
+    assert len(service.requests) == 1
+
+
+def test_last_response_is_returned_when_attempts_run_out():
+    with scripted_service([(502, 0)]) as service:
+        response = new_fetcher(POLICY._replace(max_attempts=2)).fetch(service.url)
+
+    assert response.status_code == 502
+    assert len(service.requests) == 2
+
+
+def test_last_response_is_returned_when_a_later_attempt_fails():
+    with scripted_service([(503, 0), (200, 1.0)]) as service:
+        response = new_fetcher(POLICY._replace(max_attempts=2)).fetch(service.url)
+
+    assert response.status_code == 503
+    assert len(service.requests) == 2
+
+
+def test_slow_responses_time_out_and_are_retried():
+    with scripted_service([(200, 1.0), (200, 0)]) as service:
+        started = time.monotonic()
+        response = new_fetcher().fetch(service.url)
+        elapsed = time.monotonic() - started
+
+    assert response.status_code == 200
+    assert len(service.requests) == 2
+    assert elapsed < 1.0
+
+
+def test_timeouts_are_raised_when_attempts_run_out():
+    with scripted_service([(200, 1.0)]) as service:
+        with pytest.raises(urllib3.exceptions.HTTPError):
+            new_fetcher(POLICY._replace(max_attempts=2)).fetch(service.url)
+
+
+def test_fetches_stop_at_the_deadline():
+    policy = POLICY._replace(read_timeout=5.0)
+
+    with scripted_service([(200, 2.0)]) as service:
+        started = time.monotonic()
+        with pytest.raises(fetcher.DeadlineExceeded):
+            new_fetcher(policy).fetch(service.url, deadline=time.monotonic() + 0.3)
+        elapsed = time.monotonic() - started
+
+    assert elapsed < 1.0
+
+
+def test_no_retry_is_started_past_the_deadline():
+    policy = POLICY._replace(backoff_base=1.0, backoff_cap=1.0, max_attempts=5)
+
+    with scripted_service([(503, 0)]) as service:
+        started = time.monotonic()
+        response = new_fetcher(policy).fetch(service.url, deadline=time.monotonic() + 0.2)
+        elapsed = time.monotonic() - started
+
+    # The last response is returned rather than sleeping past the deadline
+    assert response.status_code == 503
+    assert elapsed < 0.2
+
+
+def test_deadline_from_context():
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 10000
+
+    assert fetcher.deadline_from_context(None) is None
+    assert 8 < fetcher.deadline_from_context(Context(), reserve_seconds=1.5) - time.monotonic() <= 8.5
+
+
+def test_slow_requests_are_hedged():
+    policy = POLICY._replace(read_timeout=5.0, hedge_percentile=95, hedge_min_samples=5)
+    http_fetcher = new_fetcher(policy)
+
+    with scripted_service([(200, 0)] * 5 + [(200, 2.0), (200, 0)]) as service:
+        for _ in range(5):
+            http_fetcher.fetch(service.url)
+
+        metrics = {}
+        started = time.monotonic()
+        response = http_fetcher.fetch(service.url, metrics=metrics)
+        elapsed = time.monotonic() - started
+
+    assert response.status_code == 200
+    assert metrics == {'Attempts': 1, 'Hedged': 1}
+    assert len(service.requests) == 7
+    assert elapsed < 1.0
+
+
+def test_requests_are_not_hedged_without_enough_samples():
+    policy = POLICY._replace(hedge_percentile=95, hedge_min_samples=5)
+
+    with scripted_service([(200, 0)]) as service:
+        metrics = {}
+        new_fetcher(policy).fetch(service.url, metrics=metrics)
+
+    assert 'Hedged' not in metrics
+
+
+def test_circuit_opens_after_consecutive_failures():
+    policy = POLICY._replace(max_attempts=1, failure_threshold=2, reset_seconds=0.2)
+    http_fetcher = new_fetcher(policy)
+
+    with scripted_service([(503, 0), (503, 0), (200, 0)]) as service:
+        assert http_fetcher.fetch(service.url).status_code == 503
+        assert http_fetcher.fetch(service.url).status_code == 503
+        with pytest.raises(fetcher.CircuitOpenError):
+            http_fetcher.fetch(service.url)
+        assert len(service.requests) == 2
+
+        # A trial request goes through once the reset time has passed, and
+        # closes the circuit when it succeeds
+        time.sleep(0.25)
+        assert http_fetcher.fetch(service.url).status_code == 200
+        assert http_fetcher.fetch(service.url).status_code == 200
+
+
+def test_deadlines_do_not_open_the_circuit():
+    policy = POLICY._replace(read_timeout=5.0, max_attempts=1, failure_threshold=1)
+    http_fetcher = new_fetcher(policy)
+
+    with scripted_service([(200, 0.5), (200, 0)]) as service:
+        with pytest.raises(fetcher.DeadlineExceeded):
+            http_fetcher.fetch(service.url, deadline=time.monotonic() + 0.1)
+
+        assert http_fetcher.fetch(service.url).status_code == 200
+
+
+def test_failed_trial_request_opens_the_circuit_again():
+    now = [0.0]
+    breaker = fetcher.CircuitBreaker(failure_threshold=1, reset_seconds=10, clock=lambda: now[0])
+
+    breaker.record(False)
+    assert not breaker.allow()
+
+    now[0] = 10.0
+    assert breaker.allow()
+    # Only one trial request at a time
+    assert not breaker.allow()
+
+    breaker.record(False)
+    assert not breaker.allow()
+    now[0] = 20.0
+    assert breaker.allow()
+    # A trial request cut off by the deadline does not hold the circuit half-open
+    breaker.cancel()
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.allow()
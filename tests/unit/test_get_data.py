@@ -0,0 +1,308 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+
+import get_data
+import raw_codec
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=b'{}'):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode()
+
+
+class FakeS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Body, Key, **kwargs):
+        with self.lock:
+            self.objects[Key] = Body
+
+
+def test_get_locations_from_event_and_env(monkeypatch):
+    monkeypatch.setattr(get_data, 'LOCATION_QUERY_STRING', 'Melbourne VIC; Sydney NSW')
+
+    assert get_data.get_locations({}) == ['Melbourne VIC', 'Sydney NSW']
+    assert get_data.get_locations({'locations': ['Perth WA']}) == ['Perth WA']
+
+
+def test_handler_fans_out_concurrently(monkeypatch):
+    s3 = FakeS3()
+    active = []
+    peak = []
+
+    def fake_get_weather_data(query_string, deadline=None):
+        active.append(query_string)
+        peak.append(len(active))
+        time.sleep(0.05)
+        active.remove(query_string)
+        if query_string == 'Nowhere':
+            return FakeResponse(404, b'Unknown location')
+        return FakeResponse(content=json.dumps({'location': query_string}).encode())
+
+    monkeypatch.setattr(get_data, 'MAX_CONCURRENCY', 4)
+    monkeypatch.setattr(get_data, 'DEDUP_MODE', 'off')
+    monkeypatch.setattr(get_data, 'get_weather_data', fake_get_weather_data)
+    monkeypatch.setattr(get_data, 's3_client', lambda: s3)
+
+    locations = [f'City {i}' for i in range(8)] + ['Nowhere']
+    response = get_data.handler(
+        {'time': '2022-06-23T14:00:00Z', 'locations': locations}, None)
+    body = json.loads(response['body'])
+
+    assert response['statusCode'] == 207
+    assert body['uploaded'] == 8
+    assert body['failed'] == 1
+    assert 1 < max(peak) <= 4
+    assert raw_codec.decode(s3.objects['weather_data_raw/location=City_0/date=2022-06-23/hour=14/2022-06-23T14:00:00Z.json.gz']) == b'{"location": "City+0"}'
+    assert [result['location'] for result in body['results']] == locations
+
+
+def test_unchanged_observations_are_skipped(monkeypatch):
+    s3 = FakeS3()
+    observations = {'Melbourne VIC': '2022-06-23 11:59 PM', 'Sydney NSW': '2022-06-23 11:30 PM'}
+
+    def fake_get_weather_data(query_string, deadline=None):
+        location = query_string.replace('+', ' ')
+        return FakeResponse(content=json.dumps(
+            {'current_condition': [{'localObsDateTime': observations[location]}]}).encode())
+
+    monkeypatch.setattr(get_data, 'DEDUP_MODE', 'observation')
+    monkeypatch.setattr(get_data, 'RAW_CODEC', 'none')
+    monkeypatch.setattr(get_data, 'get_weather_data', fake_get_weather_data)
+    monkeypatch.setattr(get_data, 's3_client', lambda: s3)
+    event = {'locations': list(observations)}
+
+    first = json.loads(get_data.handler(dict(event, time='2022-06-23T14:00:00Z'), None)['body'])
+    assert (first['uploaded'], first['duplicates']) == (2, 0)
+
+    # Only Sydney published a new observation
+    observations['Sydney NSW'] = '2022-06-24 12:30 AM'
+    response = get_data.handler(dict(event, time='2022-06-23T15:00:00Z'), None)
+    second = json.loads(response['body'])
+
+    assert response['statusCode'] == 200
+    assert (second['uploaded'], second['duplicates']) == (1, 1)
+    assert 'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=15/2022-06-23T15:00:00Z.json' not in s3.objects
+    assert 'weather_data_raw/location=Sydney_NSW/date=2022-06-23/hour=15/2022-06-23T15:00:00Z.json' in s3.objects
+
+    index = json.loads(s3.objects['ingest_state/last_seen.json'])
+    assert index['Sydney NSW']['fingerprint'] == '2022-06-24 12:30 AM'
+
+
+def test_direct_invocations_use_the_current_time(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(get_data, 'DEDUP_MODE', 'off')
+    monkeypatch.setattr(get_data, 'get_weather_data', lambda query_string, deadline=None: FakeResponse())
+    monkeypatch.setattr(get_data, 's3_client', lambda: s3)
+
+    response = get_data.handler({'locations': ['Melbourne VIC']}, None)
+
+    assert response['statusCode'] == 200
+    key = json.loads(response['body'])['results'][0]['path']
+    event_time = key.rsplit('/', 1)[-1].split('.', 1)[0]
+    assert key.endswith(f'/date={event_time[:10]}/hour={event_time[11:13]}/{event_time}.json.gz')
+    assert time.strptime(event_time, '%Y-%m-%dT%H:%M:%SZ')
+
+
+def test_state_read_errors_are_reported_per_location(monkeypatch):
+    class FailingS3(FakeS3):
+        def get_object(self, Bucket, Key):
+            raise RuntimeError('Access denied')
+
+    s3 = FailingS3()
+    fetched = []
+    monkeypatch.setattr(get_data, 'DEDUP_MODE', 'observation')
+    monkeypatch.setattr(get_data, 'get_weather_data', lambda query_string, deadline=None: fetched.append(query_string))
+    monkeypatch.setattr(get_data, 's3_client', lambda: s3)
+
+    response = get_data.handler({'time': '2022-06-23T14:00:00Z', 'locations': ['Melbourne VIC', 'Perth WA']}, None)
+    body = json.loads(response['body'])
+
+    assert response['statusCode'] == 502
+    assert body['failed'] == 2
+    assert [(result['location'], result['error']) for result in body['results']] == [
+        ('Melbourne VIC', 'Access denied'), ('Perth WA', 'Access denied')]
+    assert not fetched
+
+    # The poll schedule of scheduled invocations is not overwritten either
+    monkeypatch.setattr(get_data, 'POLL_MODE', 'adaptive')
+    response = get_data.handler({'time': '2022-06-23T14:00:00Z'}, None)
+    assert response['statusCode'] == 502
+    assert not fetched
+    assert not s3.objects
+
+
+def test_handler_emits_phase_metrics(monkeypatch, capsys):
+    s3 = FakeS3()
+
+    monkeypatch.setattr(get_data, 'DEDUP_MODE', 'off')
+    monkeypatch.setattr(get_data, 'get_weather_data', lambda query_string, deadline=None: FakeResponse(content=b'{}'))
+    monkeypatch.setattr(get_data, 's3_client', lambda: s3)
+
+    get_data.handler({'time': '2022-06-23T14:00:00Z', 'locations': ['Melbourne VIC']}, None)
+    documents = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    phases = {document['Phase']: document for document in documents}
+
+    assert {'encode', 'put', 'handler'} <= set(phases)
+    assert phases['put']['Bytes'] == phases['encode']['StoredBytes']
+    assert (phases['handler']['Uploaded'], phases['handler']['Failed']) == (1, 0)
+
+
+def test_adaptive_polling_only_fetches_due_locations(monkeypatch):
+    s3 = FakeS3()
+    fetched = []
+
+    def fake_get_weather_data(query_string, deadline=None):
+        fetched.append(query_string)
+        return FakeResponse(content=json.dumps(
+            {'current_condition': [{'localObsDateTime': '2022-06-23 11:30 PM'}]}).encode())
+
+    monkeypatch.setattr(get_data, 'POLL_MODE', 'adaptive')
+    monkeypatch.setattr(get_data, 'LOCATION_QUERY_STRING', 'Melbourne VIC; Sydney NSW')
+    monkeypatch.setattr(get_data, 'get_weather_data', fake_get_weather_data)
+    monkeypatch.setattr(get_data, 's3_client', lambda: s3)
+
+    # Melbourne was fetched recently and is not due yet
+    schedule = {'Melbourne VIC': {'next_fetch_at': time.time() + 600}}
+    s3.objects['ingest_state/poll_schedule.json'] = json.dumps(schedule).encode()
+
+    body = json.loads(get_data.handler({'time': '2022-06-23T14:00:00Z'}, None)['body'])
+
+    assert fetched == ['Sydney+NSW']
+    assert (body['uploaded'], body['skipped']) == (1, 1)
+
+    schedule = json.loads(s3.objects['ingest_state/poll_schedule.json'])
+    assert schedule['Sydney NSW']['observations'] == ['2022-06-23 11:30 PM']
+    assert schedule['Sydney NSW']['next_fetch_at'] > time.time()
+
+
+@pytest.mark.parametrize('mode', ['quarantine', 'reject'])
+def test_invalid_payloads_are_not_stored_as_raw_data(monkeypatch, mode):
+    s3 = FakeS3()
+
+    monkeypatch.setattr(get_data, 'VALIDATION_MODE', mode)
+    monkeypatch.setattr(get_data, 'DEDUP_MODE', 'off')
+    monkeypatch.setattr(get_data, 'RAW_CODEC', 'none')
+    monkeypatch.setattr(get_data, 'get_weather_data', lambda query_string, deadline=None: FakeResponse(content=b'{"current_condition": []}'))
+    monkeypatch.setattr(get_data, 's3_client', lambda: s3)
+
+    response = get_data.handler({'time': '2022-06-23T14:00:00Z', 'locations': ['Melbourne VIC']}, None)
+    body = json.loads(response['body'])
+
+    assert response['statusCode'] == 502
+    assert (body['uploaded'], body['invalid']) == (0, 1)
+    assert 'Missing section current_condition' in body['results'][0]['problems']
+    assert not any(key.startswith('weather_data_raw/') for key in s3.objects)
+
+    quarantined = [key for key in s3.objects if key.startswith('weather_data_quarantine/')]
+    if mode == 'quarantine':
+        assert quarantined == ['weather_data_quarantine/location=Melbourne_VIC/date=2022-06-23/hour=14/2022-06-23T14:00:00Z.json']
+    else:
+        assert quarantined == []
+
+
+def test_projected_payloads_are_stored_with_an_audit_copy(monkeypatch):
+    s3 = FakeS3()
+    payload = {
+        'current_condition': [{'localObsDateTime': '2022-06-23 02:00 PM', 'temp_C': '12',
+                               'weatherIconUrl': [{'value': 'https://example.com/icon.png'}]}],
+        'nearest_area': [{'areaName': [{'value': 'Melbourne'}]}],
+        'request': [{'query': 'Melbourne', 'type': 'City'}],
+    }
+    content = json.dumps(payload, indent=4).encode()
+
+    monkeypatch.setattr(get_data, 'PROJECTION_MODE', 'pipeline')
+    monkeypatch.setattr(get_data, 'AUDIT_DATA_PATH', 'weather_data_audit')
+    monkeypatch.setattr(get_data, 'DEDUP_MODE', 'content')
+    monkeypatch.setattr(get_data, 'RAW_CODEC', 'none')
+    monkeypatch.setattr(get_data, 'get_weather_data', lambda query_string, deadline=None: FakeResponse(content=content))
+    monkeypatch.setattr(get_data, 's3_client', lambda: s3)
+
+    event = {'time': '2022-06-23T14:00:00Z', 'locations': ['Melbourne VIC']}
+    assert get_data.handler(event, None)['statusCode'] == 200
+
+    raw_key = 'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=14/2022-06-23T14:00:00Z.json'
+    assert json.loads(s3.objects[raw_key]) == {
+        'current_condition': [{'localObsDateTime': '2022-06-23 02:00 PM', 'temp_C': '12'}],
+        'nearest_area': [{'areaName': [{'value': 'Melbourne'}]}],
+    }
+    assert s3.objects['weather_data_audit' + raw_key[len('weather_data_raw'):]] == content
+
+    # The fingerprint is taken from the stored payload
+    body = json.loads(get_data.handler(dict(event, time='2022-06-23T15:00:00Z'), None)['body'])
+    assert body['duplicates'] == 1
+
+
+def test_clients_are_reused_across_invocations(monkeypatch):
+    from benchmarks.local_services import wttr_in_service
+
+    monkeypatch.setattr(get_data, '_http_pool', None)
+    monkeypatch.setattr(get_data, '_fetcher', None)
+    assert get_data.s3_client() is get_data.s3_client()
+
+    with wttr_in_service({'Melbourne': b'{"current_condition": []}'}) as wttr_in:
+        monkeypatch.setattr(get_data, 'WTTR_IN_URL', wttr_in.url)
+        responses = [get_data.get_weather_data('Melbourne') for _ in range(3)]
+
+        # One kept-alive connection served every request
+        assert get_data.http_pool().connection_from_url(wttr_in.url).num_connections == 1
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert responses[0].content == b'{"current_condition": []}'
+
+
+def test_ingest_package_includes_every_imported_module():
+    import ast
+    import os
+
+    from wttr_in_data.wttr_in_data_stack import GET_DATA_ASSET_EXCLUDE
+
+    with open(get_data.__file__) as source:
+        tree = ast.parse(source.read())
+    imported = {alias.name.split('.')[0] for node in ast.walk(tree) if isinstance(node, ast.Import)
+                for alias in node.names}
+    local_modules = {name[:-len('.py')] for name in os.listdir(os.path.dirname(get_data.__file__))}
+
+    assert imported & local_modules
+    assert not {f'{name}.py' for name in imported & local_modules} & set(GET_DATA_ASSET_EXCLUDE)
+
+
+def test_failing_upstream_is_retried_then_cut_off(monkeypatch, capsys):
+    import fetcher
+    from benchmarks.local_services import scripted_service
+
+    monkeypatch.setattr(get_data, 'FETCH_POLICY', get_data.FETCH_POLICY._replace(
+        max_attempts=2, backoff_base=0.01, backoff_cap=0.01, failure_threshold=2))
+    monkeypatch.setattr(get_data, '_http_pool', None)
+    monkeypatch.setattr(get_data, '_fetcher', None)
+
+    with scripted_service([(503, 0), (200, 0), (503, 0)]) as wttr_in:
+        monkeypatch.setattr(get_data, 'WTTR_IN_URL', wttr_in.url)
+        assert get_data.get_weather_data('Melbourne').status_code == 200
+        assert get_data.get_weather_data('Melbourne').status_code == 503
+        capsys.readouterr()
+
+        # Two failures in a row open the circuit, no request is sent
+        response = get_data.get_weather_data('Melbourne', deadline=time.monotonic() + 5)
+        assert len(wttr_in.requests) == 4
+
+    assert response == fetcher.Response(503, f'Circuit open for {wttr_in.url[len("http://"):]}'.encode())
+    metrics = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert metrics['CircuitOpen'] == 1
@@ -0,0 +1,43 @@
+import pytest
+
+import instrumentation
+
+
+def test_phase_emits_embedded_metric_format():
+    lines = []
+
+    with instrumentation.phase('get_data', 'put', {'Key': 'raw/a.json'}, write=lines.append) as metrics:
+        metrics['Bytes'] = 42
+
+    document, = lines
+    directive, = document['_aws']['CloudWatchMetrics']
+    units = {metric['Name']: metric['Unit'] for metric in directive['Metrics']}
+
+    assert (document['Service'], document['Phase'], document['Key']) == ('get_data', 'put', 'raw/a.json')
+    assert document['Bytes'] == 42 and document['Errors'] == 0 and document['DurationMs'] >= 0
+    assert directive['Dimensions'] == [['Service', 'Phase']]
+    assert units == {'Bytes': 'Bytes', 'Errors': 'Count', 'DurationMs': 'Milliseconds'}
+    # Properties are logged but are not metrics
+    assert 'Key' not in units
+
+
+def test_failed_phase_is_emitted_and_raises():
+    lines = []
+
+    with pytest.raises(RuntimeError):
+        with instrumentation.phase('etl_job', 'write', write=lines.append):
+            raise RuntimeError('write failed')
+
+    assert lines[0]['Errors'] == 1
+
+
+def test_profile_only_when_enabled():
+    lines = []
+
+    with instrumentation.profiled(False, 'disabled', write=lines.append) as profile:
+        assert profile is None
+    with instrumentation.profiled(True, 'enabled', write=lines.append):
+        sorted(range(1000), reverse=True)
+
+    assert [line['Profile'] for line in lines] == ['enabled']
+    assert 'cumulative' in lines[0]['Stats']
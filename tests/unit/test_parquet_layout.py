@@ -0,0 +1,84 @@
+import json
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from pyarrow import fs
+
+import parquet_layout
+
+
+def hourly_rows(hours, start=datetime(2022, 6, 23)):
+    return pa.table({
+        'localObsTimeStamp': [start + timedelta(hours=hour) for hour in hours],
+        'temp_C': [hour % 30 for hour in hours],
+    })
+
+
+def test_write_partition_sorts_and_splits_files(tmp_path):
+    filesystem = fs.LocalFileSystem()
+    table = hourly_rows(list(reversed(range(1000))))
+    row_bytes = parquet_layout.estimate_row_bytes(table, 'zstd')
+
+    paths = parquet_layout.write_partition(
+        table, filesystem, f'{tmp_path}/areaName=Melbourne/localObsDate=2022-06-23',
+        codec='zstd', target_file_bytes=row_bytes * 300)
+
+    assert len(paths) == 4
+    assert all(path.endswith('.zstd.parquet') for path in paths)
+    assert pq.read_metadata(paths[0]).row_group(0).column(0).compression == 'ZSTD'
+
+    timestamps = pa.concat_tables([pq.read_table(path) for path in sorted(paths)]).column(
+        'localObsTimeStamp').to_pylist()
+    assert timestamps == sorted(timestamps)
+
+
+def test_unsupported_codec():
+    with pytest.raises(ValueError):
+        parquet_layout.write_partition(hourly_rows([0]), fs.LocalFileSystem(), '/tmp/unused', codec='lz0')
+
+
+def test_optimize_rewrites_fragmented_partitions_only(tmp_path):
+    filesystem = fs.LocalFileSystem()
+    fragmented = f'{tmp_path}/areaName=Melbourne/localObsDate=2022-06-23'
+    compact = f'{tmp_path}/areaName=Sydney/localObsDate=2022-06-23'
+
+    # One tiny file per hourly run, written out of order
+    for hour in (5, 1, 3, 0, 2, 4):
+        parquet_layout.write_partition(hourly_rows([hour]), filesystem, fragmented)
+    compact_paths = parquet_layout.write_partition(hourly_rows(range(6)), filesystem, compact)
+
+    optimized = parquet_layout.optimize(filesystem, str(tmp_path))
+
+    assert optimized == [fragmented]
+    files = parquet_layout.list_partition_files(filesystem, str(tmp_path))
+    assert len(files[fragmented]) == 1
+    assert [file_info.path for file_info in files[compact]] == compact_paths
+
+    rows = pq.read_table(files[fragmented][0].path).column('localObsTimeStamp').to_pylist()
+    assert rows == [datetime(2022, 6, 23) + timedelta(hours=hour) for hour in range(6)]
+
+
+def timestamp_unit(path):
+    logical_type = pq.read_metadata(path).schema.column(0).logical_type
+    return logical_type.type, json.loads(logical_type.to_json())['timeUnit']
+
+
+def test_nanosecond_timestamps_are_written_as_micros(tmp_path):
+    filesystem = fs.LocalFileSystem()
+    partition_dir = f'{tmp_path}/areaName=Melbourne/localObsDate=2022-06-23'
+    # Spark INT96 timestamps are read back as nanoseconds
+    spark_rows = hourly_rows(range(3)).cast(
+        pa.schema([('localObsTimeStamp', pa.timestamp('ns')), ('temp_C', pa.int64())]))
+    filesystem.create_dir(partition_dir, recursive=True)
+    pq.write_table(spark_rows, f'{partition_dir}/part-00000-spark.parquet', use_deprecated_int96_timestamps=True)
+
+    paths = parquet_layout.write_partition(spark_rows, filesystem, partition_dir)
+    assert timestamp_unit(paths[0]) == ('TIMESTAMP', 'microseconds')
+
+    # Spark and pyarrow files are merged into one
+    parquet_layout.optimize(filesystem, str(tmp_path))
+    files = parquet_layout.list_partition_files(filesystem, str(tmp_path))[partition_dir]
+    assert len(files) == 1
+    assert timestamp_unit(files[0].path) == ('TIMESTAMP', 'microseconds')
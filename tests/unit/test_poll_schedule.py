@@ -0,0 +1,151 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import poll_schedule
+
+START = datetime(2022, 6, 23, 14, 0)
+# Observations become visible upstream this long after their local time
+DELAY = 10 * 60
+
+
+def observation_at(minutes):
+    return (START + timedelta(minutes=minutes)).strftime(poll_schedule.LOCAL_OBS_DATETIME_FORMAT)
+
+
+def epoch(minutes):
+    return poll_schedule.parse_observation(observation_at(minutes))
+
+
+def test_cadence_is_learned_from_observations():
+    state = None
+    for minutes in (0, 30, 60, 120):
+        state = poll_schedule.record_fetch(state, 'Melbourne VIC', epoch(minutes) + DELAY, 'ok',
+                                           observation_at(minutes))
+
+    # One observation was skipped upstream, the median ignores it
+    assert poll_schedule.cadence_seconds(state) == 30 * 60
+    assert poll_schedule.cadence_seconds({}) == poll_schedule.MIN_CADENCE_SECONDS
+
+
+def test_next_fetch_follows_the_learned_delay():
+    state = None
+    now = epoch(0) + DELAY
+    for minutes in (0, 60, 120):
+        now = epoch(minutes) + DELAY
+        state = poll_schedule.record_fetch(state, 'Melbourne VIC', now, 'ok', observation_at(minutes))
+
+    # The fetches so far only bound the delay from above, the next one probes earlier
+    assert state['next_fetch_at'] == epoch(180) + DELAY - poll_schedule.RECHECK_SECONDS
+
+    # It is too early, the observation is rechecked and seen
+    state = poll_schedule.record_fetch(state, 'Melbourne VIC', state['next_fetch_at'], 'ok', observation_at(120))
+    assert state['misses'] == 1
+    assert state['next_fetch_at'] == epoch(180) + DELAY
+    state = poll_schedule.record_fetch(state, 'Melbourne VIC', state['next_fetch_at'], 'ok', observation_at(180))
+
+    # The delay is now bracketed by the miss and the hit
+    assert epoch(240) + DELAY - poll_schedule.RECHECK_SECONDS < state['next_fetch_at'] <= epoch(240) + DELAY
+
+
+def test_missing_observations_are_rechecked_at_growing_intervals():
+    state = poll_schedule.record_fetch(None, 'Melbourne VIC', epoch(0) + DELAY, 'ok', observation_at(0))
+    state = poll_schedule.record_fetch(state, 'Melbourne VIC', epoch(60) + DELAY, 'ok', observation_at(60))
+
+    intervals = []
+    now = epoch(60) + DELAY
+    for _ in range(4):
+        now = max(now, state['next_fetch_at'])
+        state = poll_schedule.record_fetch(state, 'Melbourne VIC', now, 'ok', observation_at(60))
+        intervals.append(state['next_fetch_at'] - now)
+
+    assert intervals[1:] == sorted(intervals[1:])
+    assert all(interval <= poll_schedule.MAX_INTERVAL_SECONDS for interval in intervals)
+
+
+@pytest.mark.parametrize('outcome, factor', [('error', 1), ('throttled', poll_schedule.THROTTLED_BACKOFF_FACTOR)])
+def test_failures_back_off_with_jitter(outcome, factor):
+    rng = random.Random(0)
+    state = None
+    backoffs = []
+    for failure in range(1, 5):
+        state = poll_schedule.record_fetch(state, 'Melbourne VIC', 0, outcome, rng=rng)
+        backoff = poll_schedule.BACKOFF_SECONDS * factor * 2 ** (failure - 1)
+        assert backoff / 2 <= state['next_fetch_at'] <= backoff
+        backoffs.append(state['next_fetch_at'])
+
+    assert state['failures'] == 4
+    assert backoffs == sorted(backoffs)
+
+    state = poll_schedule.record_fetch(state, 'Melbourne VIC', 0, 'ok', observation_at(0))
+    assert state['failures'] == 0
+
+
+def test_malformed_observations_keep_the_cadence():
+    state = poll_schedule.record_fetch(None, 'Melbourne VIC', epoch(DELAY // 60), 'ok', observation_at(0))
+    state = poll_schedule.record_fetch(state, 'Melbourne VIC', epoch(60 + DELAY // 60), 'ok', observation_at(60))
+
+    for observation in ('yesterday', ''):
+        malformed = poll_schedule.record_fetch(state, 'Melbourne VIC', epoch(125), 'ok', observation)
+
+        assert malformed['observations'] == state['observations']
+        assert poll_schedule.cadence_seconds(malformed) == 3600
+        assert malformed['misses'] == 1
+
+
+def test_due_locations_are_limited_to_the_most_overdue():
+    states = {
+        'Melbourne VIC': {'next_fetch_at': 100},
+        'Sydney NSW': {'next_fetch_at': 50},
+        'Perth WA': {'next_fetch_at': 500},
+    }
+    locations = ['Melbourne VIC', 'Sydney NSW', 'Perth WA', 'Hobart TAS']
+
+    assert poll_schedule.due_locations(locations, states, 200) == ['Hobart TAS', 'Sydney NSW', 'Melbourne VIC']
+    assert poll_schedule.due_locations(locations, states, 200, max_fetches=2) == ['Hobart TAS', 'Sydney NSW']
+
+
+@pytest.mark.parametrize('derived_budget, observations_seen', [(False, 0), (True, 5)])
+def test_more_locations_than_the_fetch_limit(derived_budget, observations_seen):
+    # 200 hourly locations and 4 fetches per 5 minute tick, 48 an hour
+    locations = [f'Location {number}' for number in range(200)]
+    states = {}
+    seen = {location: set() for location in locations}
+    rng = random.Random(1)
+
+    for minutes in range(0, 4 * 60, 5):
+        now = epoch(minutes)
+        budget = poll_schedule.fetch_budget(locations, states, 5 * 60, 4) if derived_budget else 4
+        # The observation of the hour is visible DELAY after it
+        latest = observation_at((minutes * 60 - DELAY) // 3600 * 60)
+        for location in poll_schedule.due_locations(locations, states, now, budget):
+            seen[location].add(latest)
+            states[location] = poll_schedule.record_fetch(states.get(location), location, now, 'ok', latest, rng)
+
+    # A fixed limit leaves locations unfetched for hours, the derived budget
+    # sees every hourly observation of every location
+    assert min(len(observations) for observations in seen.values()) == observations_seen
+
+
+def test_fetch_budget_follows_the_cadences():
+    hourly = {'observations': [observation_at(0), observation_at(60)]}
+    states = {f'Location {number}': hourly for number in range(120)}
+
+    assert poll_schedule.fetch_budget(list(states), states, 5 * 60) is None
+    # 120 hourly locations need 10 fetches per tick, 15 with the headroom
+    assert poll_schedule.fetch_budget(list(states), states, 5 * 60, 4) == 15
+    assert poll_schedule.fetch_budget(list(states), states, 5 * 60, 20) == 20
+    # Locations not fetched yet count with the shortest cadence
+    assert poll_schedule.fetch_budget(['Hobart TAS'] * 12, {}, 5 * 60, 1) == 6
+
+
+def test_unsupported_outcome():
+    with pytest.raises(ValueError):
+        poll_schedule.record_fetch(None, 'Melbourne VIC', 0, 'timeout')
+
+
+def test_fetch_outcome():
+    assert poll_schedule.fetch_outcome({'statusCode': 200}) == 'ok'
+    assert poll_schedule.fetch_outcome({'statusCode': 429}) == 'throttled'
+    assert poll_schedule.fetch_outcome({'statusCode': 503}) == 'error'
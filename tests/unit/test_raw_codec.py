@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import arrow_flatten
+import compact_raw
+import raw_codec
+
+SAMPLE_RAW_DATA = os.path.join(os.path.dirname(__file__), '..', '..', 'glue', 'sample_raw_data.json')
+
+
+@pytest.fixture
+def sample():
+    with open(SAMPLE_RAW_DATA, 'rb') as sample_file:
+        return sample_file.read()
+
+
+@pytest.mark.parametrize('name', ['none', 'gzip', 'zstd'])
+def test_roundtrip_and_detection(sample, name):
+    encoded = raw_codec.encode(sample, name)
+
+    assert raw_codec.detect_codec(encoded) == name
+    assert raw_codec.decode(encoded) == sample
+    assert raw_codec.decode(encoded, name) == sample
+
+
+def test_gzip_output_is_deterministic(sample):
+    assert raw_codec.encode(sample, 'gzip') == raw_codec.encode(sample, 'gzip')
+    assert len(raw_codec.encode(sample, 'gzip')) < len(sample) / 4
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        raw_codec.encode(b'{}', 'brotli')
+
+
+@pytest.mark.parametrize('name', ['none', 'gzip', 'zstd'])
+def test_readers_decode_any_codec(sample, name):
+    encoded = raw_codec.encode(sample, name)
+
+    assert len(arrow_flatten.load_records(encoded)) == 1
+    assert len(compact_raw.read_records(encoded)) == 1
@@ -0,0 +1,74 @@
+import pytest
+
+import register_partition
+
+
+class LocalCatalog:
+    # Local stand-in for the Glue Data Catalog API used by register_partition
+    def __init__(self):
+        self.partitions = {}
+        self.get_table_calls = 0
+
+    def get_table(self, DatabaseName, Name):
+        self.get_table_calls += 1
+        return {'Table': {'StorageDescriptor': {
+            'Location': 's3://bucket/weather_data_raw/',
+            'SerdeInfo': {'SerializationLibrary': 'org.openx.data.jsonserde.JsonSerDe'},
+        }}}
+
+    def batch_create_partition(self, DatabaseName, TableName, PartitionInputList):
+        errors = []
+        for partition in PartitionInputList:
+            values = tuple(partition['Values'])
+            if values in self.partitions:
+                errors.append({'PartitionValues': list(values),
+                               'ErrorDetail': {'ErrorCode': 'AlreadyExistsException'}})
+            else:
+                self.partitions[values] = partition
+        return {'Errors': errors}
+
+
+def s3_event(*keys):
+    return {'Records': [{'s3': {'bucket': {'name': 'bucket'}, 'object': {'key': key}}}
+                        for key in keys]}
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    register_partition.registered_partitions.clear()
+
+
+def test_parse_partition():
+    assert register_partition.parse_partition(
+        'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=14/2022-06-23T14:00:00Z.json'
+    ) == ('Melbourne_VIC', '2022-06-23', '14')
+    assert register_partition.parse_partition('weather_data_raw/2022-06-23T14:00:00Z.json') is None
+    assert register_partition.parse_partition('other/location=a/date=b/hour=c/x.json') is None
+
+
+def test_partitions_registered_once(monkeypatch):
+    catalog = LocalCatalog()
+    monkeypatch.setattr(register_partition.boto3, 'client', lambda service: catalog)
+
+    response = register_partition.handler(s3_event(
+        'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=14/a.json',
+        'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=14/b.json',
+        'weather_data_raw/location=Sydney_NSW/date=2022-06-23/hour=14/a.json',
+    ), None)
+
+    assert response['registered'] == [
+        ['Melbourne_VIC', '2022-06-23', '14'], ['Sydney_NSW', '2022-06-23', '14']]
+    location = catalog.partitions[('Sydney_NSW', '2022-06-23', '14')]['StorageDescriptor']['Location']
+    assert location == 's3://bucket/weather_data_raw/location=Sydney_NSW/date=2022-06-23/hour=14/'
+
+    # Warm invocations skip the catalog for known partitions
+    register_partition.handler(s3_event(
+        'weather_data_raw/location=Sydney_NSW/date=2022-06-23/hour=14/c.json'), None)
+    assert catalog.get_table_calls == 1
+
+    # A cold container treats existing partitions as registered
+    register_partition.registered_partitions.clear()
+    response = register_partition.handler(s3_event(
+        'weather_data_raw/location=Sydney_NSW/date=2022-06-23/hour=14/c.json'), None)
+    assert response['registered'] == []
+    assert len(catalog.partitions) == 2
@@ -0,0 +1,12 @@
+from datetime import date
+
+import rollups
+
+
+def test_affected_months_and_bounds():
+    partitions = [('Melbourne', date(2022, 12, 31)), ('Melbourne', date(2022, 12, 1)),
+                  ('Sydney', date(2023, 1, 1)), (None, date(2023, 1, 1))]
+
+    assert rollups.affected_months(partitions) == [('Melbourne', '2022-12'), ('Sydney', '2023-01')]
+    assert rollups.month_bounds('2022-12') == (date(2022, 12, 1), date(2023, 1, 1))
+    assert rollups.month_bounds('2023-02') == (date(2023, 2, 1), date(2023, 3, 1))
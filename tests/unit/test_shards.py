@@ -0,0 +1,104 @@
+import io
+import json
+
+import pytest
+
+import shards
+import verify_shards
+
+
+class LocalS3:
+    def __init__(self):
+        self.objects = {}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {'Contents': [{'Key': key} for key in sorted(self.objects) if key.startswith(Prefix)]}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+
+def test_hash_shards_partition_the_areas():
+    areas = [f'Area {number}' for number in range(100)] + [None]
+    parsed = [shards.parse_shard(str(index), '4') for index in range(4)]
+
+    for area in areas:
+        assert sum(shards.owns(shard, area) for shard in parsed) == 1
+    assert shards.shard_of('Melbourne', 4) == shards.shard_of('Melbourne', 4)
+    assert shards.owns(None, 'Melbourne')
+
+
+def test_area_list_shard():
+    shard = shards.parse_shard(areas='St Kilda, Melbourne')
+
+    assert shard.areas == ('Melbourne', 'St Kilda')
+    assert shards.owns(shard, 'Melbourne') and not shards.owns(shard, 'Sydney')
+    assert shards.shard_name(shard).startswith('areas-')
+    assert shards.parse_shard() is None
+
+
+@pytest.mark.parametrize('index, count', [('4', '4'), ('-1', '4'), ('0', '0'), ('1', None)])
+def test_invalid_shards(index, count):
+    with pytest.raises(ValueError):
+        shards.parse_shard(index, count)
+
+
+def test_partition_area():
+    assert shards.partition_area('bucket/curated/areaName=St%3A Kilda/localObsDate=2022-06-23') == 'St: Kilda'
+    assert shards.partition_area('curated/areaName=__HIVE_DEFAULT_PARTITION__/localObsDate=2022-06-23') is None
+
+
+def test_earliest_watermark():
+    watermarks = [
+        {'high_water_mark': '2022-06-23T10:00:00+00:00', 'keys_at_mark': ['a', 'b']},
+        {'high_water_mark': '2022-06-23T10:00:00+00:00', 'keys_at_mark': ['b']},
+        {'high_water_mark': '2022-06-23T10:00:00.500000+00:00', 'keys_at_mark': ['c']},
+    ]
+
+    assert shards.earliest_watermark(watermarks) == {'high_water_mark': '2022-06-23T10:00:00+00:00',
+                                                     'keys_at_mark': ['b']}
+
+
+def save_markers(s3, count, indexes, partitions=None):
+    for index in indexes:
+        shard = shards.Shard(index, count, None)
+        watermark = {'high_water_mark': f'2022-06-23T10:0{index}:00+00:00', 'keys_at_mark': [f'key-{index}']}
+        shard_partitions = (partitions or {}).get(index, [(f'Area {index}', '2022-06-23')])
+        shards.save_marker(s3, 'bucket', shards.marker_key('glue/state/shards', 'wr_1', shard), shard, watermark,
+                           shard_partitions)
+
+
+def test_verify_saves_the_earliest_watermark():
+    s3 = LocalS3()
+    save_markers(s3, 3, range(3))
+
+    watermark, partitions = verify_shards.verify(s3, 's3://bucket/glue/state/shards/', 'wr_1', 3,
+                                                 's3://bucket/glue/state/raw_watermark.json')
+
+    assert partitions == 3
+    assert watermark == {'high_water_mark': '2022-06-23T10:00:00+00:00', 'keys_at_mark': ['key-0']}
+    assert json.loads(s3.objects['glue/state/raw_watermark.json']) == watermark
+
+
+def test_verify_fails_without_every_shard():
+    s3 = LocalS3()
+    save_markers(s3, 3, [0, 2])
+
+    with pytest.raises(RuntimeError, match='shard-001-of-003'):
+        verify_shards.verify(s3, 's3://bucket/glue/state/shards/', 'wr_1', 3,
+                             's3://bucket/glue/state/raw_watermark.json')
+    assert 'glue/state/raw_watermark.json' not in s3.objects
+
+
+def test_verify_fails_when_shards_overlap():
+    s3 = LocalS3()
+    save_markers(s3, 2, range(2), {0: [('Melbourne', '2022-06-23')], 1: [('Melbourne', '2022-06-23')]})
+
+    with pytest.raises(RuntimeError, match='more than one shard'):
+        verify_shards.verify(s3, 's3://bucket/glue/state/shards/', 'wr_1', 2)
@@ -0,0 +1,58 @@
+import pytest
+
+from wttr_in_data.sizing import DEFAULT_WORKLOAD, Workload, fetch_schedule, size
+
+
+def test_default_workload():
+    sizing = size(DEFAULT_WORKLOAD)
+
+    assert (sizing.lambda_memory_mb, sizing.lambda_timeout_seconds, sizing.lambda_architecture) == (256, 15, 'arm64')
+    assert (sizing.glue_worker_type, sizing.glue_worker_count) == ('G.1X', 2)
+    assert sizing.compaction_max_capacity == 0.0625
+
+
+def test_more_locations_raise_concurrency_and_timeout():
+    small = size(Workload(locations=10, fetch_interval_minutes=60, retention_days=365))
+    large = size(Workload(locations=500, fetch_interval_minutes=60, retention_days=365))
+
+    assert large.lambda_concurrency > small.lambda_concurrency
+    assert large.lambda_memory_mb > small.lambda_memory_mb
+    assert large.lambda_timeout_seconds > small.lambda_timeout_seconds
+    assert large.compaction_timeout_minutes > small.compaction_timeout_minutes
+
+
+def test_invocations_fit_the_fetch_interval():
+    sizing = size(Workload(locations=500, fetch_interval_minutes=5, retention_days=30))
+
+    assert sizing.lambda_timeout_seconds <= 5 * 60
+
+    with pytest.raises(ValueError):
+        size(Workload(locations=5000, fetch_interval_minutes=5, retention_days=30))
+
+
+def test_long_retention_uses_larger_and_more_glue_workers():
+    short = size(Workload(locations=500, fetch_interval_minutes=15, retention_days=30))
+    long = size(Workload(locations=500, fetch_interval_minutes=15, retention_days=730))
+
+    assert (short.glue_worker_type, long.glue_worker_type) == ('G.1X', 'G.2X')
+    assert long.glue_worker_count > short.glue_worker_count
+    assert long.glue_job_timeout_minutes > short.glue_job_timeout_minutes
+
+
+@pytest.mark.parametrize('interval, schedule', [
+    (15, {'minute': '0/15', 'hour': '*'}),
+    (60, {'minute': '0', 'hour': '*'}),
+    (180, {'minute': '0', 'hour': '0/3'}),
+])
+def test_fetch_schedule(interval, schedule):
+    assert fetch_schedule(Workload(1, interval, 365)) == schedule
+
+
+@pytest.mark.parametrize('workload', [
+    Workload(locations=0, fetch_interval_minutes=60, retention_days=365),
+    Workload(locations=1, fetch_interval_minutes=45, retention_days=365),
+    Workload(locations=1, fetch_interval_minutes=60, retention_days=0),
+])
+def test_invalid_workloads(workload):
+    with pytest.raises(ValueError):
+        size(workload)
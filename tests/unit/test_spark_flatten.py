@@ -0,0 +1,98 @@
+import gzip
+import json
+import os
+import shutil
+
+import pytest
+
+pyspark = pytest.importorskip('pyspark')
+
+import arrow_flatten  # noqa: E402
+import spark_flatten  # noqa: E402
+import weather_schema  # noqa: E402
+
+SAMPLE_RAW_DATA = os.path.join(os.path.dirname(__file__), '..', '..', 'glue', 'sample_raw_data.json')
+
+
+@pytest.fixture(scope='module')
+def spark():
+    session = spark_flatten.local_session(shuffle_partitions=1)
+    yield session
+    session.stop()
+
+
+def load_sample():
+    with open(SAMPLE_RAW_DATA) as sample:
+        return json.load(sample)
+
+
+def test_curated_columns_match_the_mapping(spark):
+    df = spark_flatten.curated_df(spark_flatten.read_raw(spark, [SAMPLE_RAW_DATA]))
+
+    # Same columns and types as the ApplyMapping of the relationalize engine
+    assert df.schema == spark_flatten.CURATED_SCHEMA
+    assert [(field.name, field.dataType.typeName()) for field in df.schema.fields] == \
+        [(name.strip('`'), spark_flatten.SPARK_TYPES[column_type]) for _, name, column_type in weather_schema.apply_mapping()]
+
+    # Same values as the arrow engine, apart from the row ids
+    rows = [row.asDict() for row in df.collect()]
+    expected = arrow_flatten.flatten_records([load_sample()]).to_pylist()
+    for row in rows + expected:
+        del row['id']
+    assert rows == expected
+
+
+def test_malformed_values_are_null_like_the_arrow_engine(spark, tmp_path):
+    record = load_sample()
+    record['current_condition'][0]['temp_C'] = 'abc'
+    record['current_condition'][0]['humidity'] = '12.5.1'
+    malformed = tmp_path / 'malformed.json'
+    malformed.write_text(json.dumps(record))
+
+    rows = [row.asDict() for row in spark_flatten.curated_df(spark_flatten.read_raw(spark, [str(malformed)])).collect()]
+    expected = arrow_flatten.flatten_records([record]).to_pylist()
+    for row in rows + expected:
+        del row['id']
+
+    assert rows == expected
+    assert (rows[0]['temp_C'], rows[0]['humidity']) == (None, None)
+
+
+def test_hourly_and_compacted_objects(spark, tmp_path):
+    hourly_dir = tmp_path / 'location=Melbourne_VIC' / 'date=2022-06-23' / 'hour=23'
+    compacted_dir = tmp_path / 'location=Melbourne_VIC' / 'date=2022-06-22' / 'hour=all'
+    hourly_dir.mkdir(parents=True)
+    compacted_dir.mkdir(parents=True)
+    shutil.copy(SAMPLE_RAW_DATA, hourly_dir / '2022-06-23T23:00:00Z.json')
+
+    records = []
+    for hour in (1, 2):
+        record = load_sample()
+        record['current_condition'][0]['localObsDateTime'] = f'2022-06-22 {hour}:00 AM'
+        record['current_condition'][0]['temp_C'] = ''
+        records.append(json.dumps(record))
+    with gzip.open(compacted_dir / 'compacted-0001.jsonl.gz', 'wt') as compacted:
+        compacted.write('\n'.join(records) + '\n')
+
+    rows = spark_flatten.curated_df(spark_flatten.read_raw(spark, [str(tmp_path)])) \
+        .select('localObsTimeStamp', 'temp_C').orderBy('localObsTimeStamp').collect()
+
+    assert [(row.localObsTimeStamp.hour, row.temp_C) for row in rows] == [(1, None), (2, None), (23, 12)]
+
+
+def test_forecast_rows(spark):
+    df = spark_flatten.forecast_df(spark_flatten.read_raw(spark, [SAMPLE_RAW_DATA]))
+
+    assert df.count() == arrow_flatten.flatten_forecast_records([load_sample()]).num_rows
+
+
+def test_projected_and_full_payloads_are_read_alike(spark, tmp_path):
+    projected = tmp_path / 'projected.json'
+    projected.write_text(json.dumps(weather_schema.project(load_sample())))
+
+    full_df = spark_flatten.read_raw(spark, [SAMPLE_RAW_DATA])
+    projected_df = spark_flatten.read_raw(spark, [str(projected)])
+
+    assert spark_flatten.curated_df(projected_df).drop('id').collect() == \
+        spark_flatten.curated_df(full_df).drop('id').collect()
+    assert spark_flatten.forecast_df(projected_df).collect() == spark_flatten.forecast_df(full_df).collect()
@@ -0,0 +1,63 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+pyspark = pytest.importorskip('pyspark')
+
+import rollups  # noqa: E402
+import spark_flatten  # noqa: E402
+
+CURATED_COLUMNS = ('areaName string, localObsTimeStamp timestamp, localObsDate date, temp_C int, '
+                   'precipMM float, humidity int, windspeedKmph int')
+
+
+@pytest.fixture(scope='module')
+def spark():
+    session = spark_flatten.local_session(shuffle_partitions=1)
+    yield session
+    session.stop()
+
+
+def observations(area_name, start, hours, temps):
+    timestamps = [start + timedelta(hours=hour) for hour in range(hours)]
+    return [(area_name, timestamp, timestamp.date(), temp, 0.5, 80, 10 + hour % 3)
+            for hour, (timestamp, temp) in enumerate(zip(timestamps, temps))]
+
+
+def test_daily_rollup(spark):
+    # Two days of Melbourne, one missing temperature on the second day
+    curated = spark.createDataFrame(
+        observations('Melbourne', datetime(2022, 6, 30), 24, list(range(24))) +
+        observations('Melbourne', datetime(2022, 7, 1), 2, [10, None]) +
+        observations('Sydney', datetime(2022, 6, 30, 12), 1, [20]) +
+        [('Sydney', None, None, 15, 0.0, 80, 10)], CURATED_COLUMNS)
+
+    daily = {(row['areaName'], row['localObsDate']): row.asDict()
+             for row in rollups.daily_rollup(curated).collect()}
+
+    june = daily[('Melbourne', date(2022, 6, 30))]
+    assert (june['localObsMonth'], june['observations']) == ('2022-06', 24)
+    assert (june['minTempC'], june['maxTempC'], june['meanTempC']) == (0, 23, 11.5)
+    assert june['totalPrecipMM'] == 12.0
+    assert (june['maxWindspeedKmph'], june['meanHumidity']) == (12, 80.0)
+
+    july = daily[('Melbourne', date(2022, 7, 1))]
+    assert (july['observations'], july['countTempC'], july['meanTempC']) == (2, 1, 10.0)
+    # Rows without an observation time are not rolled up
+    assert set(daily) == {('Melbourne', date(2022, 6, 30)), ('Melbourne', date(2022, 7, 1)),
+                          ('Sydney', date(2022, 6, 30))}
+    assert daily[('Sydney', date(2022, 6, 30))]['observations'] == 1
+
+
+def test_monthly_rollup_is_weighted_by_observations(spark):
+    curated = spark.createDataFrame(
+        observations('Melbourne', datetime(2022, 6, 1), 3, [0, 0, 0]) +
+        observations('Melbourne', datetime(2022, 6, 2), 1, [12]), CURATED_COLUMNS)
+
+    monthly, = rollups.monthly_rollup(rollups.daily_rollup(curated)).collect()
+
+    assert (monthly['areaName'], monthly['localObsMonth']) == ('Melbourne', '2022-06')
+    assert (monthly['observations'], monthly['minTempC'], monthly['maxTempC']) == (4, 0, 12)
+    # The mean of the observations, not the mean of the daily means
+    assert monthly['meanTempC'] == 3.0
+    assert monthly['totalPrecipMM'] == 2.0
@@ -0,0 +1,149 @@
+import io
+import json
+import os
+
+import pyarrow.parquet as pq
+import pytest
+
+import raw_codec
+import transform_raw
+
+SAMPLE_RAW_DATA = os.path.join(os.path.dirname(__file__), '..', '..', 'glue', 'sample_raw_data.json')
+
+
+class LocalS3:
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+
+class LocalCatalog:
+    # Local stand-in for the Glue Data Catalog, table_exists is False until
+    # the parquet crawler has run
+    class exceptions:
+        class EntityNotFoundException(Exception):
+            pass
+
+    def __init__(self, table_exists=True):
+        self.table_exists = table_exists
+        self.partitions = {}
+
+    def get_table(self, DatabaseName, Name):
+        if not self.table_exists:
+            raise self.exceptions.EntityNotFoundException(Name)
+        return {'Table': {'StorageDescriptor': {'Location': 's3://bucket/weather_data_parquet/'}}}
+
+    def batch_create_partition(self, DatabaseName, TableName, PartitionInputList):
+        for partition in PartitionInputList:
+            self.partitions[tuple(partition['Values'])] = partition
+        return {'Errors': []}
+
+
+def sqs_event(*keys):
+    return {'Records': [{'messageId': f'message-{index}', 'body': json.dumps({
+        'detail-type': 'Object Created',
+        'detail': {'bucket': {'name': 'bucket'}, 'object': {'key': key}},
+    })} for index, key in enumerate(keys)]}
+
+
+def sample_record(area_name='Melbourne', local_obs_datetime='2022-06-23 11:59 PM'):
+    with open(SAMPLE_RAW_DATA) as sample:
+        record = json.load(sample)
+    record['nearest_area'][0]['areaName'] = [{'value': area_name}]
+    record['current_condition'][0]['localObsDateTime'] = local_obs_datetime
+    return record
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    s3, glue = LocalS3(), LocalCatalog()
+    monkeypatch.setattr(transform_raw.boto3, 'client', lambda service: s3 if service == 's3' else glue)
+    transform_raw.registered_partitions.clear()
+    return s3, glue
+
+
+def test_raw_objects_are_appended_to_their_partitions(clients):
+    s3, glue = clients
+    keys = [
+        'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=13/2022-06-23T13:00:00Z.json.gz',
+        'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=14/2022-06-23T14:00:00Z.json.gz',
+        'weather_data_raw/location=St_Kilda/date=2022-06-23/hour=14/2022-06-23T14:00:00Z.json',
+    ]
+    s3.objects[keys[0]] = raw_codec.encode(json.dumps(sample_record(local_obs_datetime='2022-06-23 11:00 PM')).encode(), 'gzip')
+    s3.objects[keys[1]] = raw_codec.encode(json.dumps(sample_record()).encode(), 'gzip')
+    s3.objects[keys[2]] = json.dumps(sample_record('St: Kilda')).encode()
+
+    response = transform_raw.handler(sqs_event(*keys), None)
+
+    assert response['objects'] == 3
+    melbourne, st_kilda = sorted(response['written'])
+    assert melbourne.startswith('weather_data_parquet/areaName=Melbourne/localObsDate=2022-06-23/part-nrt-')
+    assert st_kilda.startswith('weather_data_parquet/areaName=St%3A Kilda/localObsDate=2022-06-23/')
+
+    table = pq.read_table(io.BytesIO(s3.objects[melbourne]))
+    assert table.column_names == [name for name in transform_raw.arrow_flatten.CURATED_SCHEMA.names
+                                  if name not in transform_raw.PARTITION_KEYS]
+    assert table.column('temp_C').to_pylist() == [12, 12]
+    # Records are numbered across the batch like in the batch engines
+    st_kilda_ids = pq.read_table(io.BytesIO(s3.objects[st_kilda])).column('id').to_pylist()
+    assert sorted(table.column('id').to_pylist() + st_kilda_ids) == [1, 2, 3]
+    assert [value.hour for value in table.column('localObsTimeStamp').to_pylist()] == [23, 23]
+
+    assert set(glue.partitions) == {('Melbourne', '2022-06-23'), ('St: Kilda', '2022-06-23')}
+    assert glue.partitions[('St: Kilda', '2022-06-23')]['StorageDescriptor']['Location'] == \
+        's3://bucket/weather_data_parquet/areaName=St%3A Kilda/localObsDate=2022-06-23/'
+
+
+def test_retried_batches_overwrite_their_files(clients):
+    s3, _ = clients
+    key = 'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=14/2022-06-23T14:00:00Z.json'
+    s3.objects[key] = json.dumps(sample_record()).encode()
+
+    first = transform_raw.handler(sqs_event(key), None)
+    second = transform_raw.handler(sqs_event(key), None)
+
+    assert first['written'] == second['written']
+
+
+def test_only_failed_messages_are_redelivered(clients):
+    s3, glue = clients
+    keys = [
+        'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=13/2022-06-23T13:00:00Z.json',
+        'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=14/2022-06-23T14:00:00Z.json',
+    ]
+    s3.objects[keys[0]] = b'{"current_condition": ['
+    s3.objects[keys[1]] = json.dumps(sample_record()).encode()
+
+    response = transform_raw.handler(sqs_event(*keys), None)
+
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'message-0'}]
+    assert response['objects'] == 1
+    written, = response['written']
+    assert pq.read_table(io.BytesIO(s3.objects[written])).num_rows == 1
+    assert set(glue.partitions) == {('Melbourne', '2022-06-23')}
+
+
+def test_compacted_and_other_objects_are_skipped(clients):
+    response = transform_raw.handler(sqs_event(
+        'weather_data_raw/location=Melbourne_VIC/date=2022-06-23/hour=all/compacted-0001.jsonl.gz',
+        'ingest_state/last_seen.json',
+    ), None)
+
+    assert response == {'objects': 0, 'written': [], 'batchItemFailures': []}
+
+
+def test_partitions_wait_for_the_crawled_table():
+    glue = LocalCatalog(table_exists=False)
+
+    assert transform_raw.register_partitions(glue, 'bucket', [('Melbourne', '2022-06-23')]) == []
+    assert transform_raw.registered_partitions == set()
+
+
+def test_partition_dir():
+    assert transform_raw.partition_dir(('a/b=c', None)) == \
+        f'weather_data_parquet/areaName=a%2Fb%3Dc/localObsDate={transform_raw.NULL_PARTITION}'
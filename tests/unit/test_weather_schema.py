@@ -0,0 +1,86 @@
+import copy
+import json
+import os
+from datetime import date, datetime
+
+import pytest
+
+import weather_schema
+
+SAMPLE_RAW_DATA = os.path.join(os.path.dirname(__file__), '..', '..', 'glue', 'sample_raw_data.json')
+
+
+@pytest.fixture
+def sample():
+    with open(SAMPLE_RAW_DATA) as sample_file:
+        return json.load(sample_file)
+
+
+def test_sample_is_valid(sample):
+    assert weather_schema.validate(sample) == []
+
+    row = weather_schema.convert(sample)
+    assert row['localObsTimeStamp'] == datetime(2022, 6, 23, 23, 59)
+    assert row['localObsDate'] == date(2022, 6, 23)
+    assert (row['temp_C'], row['precipMM'], row['areaName']) == (12, 0.0, 'Melbourne')
+
+
+def test_drifted_and_malformed_payloads(sample):
+    drifted = copy.deepcopy(sample)
+    del drifted['current_condition'][0]['humidity']
+    drifted['current_condition'][0]['temp_C'] = 'twelve'
+    drifted['current_condition'][0]['newField'] = '1'
+    drifted['nearest_area'][0]['areaName'] = []
+
+    assert weather_schema.validate(drifted) == [
+        'Missing fields in current_condition: humidity',
+        'Missing required value nearest_area[].areaName[].value',
+        'Invalid int value for temp_C',
+    ]
+    assert weather_schema.validate({'current_condition': [{'localObsDateTime': 'yesterday'}]})[:2] == [
+        'Missing fields in current_condition: ' + ', '.join(
+            weather_schema.field_name(field) for field in weather_schema.CURRENT_CONDITION_FIELDS
+            if weather_schema.field_name(field) != 'localObsDateTime'),
+        'Missing section nearest_area',
+    ]
+    assert weather_schema.validate([]) == ['Expected a j1 document, got list']
+
+
+def test_projection_keeps_the_fields_the_pipeline_reads(sample):
+    projected = weather_schema.project(sample)
+
+    assert set(projected) == {'current_condition', 'nearest_area', 'weather'}
+    assert weather_schema.convert(projected) == weather_schema.convert(sample)
+    assert projected['current_condition'][0]['weatherDesc'] == sample['current_condition'][0]['weatherDesc']
+    assert 'weatherIconUrl' not in projected['current_condition'][0]
+    assert 'astronomy' not in projected['weather'][0]
+
+    # Every element of an array is projected
+    assert len(projected['weather']) == len(sample['weather'])
+    assert [hour['time'] for hour in projected['weather'][-1]['hourly']] == \
+        [hour['time'] for hour in sample['weather'][-1]['hourly']]
+    assert 'chanceofremdry' not in projected['weather'][-1]['hourly'][0]
+
+
+def test_projection_of_nested_paths():
+    tree = weather_schema.projection(['a[].b[].value', 'a[].c', 'd', 'd[].e'])
+
+    assert tree == {'a': {'b': {'value': None}, 'c': None}, 'd': None}
+    assert weather_schema.project({'a': [{'b': [{'value': 1, 'x': 2}], 'c': 3, 'y': 4}], 'd': [{'e': 5}], 'z': 6}, tree) == \
+        {'a': [{'b': [{'value': 1}], 'c': 3}], 'd': [{'e': 5}]}
+
+
+def test_apply_mapping_uses_relationalized_paths():
+    mappings = weather_schema.apply_mapping()
+
+    assert len(mappings) == len(weather_schema.CURATED_COLUMNS)
+    # Computed columns are mapped by name
+    assert mappings[0] == ('id', '`id`', 'long')
+    assert mappings[3] == ('localObsDate', '`localObsDate`', 'date')
+    assert mappings[4] == ('`current_condition.val.FeelsLikeC`', 'FeelsLikeC', 'int')
+    assert ('`nearest_area.val.areaName.val.value`', 'areaName', 'string') in mappings
+
+
+def test_catalog_columns():
+    assert weather_schema.catalog_columns(weather_schema.CURATED_COLUMNS[:3]) == [
+        ('id', 'bigint'), ('index', 'int'), ('localObsTimeStamp', 'timestamp')]
@@ -4,6 +4,7 @@ from aws_cdk import (
     assertions,
     App
 )
+from wttr_in_data.sizing import Workload
 from wttr_in_data.wttr_in_data_stack import WttrInDataStack
 import pytest
 
@@ -37,15 +38,16 @@ def test_lambda_function_created():
 
     template = assertions.Template.from_stack(test_stack)
 
-    template.resource_count_is('AWS::Lambda::Function', 1)
+    # get_data, register_partition and the bucket notifications handler
+    template.resource_count_is('AWS::Lambda::Function', 3)
 
     env_capture = assertions.Capture()
 
     template.has_resource_properties('AWS::Lambda::Function',
                                      {
                                          'Handler': 'get_data.handler',
-                                         'Runtime': 'python3.7',
-                                         'Timeout': 10,
+                                         'Runtime': 'python3.9',
+                                         'Timeout': 15,
                                          'Environment': env_capture
                                      })
 
@@ -67,4 +69,192 @@ def test_event_created():
     template.has_resource_properties('AWS::Events::Rule', {
         'ScheduleExpression': 'cron(0 * ? * * *)',
         'State': 'ENABLED'
-    })
\ No newline at end of file
+    })
+
+
+def test_raw_table_registered_by_events():
+    app = App()
+
+    test_stack = WttrInDataStack(app, "TestStack")
+
+    template = assertions.Template.from_stack(test_stack)
+
+    # The raw and curated tables
+    template.resource_count_is('AWS::Glue::Table', 2)
+    template.has_resource_properties('AWS::Lambda::Function', {
+        'Handler': 'register_partition.handler'
+    })
+    template.resource_count_is('Custom::S3BucketNotifications', 1)
+
+    # The workflow starts with raw data compaction, no raw data crawler is needed
+    template.resource_count_is('AWS::Glue::Crawler', 1)
+    template.has_resource_properties('AWS::Glue::Trigger', {
+        'Type': 'SCHEDULED',
+        'Schedule': 'cron(0 3 * * ? *)',
+        'Description': 'Compact raw data daily at 03:00'
+    })
+    template.has_resource_properties('AWS::Glue::Job', {
+        'Command': assertions.Match.object_like({'Name': 'pythonshell'}),
+        'MaxCapacity': 0.0625
+    })
+
+
+def test_raw_table_partition_projection():
+    app = App()
+
+    test_stack = WttrInDataStack(app, "TestStack", raw_partition_projection=True)
+
+    template = assertions.Template.from_stack(test_stack)
+
+    template.resource_count_is('Custom::S3BucketNotifications', 0)
+    template.has_resource_properties('AWS::Glue::Table', {
+        'TableInput': {
+            'Parameters': assertions.Match.object_like({
+                'projection.enabled': 'true',
+                'projection.hour.values': assertions.Match.string_like_regexp('^00,01,.*,23,all$'),
+            }),
+            'PartitionKeys': [
+                {'Name': 'location', 'Type': 'string'},
+                {'Name': 'date', 'Type': 'string'},
+                {'Name': 'hour', 'Type': 'string'},
+            ]
+        }
+    })
+    # Nothing registers raw partitions, full rebuilds of the ETL job read the raw objects from --rawDir
+    assert template.find_resources('AWS::Lambda::Function', {
+        'Properties': {'Handler': 'register_partition.handler'}}) == {}
+    template.has_resource_properties('AWS::Glue::Job', {
+        'Command': assertions.Match.object_like({'Name': 'glueetl'}),
+        'DefaultArguments': assertions.Match.object_like({
+            '--rawDir': assertions.Match.any_value(),
+            '--fullRebuild': 'false',
+        }),
+    })
+
+
+@pytest.mark.parametrize('workload, lambda_properties, etl_properties, compaction_properties, schedule', [
+    (Workload(locations=1, fetch_interval_minutes=60, retention_days=365),
+     {'MemorySize': 256, 'Timeout': 15},
+     {'WorkerType': 'G.1X', 'NumberOfWorkers': 2, 'Timeout': 30},
+     {'MaxCapacity': 0.0625, 'Timeout': 10},
+     'cron(0 * ? * * *)'),
+    (Workload(locations=50, fetch_interval_minutes=30, retention_days=365),
+     {'MemorySize': 256, 'Timeout': 45},
+     {'WorkerType': 'G.1X', 'NumberOfWorkers': 2, 'Timeout': 335},
+     {'MaxCapacity': 0.0625, 'Timeout': 16},
+     'cron(0/30 * ? * * *)'),
+    (Workload(locations=500, fetch_interval_minutes=15, retention_days=730),
+     {'MemorySize': 640, 'Timeout': 85},
+     {'WorkerType': 'G.2X', 'NumberOfWorkers': 15, 'Timeout': 478},
+     {'MaxCapacity': 0.0625, 'Timeout': 320},
+     'cron(0/15 * ? * * *)'),
+])
+def test_resources_sized_for_workload(workload, lambda_properties, etl_properties, compaction_properties, schedule):
+    app = App()
+
+    test_stack = WttrInDataStack(app, "TestStack", workload=workload)
+
+    template = assertions.Template.from_stack(test_stack)
+
+    template.has_resource_properties('AWS::Lambda::Function', dict(
+        lambda_properties, Handler='get_data.handler', Architectures=['arm64'], Runtime='python3.9'))
+    template.has_resource_properties('AWS::Glue::Job', dict(
+        etl_properties, Command=assertions.Match.object_like({'Name': 'glueetl'})))
+    template.has_resource_properties('AWS::Glue::Job', dict(
+        compaction_properties, Command=assertions.Match.object_like({'Name': 'pythonshell'})))
+    template.has_resource_properties('AWS::Glue::Trigger', {
+        'Description': 'Run ETL job after raw data compaction',
+        'Actions': [assertions.Match.object_like({'Timeout': etl_properties['Timeout']})],
+    })
+    template.has_resource_properties('AWS::Events::Rule', {'ScheduleExpression': schedule})
+
+
+def test_adaptive_polling():
+    app = App()
+
+    test_stack = WttrInDataStack(app, "TestStack", adaptive_polling=True)
+
+    template = assertions.Template.from_stack(test_stack)
+
+    template.has_resource_properties('AWS::Events::Rule', {'ScheduleExpression': 'cron(0/5 * ? * * *)'})
+    template.has_resource_properties('AWS::Lambda::Function', {
+        'Handler': 'get_data.handler',
+        'Environment': {'Variables': assertions.Match.object_like({'POLL_MODE': 'adaptive', 'POLL_MAX_FETCHES': '1'})},
+    })
+
+
+def test_near_real_time_transform():
+    app = App()
+
+    test_stack = WttrInDataStack(app, "TestStack", near_real_time=True)
+
+    template = assertions.Template.from_stack(test_stack)
+
+    template.has_resource_properties('AWS::Lambda::Function', {
+        'Handler': 'transform_raw.handler',
+        'Layers': [{'Ref': 'ArrowLayerArn'}],
+    })
+    template.has_resource_properties('AWS::Events::Rule', {
+        'EventPattern': assertions.Match.object_like({'source': ['aws.s3'], 'detail-type': ['Object Created']}),
+    })
+    template.has_resource_properties('AWS::Lambda::EventSourceMapping', {
+        'BatchSize': 100,
+        'MaximumBatchingWindowInSeconds': 60,
+        'FunctionResponseTypes': ['ReportBatchItemFailures'],
+    })
+    template.has_resource_properties('Custom::S3BucketNotifications', {
+        'NotificationConfiguration': assertions.Match.object_like({'EventBridgeConfiguration': {}}),
+    })
+
+
+def test_curated_table_generated_from_schema():
+    app = App()
+
+    test_stack = WttrInDataStack(app, "TestStack")
+
+    template = assertions.Template.from_stack(test_stack)
+
+    template.has_resource_properties('AWS::Glue::Table', {
+        'TableInput': assertions.Match.object_like({
+            'Name': {'Ref': 'S3IngestParquetDataPath'},
+            'PartitionKeys': [
+                {'Name': 'areaName', 'Type': 'string'},
+                {'Name': 'localObsDate', 'Type': 'date'},
+            ],
+            'StorageDescriptor': assertions.Match.object_like({
+                'Columns': assertions.Match.array_with([
+                    {'Name': 'id', 'Type': 'bigint'},
+                    {'Name': 'localObsTimeStamp', 'Type': 'timestamp'},
+                    {'Name': 'precipMM', 'Type': 'float'},
+                ]),
+            }),
+        }),
+    })
+
+
+def test_sharded_etl():
+    app = App()
+
+    test_stack = WttrInDataStack(app, "TestStack", etl_shards=3)
+
+    template = assertions.Template.from_stack(test_stack)
+
+    for index in range(3):
+        template.has_resource_properties('AWS::Glue::Job', {
+            'Name': f'Wttr ETL Job - shard {index + 1} of 3',
+            'DefaultArguments': assertions.Match.object_like({'--shardIndex': str(index), '--shardCount': '3'}),
+        })
+    template.has_resource_properties('AWS::Glue::Trigger', {
+        'Description': 'Run ETL job after raw data compaction',
+        'Actions': [assertions.Match.object_like({'JobName': {'Ref': assertions.Match.string_like_regexp(
+            f'WttrETLJobShard{index}')}}) for index in range(3)],
+    })
+    template.has_resource_properties('AWS::Glue::Trigger', {
+        'Description': 'Verify that every ETL shard completed and move the raw watermark',
+        'Predicate': {'Logical': 'AND', 'Conditions': assertions.Match.any_value()},
+    })
+    template.has_resource_properties('AWS::Glue::Trigger', {
+        'Description': 'Crawl parquet data after ETL job',
+        'Predicate': {'Conditions': [assertions.Match.object_like({'JobName': {'Ref': assertions.Match.string_like_regexp(
+            'WttrVerifyShardsJob')}})]},
+    })
@@ -0,0 +1,32 @@
+from aws_cdk import aws_glue
+
+from wttr_in_data.lambda_assets import load_lambda_module
+
+weather_schema = load_lambda_module('weather_schema')
+
+
+def curated_table_input(table_name, location):
+    # Parquet table written by the ETL job, partitioned by areaName and
+    # localObsDate. Defining it means the parquet crawler only adds partitions.
+    columns = [column for column in weather_schema.CURATED_COLUMNS
+               if column.name not in weather_schema.PARTITION_KEYS]
+    partition_keys = [column for name in weather_schema.PARTITION_KEYS
+                      for column in weather_schema.CURATED_COLUMNS if column.name == name]
+
+    return aws_glue.CfnTable.TableInputProperty(
+        name=table_name,
+        table_type='EXTERNAL_TABLE',
+        parameters={'classification': 'parquet'},
+        partition_keys=[aws_glue.CfnTable.ColumnProperty(name=name, type=type)
+                        for name, type in weather_schema.catalog_columns(partition_keys)],
+        storage_descriptor=aws_glue.CfnTable.StorageDescriptorProperty(
+            location=location,
+            input_format='org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
+            output_format='org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat',
+            serde_info=aws_glue.CfnTable.SerdeInfoProperty(
+                serialization_library='org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe',
+            ),
+            columns=[aws_glue.CfnTable.ColumnProperty(name=name, type=type)
+                     for name, type in weather_schema.catalog_columns(columns)],
+        ),
+    )
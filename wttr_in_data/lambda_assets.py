@@ -0,0 +1,18 @@
+import importlib.util
+import os
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda')
+
+# The stack generates its Glue tables from lambda/weather_schema.py. The
+# lambda directory is deployed as a flat asset rather than a package, so its
+# modules are loaded from their files instead of adding it to the import path.
+_modules = {}
+
+
+def load_lambda_module(name):
+    if name not in _modules:
+        spec = importlib.util.spec_from_file_location(f'{__name__}.{name}', os.path.join(LAMBDA_DIR, f'{name}.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[name] = module
+    return _modules[name]
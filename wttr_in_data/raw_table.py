@@ -0,0 +1,72 @@
+from aws_cdk import aws_glue
+
+from wttr_in_data.lambda_assets import load_lambda_module
+
+weather_schema = load_lambda_module('weather_schema')
+
+# Hive-style partition keys of the raw data, matching the keys written by
+# lambda/get_data.py: {RAW_DATA_PATH}/location=.../date=YYYY-MM-DD/hour=HH/
+RAW_PARTITION_KEYS = ['location', 'date', 'hour']
+
+# Hour partitions: one per hour, plus hour=all for the daily compacted files
+# written by glue/compact_raw.py
+RAW_HOURS = [f'{hour:02d}' for hour in range(24)] + ['all']
+
+# wttr.in wraps text values in [{'value': ...}] arrays
+VALUE_ARRAY = 'array<struct<value:string>>'
+
+
+def field_type(field):
+    # Fields of weather_schema.py are strings, value arrays or nested sections
+    if isinstance(field, str):
+        return 'string'
+    if field[1] == weather_schema.VALUE_ARRAY:
+        return VALUE_ARRAY
+    return array_of_struct(field[1])
+
+
+def array_of_struct(fields):
+    return 'array<struct<' + ','.join(
+        f'{weather_schema.field_name(field)}:{field_type(field)}' for field in fields) + '>>'
+
+
+RAW_COLUMNS = [(section, array_of_struct(fields)) for section, fields in weather_schema.J1_SECTIONS]
+
+
+def projection_parameters(location_template):
+    # Athena partition projection: partitions are computed from the query
+    # instead of being looked up in the catalog
+    return {
+        'projection.enabled': 'true',
+        'projection.location.type': 'injected',
+        'projection.date.type': 'date',
+        'projection.date.format': 'yyyy-MM-dd',
+        'projection.date.range': '2022-01-01,NOW',
+        'projection.hour.type': 'enum',
+        'projection.hour.values': ','.join(RAW_HOURS),
+        'storage.location.template': location_template + 'location=${location}/date=${date}/hour=${hour}/',
+    }
+
+
+def raw_table_input(table_name, location, partition_projection=False):
+    parameters = {'classification': 'json'}
+    if partition_projection:
+        parameters.update(projection_parameters(location))
+
+    return aws_glue.CfnTable.TableInputProperty(
+        name=table_name,
+        table_type='EXTERNAL_TABLE',
+        parameters=parameters,
+        partition_keys=[aws_glue.CfnTable.ColumnProperty(name=key, type='string')
+                        for key in RAW_PARTITION_KEYS],
+        storage_descriptor=aws_glue.CfnTable.StorageDescriptorProperty(
+            location=location,
+            input_format='org.apache.hadoop.mapred.TextInputFormat',
+            output_format='org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
+            serde_info=aws_glue.CfnTable.SerdeInfoProperty(
+                serialization_library='org.openx.data.jsonserde.JsonSerDe',
+            ),
+            columns=[aws_glue.CfnTable.ColumnProperty(name=name, type=type)
+                     for name, type in RAW_COLUMNS],
+        ),
+    )
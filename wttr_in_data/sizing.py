@@ -0,0 +1,162 @@
+import math
+from collections import namedtuple
+
+# Declared workload the stack is sized for: the number of locations fetched
+# by get_data, the minutes between fetches and the days of raw data kept
+Workload = namedtuple('Workload', ['locations', 'fetch_interval_minutes', 'retention_days'])
+
+DEFAULT_WORKLOAD = Workload(locations=1, fetch_interval_minutes=60, retention_days=365)
+
+# Resources derived from a workload
+Sizing = namedtuple('Sizing', [
+    'lambda_memory_mb', 'lambda_architecture', 'lambda_timeout_seconds', 'lambda_concurrency',
+    'glue_worker_type', 'glue_worker_count', 'glue_job_timeout_minutes',
+    'compaction_max_capacity', 'compaction_timeout_minutes',
+])
+
+# Measured on the sample payload: a j1 document is about 50 KB of JSON, one
+# fetch takes up to a few seconds and the put of a gzipped payload well under
+# one. Each payload is held as JSON, bytes and its compressed copy while it is
+# processed.
+RAW_PAYLOAD_BYTES = 50 * 1024
+FETCH_SECONDS = 4
+PUT_SECONDS = 1
+PAYLOAD_MEMORY_MB = 8
+
+# get_data fetches up to this many locations at the same time, memory also
+# buys CPU and network bandwidth so it is never below LAMBDA_MIN_MEMORY_MB
+LAMBDA_MIN_CONCURRENCY = 8
+LAMBDA_MAX_CONCURRENCY = 64
+LAMBDA_MIN_MEMORY_MB = 256
+LAMBDA_MEMORY_STEP_MB = 64
+# Index load/save, client setup and cold start
+LAMBDA_OVERHEAD_SECONDS = 5
+LAMBDA_TARGET_SECONDS = 60
+LAMBDA_MAX_TIMEOUT_SECONDS = 900
+
+# Glue ETL throughput per G.1X executor on raw JSON (relationalize and joins).
+# The worker count is the most a full rebuild of the retention window needs
+# to finish in GLUE_REBUILD_TARGET_MINUTES, auto scaling uses fewer workers
+# for the daily incremental runs.
+GLUE_BYTES_PER_WORKER_MINUTE = 256 * 1024 * 1024
+GLUE_REBUILD_TARGET_MINUTES = 240
+# One worker runs the driver, Glue 3.0 needs at least 2 G.1X workers
+GLUE_MIN_WORKERS = 2
+GLUE_MAX_WORKERS = 100
+# Above this much retained raw data a full rebuild is memory bound on G.1X
+# (16 GB) workers, so G.2X (32 GB) workers are used instead
+GLUE_G2X_RETAINED_BYTES = 500 * 1024 ** 3
+GLUE_MIN_TIMEOUT_MINUTES = 30
+GLUE_MAX_TIMEOUT_MINUTES = 2880
+
+# The compaction job reads, rewrites and deletes each hourly object of a day
+COMPACTION_SECONDS_PER_OBJECT = 0.2
+COMPACTION_MIN_TIMEOUT_MINUTES = 10
+# A location's day is held in memory, beyond this the 1 GB of 0.0625 DPU is not enough
+COMPACTION_SMALL_DAY_BYTES = 256 * 1024 * 1024
+
+# Estimates are multiplied by this before they become timeouts
+SAFETY_FACTOR = 2
+
+
+def _round_up(value, step):
+    return int(math.ceil(value / step) * step)
+
+
+def _clamp(value, lowest, highest):
+    return max(lowest, min(highest, value))
+
+
+def fetches_per_day(workload):
+    return 24 * 60 // workload.fetch_interval_minutes
+
+
+def daily_raw_bytes(workload):
+    return workload.locations * fetches_per_day(workload) * RAW_PAYLOAD_BYTES
+
+
+def validate(workload):
+    if workload.locations < 1:
+        raise ValueError(f'A workload needs at least one location, got {workload.locations}')
+    if workload.retention_days < 1:
+        raise ValueError(f'The retention window must be at least one day, got {workload.retention_days}')
+    # The interval must map onto a cron schedule
+    interval = workload.fetch_interval_minutes
+    if not (0 < interval < 60 and 60 % interval == 0) and not (interval % 60 == 0 and 24 % (interval // 60) == 0):
+        raise ValueError(f'The fetch interval must divide an hour or a day, got {interval} minutes')
+
+
+def lambda_seconds(locations, concurrency):
+    waves = math.ceil(locations / concurrency)
+    return LAMBDA_OVERHEAD_SECONDS + waves * (FETCH_SECONDS + PUT_SECONDS) * SAFETY_FACTOR
+
+
+def size_lambda(workload):
+    # The invocation is I/O bound and billed by duration, so concurrency is
+    # raised until it takes about LAMBDA_TARGET_SECONDS. It has to finish
+    # before the next fetch and within the Lambda limit.
+    budget_seconds = min(LAMBDA_MAX_TIMEOUT_SECONDS, workload.fetch_interval_minutes * 60)
+    max_concurrency = min(workload.locations, LAMBDA_MAX_CONCURRENCY)
+    concurrency = min(workload.locations, LAMBDA_MIN_CONCURRENCY)
+    while concurrency < max_concurrency and lambda_seconds(workload.locations, concurrency) > LAMBDA_TARGET_SECONDS:
+        concurrency = min(concurrency * 2, max_concurrency)
+
+    if lambda_seconds(workload.locations, concurrency) > budget_seconds:
+        raise ValueError(f'{workload.locations} locations cannot be fetched every '
+                         f'{workload.fetch_interval_minutes} minutes by one function')
+
+    memory_mb = _round_up(
+        max(LAMBDA_MIN_MEMORY_MB, 128 + concurrency * PAYLOAD_MEMORY_MB), LAMBDA_MEMORY_STEP_MB)
+    timeout_seconds = max(10, lambda_seconds(workload.locations, concurrency))
+
+    # The functions are pure Python, so they run on Graviton (arm64) which is
+    # cheaper per GB-second than x86_64
+    return memory_mb, 'arm64', timeout_seconds, concurrency
+
+
+def size_glue_etl(workload):
+    daily_bytes = daily_raw_bytes(workload)
+    retained_bytes = daily_bytes * workload.retention_days
+
+    worker_type = 'G.2X' if retained_bytes > GLUE_G2X_RETAINED_BYTES else 'G.1X'
+    worker_bytes_per_minute = GLUE_BYTES_PER_WORKER_MINUTE * (2 if worker_type == 'G.2X' else 1)
+
+    executors = math.ceil(retained_bytes / (worker_bytes_per_minute * GLUE_REBUILD_TARGET_MINUTES))
+    worker_count = _clamp(executors + 1, GLUE_MIN_WORKERS, GLUE_MAX_WORKERS)
+    throughput = worker_bytes_per_minute * (worker_count - 1)
+
+    # The timeout covers a full rebuild of the retention window, the daily
+    # incremental runs are much shorter
+    timeout_minutes = _clamp(
+        math.ceil(retained_bytes / throughput * SAFETY_FACTOR),
+        GLUE_MIN_TIMEOUT_MINUTES, GLUE_MAX_TIMEOUT_MINUTES)
+
+    return worker_type, worker_count, timeout_minutes
+
+
+def size_compaction(workload):
+    objects = workload.locations * fetches_per_day(workload)
+    location_day_bytes = fetches_per_day(workload) * RAW_PAYLOAD_BYTES
+
+    max_capacity = 0.0625 if location_day_bytes <= COMPACTION_SMALL_DAY_BYTES else 1.0
+    timeout_minutes = max(
+        COMPACTION_MIN_TIMEOUT_MINUTES,
+        math.ceil(objects * COMPACTION_SECONDS_PER_OBJECT / 60 * SAFETY_FACTOR))
+
+    return max_capacity, timeout_minutes
+
+
+def size(workload=DEFAULT_WORKLOAD):
+    validate(workload)
+
+    return Sizing(*size_lambda(workload), *size_glue_etl(workload), *size_compaction(workload))
+
+
+def fetch_schedule(workload):
+    # minute/hour fields of the cron schedule of get_data
+    interval = workload.fetch_interval_minutes
+    if interval < 60:
+        return {'minute': f'0/{interval}', 'hour': '*'}
+    if interval == 60:
+        return {'minute': '0', 'hour': '*'}
+    return {'minute': '0', 'hour': f'0/{interval // 60}'}
@@ -10,16 +10,47 @@ from aws_cdk import (
     aws_glue_alpha,
     aws_glue,
     aws_iam,
+    aws_s3_notifications,
+    aws_sqs,
+    aws_lambda_event_sources,
     CfnParameter
 )
 
 from constructs import Construct
 
+from wttr_in_data.curated_table import curated_table_input
+from wttr_in_data.raw_table import raw_table_input
+from wttr_in_data.sizing import DEFAULT_WORKLOAD, fetch_schedule, size
+
+GLUE_WORKER_TYPES = {
+    'G.1X': aws_glue_alpha.WorkerType.G_1_X,
+    'G.2X': aws_glue_alpha.WorkerType.G_2_X,
+}
+
+# With adaptive polling get_data runs at this interval and only fetches the
+# locations that are due
+POLL_TICK_MINUTES = 5
+
+LAMBDA_ARCHITECTURES = {
+    'arm64': aws_lambda.Architecture.ARM_64,
+    'x86_64': aws_lambda.Architecture.X86_64,
+}
+
+# get_data only needs its own modules and the botocore and urllib3 of the
+# runtime, a smaller package is faster to fetch and unpack on a cold start
+GET_DATA_ASSET_EXCLUDE = ['__pycache__', 'arrow_flatten.py', 'register_partition.py', 'transform_raw.py']
+
 
 class WttrInDataStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, raw_partition_projection: bool = False,
+                 workload=DEFAULT_WORKLOAD, adaptive_polling: bool = False, near_real_time: bool = False,
+                 etl_shards: int = 1, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # Lambda and Glue resources are derived from the declared workload,
+        # see sizing.py
+        sizing = size(workload)
+
         # Stack parameters
         S3_INGEST_BUCKET_NAME = CfnParameter(
             self, 'S3IngestBucketName',
@@ -41,6 +72,20 @@ class WttrInDataStack(Stack):
             default='weather_data_parquet'
         )
 
+        S3_INGEST_FORECAST_DATA_PATH = CfnParameter(
+            self, 'S3IngestForecastDataPath',
+            type='String',
+            description='Path to forecast parquet data in S3 ingest bucket',
+            default='weather_data_forecast_parquet'
+        )
+
+        S3_INGEST_ROLLUP_DATA_PATH = CfnParameter(
+            self, 'S3IngestRollupDataPath',
+            type='String',
+            description='Path prefix of the daily and monthly rollup parquet data in S3 ingest bucket',
+            default='weather_data_rollup'
+        )
+
         LOCATION_QUERY_STRING = CfnParameter(
             self, 'LocationQueryString',
             type='String',
@@ -48,6 +93,55 @@ class WttrInDataStack(Stack):
             default='Melbourne VIC'
         )
 
+        DEDUP_MODE = CfnParameter(
+            self, 'DedupMode',
+            type='String',
+            description='How unchanged observations are detected and skipped at ingest',
+            allowed_values=['observation', 'content', 'off'],
+            default='observation'
+        )
+
+        # zstd is left out as the zstandard package is not bundled with the
+        # lambda code
+        RAW_CODEC = CfnParameter(
+            self, 'RawCodec',
+            type='String',
+            description='Compression codec of the raw payloads written at ingest',
+            allowed_values=['gzip', 'none'],
+            default='gzip'
+        )
+
+        VALIDATION_MODE = CfnParameter(
+            self, 'ValidationMode',
+            type='String',
+            description='What happens to payloads that do not match the j1 schema at ingest',
+            allowed_values=['quarantine', 'reject', 'off'],
+            default='quarantine'
+        )
+
+        S3_INGEST_QUARANTINE_DATA_PATH = CfnParameter(
+            self, 'S3IngestQuarantineDataPath',
+            type='String',
+            description='Path to quarantined raw data in S3 ingest bucket',
+            default='weather_data_quarantine'
+        )
+
+        PROJECTION_MODE = CfnParameter(
+            self, 'ProjectionMode',
+            type='String',
+            description='Whether payloads are projected to the fields the pipeline reads before they are stored',
+            allowed_values=['pipeline', 'off'],
+            default='off'
+        )
+
+        S3_INGEST_AUDIT_DATA_PATH = CfnParameter(
+            self, 'S3IngestAuditDataPath',
+            type='String',
+            description='Path to the payloads as received in S3 ingest bucket when they are projected, '
+                        'empty to not keep them',
+            default=''
+        )
+
         # Create KMS Key
         my_kms_key = aws_kms.Key(
             self, 'MyKMSKey',
@@ -66,6 +160,7 @@ class WttrInDataStack(Stack):
                 encryption=aws_s3.BucketEncryption.KMS,
                 encryption_key=my_kms_key,
                 enforce_ssl=True,
+                event_bridge_enabled=near_real_time,
             )
         else:
             ingest_bucket = aws_s3.Bucket(
@@ -75,31 +170,56 @@ class WttrInDataStack(Stack):
                 encryption=aws_s3.BucketEncryption.KMS,
                 encryption_key=my_kms_key,
                 enforce_ssl=True,
+                event_bridge_enabled=near_real_time,
             )
 
         # Create lambda function to obtain data from wttr.in
         get_data_lambda = aws_lambda.Function(
             self, 'GetDataLambda',
-            runtime=aws_lambda.Runtime.PYTHON_3_7,
-            code=aws_lambda.Code.from_asset('lambda'),
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            architecture=LAMBDA_ARCHITECTURES[sizing.lambda_architecture],
+            code=aws_lambda.Code.from_asset('lambda', exclude=GET_DATA_ASSET_EXCLUDE),
             handler='get_data.handler',
-            timeout=Duration.seconds(10),
+            memory_size=sizing.lambda_memory_mb,
+            timeout=Duration.seconds(sizing.lambda_timeout_seconds),
             environment={
                 'INGEST_BUCKET': ingest_bucket.bucket_name,
                 'LOCATION_QUERY_STRING': LOCATION_QUERY_STRING.value_as_string,
-                'RAW_DATA_PATH': S3_INGEST_RAW_DATA_PATH.value_as_string
+                'RAW_DATA_PATH': S3_INGEST_RAW_DATA_PATH.value_as_string,
+                'DEDUP_MODE': DEDUP_MODE.value_as_string,
+                'RAW_CODEC': RAW_CODEC.value_as_string,
+                'VALIDATION_MODE': VALIDATION_MODE.value_as_string,
+                'QUARANTINE_DATA_PATH': S3_INGEST_QUARANTINE_DATA_PATH.value_as_string,
+                'PROJECTION_MODE': PROJECTION_MODE.value_as_string,
+                'AUDIT_DATA_PATH': S3_INGEST_AUDIT_DATA_PATH.value_as_string,
+                'MAX_CONCURRENCY': str(sizing.lambda_concurrency),
+                'POLL_MODE': 'adaptive' if adaptive_polling else 'fixed',
+                # One wave of concurrent fetches per adaptive invocation, or
+                # more when the cadences of the locations need it
+                'POLL_MAX_FETCHES': str(sizing.lambda_concurrency),
+                'POLL_TICK_MINUTES': str(POLL_TICK_MINUTES),
             },
         )
 
         # Grant write permission to created lambda function
         ingest_bucket.grant_write(get_data_lambda)
 
-        # Create event rule to trigger lambda function every hour
+        # Grant read permission to the index of last seen observations
+        ingest_bucket.grant_read(get_data_lambda, 'ingest_state/*')
+
+        # Create event rule to trigger lambda function at the fetch interval of
+        # the workload (every hour by default), or every few minutes with
+        # adaptive polling. The construct id is kept so existing rules are
+        # updated in place.
+        if adaptive_polling:
+            schedule = fetch_schedule(workload._replace(fetch_interval_minutes=POLL_TICK_MINUTES))
+        else:
+            schedule = fetch_schedule(workload)
+
         extract_rule = aws_events.Rule(
             self, "HourlyRule",
             schedule=aws_events.Schedule.cron(
-                minute='0',
-                hour='*',
+                **schedule,
                 week_day='*',
                 month='*',
                 year='*'
@@ -132,27 +252,142 @@ class WttrInDataStack(Stack):
         # Grant Encrypt and Decrypt to Glue crawler's IAM role
         my_kms_key.grant_encrypt_decrypt(glue_crawler_role)
 
-        # Create Glue Crawler for raw data
-        glue_crawler_raw = aws_glue.CfnCrawler(
-            self, 'WttrRawCrawler',
-            role=glue_crawler_role.role_arn,
-            name='wttr_in_raw_data_crawler',
-            targets=aws_glue.CfnCrawler.TargetsProperty(
-                s3_targets=[aws_glue.CfnCrawler.S3TargetProperty(
-                    path='s3://' + ingest_bucket.bucket_name +
-                    f'/{S3_INGEST_RAW_DATA_PATH.value_as_string}/',
-                )]
-            ),
+        # Create Glue table for raw data, partitioned by location, date and hour
+        raw_data_location = 's3://' + ingest_bucket.bucket_name + \
+            f'/{S3_INGEST_RAW_DATA_PATH.value_as_string}/'
+
+        aws_glue.CfnTable(
+            self, 'WttrRawTable',
+            catalog_id=self.account,
             database_name=glue_database.database_name,
-            schema_change_policy=aws_glue.CfnCrawler.SchemaChangePolicyProperty(
-                delete_behavior='LOG',
-                update_behavior='UPDATE_IN_DATABASE'
-            ),
-            recrawl_policy=aws_glue.CfnCrawler.RecrawlPolicyProperty(
-                recrawl_behavior='CRAWL_EVERYTHING'
-            )
+            table_input=raw_table_input(
+                S3_INGEST_RAW_DATA_PATH.value_as_string, raw_data_location,
+                partition_projection=raw_partition_projection),
+        )
+
+        # Create Glue table for the curated parquet data, so its schema comes
+        # from weather_schema.py rather than from crawler inference
+        aws_glue.CfnTable(
+            self, 'WttrCuratedTable',
+            catalog_id=self.account,
+            database_name=glue_database.database_name,
+            table_input=curated_table_input(
+                S3_INGEST_PARQUET_DATA_PATH.value_as_string,
+                's3://' + ingest_bucket.bucket_name + f'/{S3_INGEST_PARQUET_DATA_PATH.value_as_string}/'),
         )
 
+        # Partitions are either projected by Athena or registered as raw objects land
+        if not raw_partition_projection:
+            register_partition_lambda = aws_lambda.Function(
+                self, 'RegisterPartitionLambda',
+                runtime=aws_lambda.Runtime.PYTHON_3_9,
+                architecture=LAMBDA_ARCHITECTURES[sizing.lambda_architecture],
+                code=aws_lambda.Code.from_asset('lambda'),
+                handler='register_partition.handler',
+                timeout=Duration.seconds(30),
+                environment={
+                    'GLUE_DATABASE': glue_database.database_name,
+                    'GLUE_TABLE': S3_INGEST_RAW_DATA_PATH.value_as_string,
+                    'RAW_DATA_PATH': S3_INGEST_RAW_DATA_PATH.value_as_string
+                },
+            )
+
+            # Grant read access to the raw table and permission to add partitions
+            register_partition_lambda.add_to_role_policy(aws_iam.PolicyStatement(
+                actions=['glue:GetTable', 'glue:BatchCreatePartition'],
+                resources=[
+                    self.format_arn(service='glue', resource='catalog'),
+                    self.format_arn(service='glue', resource='database',
+                                    resource_name=glue_database.database_name),
+                    self.format_arn(service='glue', resource='table',
+                                    resource_name=f'{glue_database.database_name}/{S3_INGEST_RAW_DATA_PATH.value_as_string}'),
+                ],
+            ))
+
+            # Register partitions when raw objects are created
+            ingest_bucket.add_event_notification(
+                aws_s3.EventType.OBJECT_CREATED,
+                aws_s3_notifications.LambdaDestination(register_partition_lambda),
+                aws_s3.NotificationKeyFilter(
+                    prefix=f'{S3_INGEST_RAW_DATA_PATH.value_as_string}/'),
+            )
+
+        # Near-real-time path: raw objects are flattened into the curated
+        # table within minutes of landing, the nightly ETL job then rewrites
+        # their partitions. Object Created events go through EventBridge, as
+        # the raw prefix already has an S3 notification, and are queued in SQS
+        # so the function transforms them in micro-batches.
+        if near_real_time:
+            ARROW_LAYER_ARN = CfnParameter(
+                self, 'ArrowLayerArn',
+                type='String',
+                description='ARN of a Lambda layer providing pyarrow for the arm64 Python 3.9 runtime, '
+                            'e.g. the AWS SDK for pandas layer of the region',
+            )
+
+            transform_dead_letter_queue = aws_sqs.Queue(
+                self, 'TransformRawDeadLetterQueue',
+                retention_period=Duration.days(14),
+            )
+            transform_queue = aws_sqs.Queue(
+                self, 'TransformRawQueue',
+                # Six times the function timeout, as recommended for SQS event sources
+                visibility_timeout=Duration.minutes(6),
+                dead_letter_queue=aws_sqs.DeadLetterQueue(max_receive_count=3, queue=transform_dead_letter_queue),
+            )
+
+            aws_events.Rule(
+                self, 'RawObjectCreatedRule',
+                event_pattern=aws_events.EventPattern(
+                    source=['aws.s3'],
+                    detail_type=['Object Created'],
+                    detail={
+                        'bucket': {'name': [ingest_bucket.bucket_name]},
+                        'object': {'key': [{'prefix': f'{S3_INGEST_RAW_DATA_PATH.value_as_string}/'}]},
+                    },
+                ),
+                targets=[aws_events_targets.SqsQueue(transform_queue)],
+            )
+
+            transform_raw_lambda = aws_lambda.Function(
+                self, 'TransformRawLambda',
+                runtime=aws_lambda.Runtime.PYTHON_3_9,
+                architecture=LAMBDA_ARCHITECTURES[sizing.lambda_architecture],
+                code=aws_lambda.Code.from_asset('lambda'),
+                handler='transform_raw.handler',
+                layers=[aws_lambda.LayerVersion.from_layer_version_arn(
+                    self, 'ArrowLayer', ARROW_LAYER_ARN.value_as_string)],
+                memory_size=512,
+                timeout=Duration.seconds(60),
+                environment={
+                    'RAW_DATA_PATH': S3_INGEST_RAW_DATA_PATH.value_as_string,
+                    'PARQUET_DATA_PATH': S3_INGEST_PARQUET_DATA_PATH.value_as_string,
+                    'GLUE_DATABASE': glue_database.database_name,
+                },
+            )
+            transform_raw_lambda.add_event_source(aws_lambda_event_sources.SqsEventSource(
+                transform_queue,
+                batch_size=100,
+                max_batching_window=Duration.minutes(1),
+                # Only the messages listed in batchItemFailures are redelivered
+                report_batch_item_failures=True,
+            ))
+
+            ingest_bucket.grant_read(transform_raw_lambda, f'{S3_INGEST_RAW_DATA_PATH.value_as_string}/*')
+            ingest_bucket.grant_put(transform_raw_lambda, f'{S3_INGEST_PARQUET_DATA_PATH.value_as_string}/*')
+
+            # Grant read access to the curated table and permission to add partitions
+            transform_raw_lambda.add_to_role_policy(aws_iam.PolicyStatement(
+                actions=['glue:GetTable', 'glue:BatchCreatePartition'],
+                resources=[
+                    self.format_arn(service='glue', resource='catalog'),
+                    self.format_arn(service='glue', resource='database',
+                                    resource_name=glue_database.database_name),
+                    self.format_arn(service='glue', resource='table',
+                                    resource_name=f'{glue_database.database_name}/{S3_INGEST_PARQUET_DATA_PATH.value_as_string}'),
+                ],
+            ))
+
         # Create Glue Crawler for parquet data
         glue_crawler_parquet = aws_glue.CfnCrawler(
             self, 'WttrParquetCrawler',
@@ -162,36 +397,122 @@ class WttrInDataStack(Stack):
                 s3_targets=[aws_glue.CfnCrawler.S3TargetProperty(
                     path='s3://' + ingest_bucket.bucket_name +
                     f'/{S3_INGEST_PARQUET_DATA_PATH.value_as_string}/',
+                ), aws_glue.CfnCrawler.S3TargetProperty(
+                    path='s3://' + ingest_bucket.bucket_name +
+                    f'/{S3_INGEST_FORECAST_DATA_PATH.value_as_string}/',
+                ), aws_glue.CfnCrawler.S3TargetProperty(
+                    path='s3://' + ingest_bucket.bucket_name +
+                    f'/{S3_INGEST_ROLLUP_DATA_PATH.value_as_string}_daily/',
+                ), aws_glue.CfnCrawler.S3TargetProperty(
+                    path='s3://' + ingest_bucket.bucket_name +
+                    f'/{S3_INGEST_ROLLUP_DATA_PATH.value_as_string}_monthly/',
                 )]
             ),
             database_name=glue_database.database_name,
+            # The ETL job only adds or rewrites partition folders, so only new folders need crawling
             schema_change_policy=aws_glue.CfnCrawler.SchemaChangePolicyProperty(
                 delete_behavior='LOG',
-                update_behavior='UPDATE_IN_DATABASE'
+                update_behavior='LOG'
             ),
             recrawl_policy=aws_glue.CfnCrawler.RecrawlPolicyProperty(
-                recrawl_behavior='CRAWL_EVERYTHING'
+                recrawl_behavior='CRAWL_NEW_FOLDERS_ONLY'
             )
         )
 
         # Create Glue ETL job to flatten data and save to S3 as parquet files
-        glue_etl_job = aws_glue_alpha.Job(
-            self, 'WttrETLJob',
+        etl_job_properties = dict(
             executable=aws_glue_alpha.JobExecutable.python_etl(
                 glue_version=aws_glue_alpha.GlueVersion.V3_0,
                 python_version=aws_glue_alpha.PythonVersion.THREE,
                 script=aws_glue_alpha.Code.from_asset(
                     'glue/job_script.py'),
+                extra_python_files=[
+                    aws_glue_alpha.Code.from_asset('lambda/arrow_flatten.py'),
+                    aws_glue_alpha.Code.from_asset('lambda/weather_schema.py'),
+                    aws_glue_alpha.Code.from_asset('glue/incremental.py'),
+                    aws_glue_alpha.Code.from_asset('glue/parquet_layout.py'),
+                    aws_glue_alpha.Code.from_asset('glue/rollups.py'),
+                    aws_glue_alpha.Code.from_asset('glue/spark_flatten.py'),
+                    aws_glue_alpha.Code.from_asset('glue/shards.py'),
+                    aws_glue_alpha.Code.from_asset('lambda/raw_codec.py'),
+                    aws_glue_alpha.Code.from_asset('lambda/instrumentation.py'),
+                ],
             ),
-            job_name='Wttr ETL Job',
             role=glue_crawler_role,
-            worker_count=1,
-            worker_type=aws_glue_alpha.WorkerType.STANDARD,
+            worker_count=sizing.glue_worker_count,
+            worker_type=GLUE_WORKER_TYPES[sizing.glue_worker_type],
+            timeout=Duration.minutes(sizing.glue_job_timeout_minutes),
             default_arguments={
                 '--glue_src_db': glue_database.database_name,
                 '--glue_src_tbl': f'{S3_INGEST_RAW_DATA_PATH.value_as_string}',
                 '--outputDir': 's3://' + ingest_bucket.bucket_name + f'/{S3_INGEST_PARQUET_DATA_PATH.value_as_string}/',
                 '--tempDir': 's3://' + ingest_bucket.bucket_name + '/glue/temp/',
+                '--forecastOutputDir': 's3://' + ingest_bucket.bucket_name + f'/{S3_INGEST_FORECAST_DATA_PATH.value_as_string}/',
+                # Daily and monthly rollups, set --rollupsBackfill to true to recompute every month
+                '--rollupDailyOutputDir': 's3://' + ingest_bucket.bucket_name + f'/{S3_INGEST_ROLLUP_DATA_PATH.value_as_string}_daily/',
+                '--rollupMonthlyOutputDir': 's3://' + ingest_bucket.bucket_name + f'/{S3_INGEST_ROLLUP_DATA_PATH.value_as_string}_monthly/',
+                '--rollupsBackfill': 'false',
+                '--rawDir': 's3://' + ingest_bucket.bucket_name + f'/{S3_INGEST_RAW_DATA_PATH.value_as_string}/',
+                # Flattening engine: 'relationalize' (DynamicFrame relationalize and joins), 'arrow' (single pass PyArrow)
+                # or 'spark' (DataFrames parsed with an explicit schema)
+                '--engine': 'relationalize',
+                # Only raw objects newer than the watermark are processed, set --fullRebuild to true to rebuild everything
+                '--watermarkPath': 's3://' + ingest_bucket.bucket_name + '/glue/state/raw_watermark.json',
+                '--fullRebuild': 'false',
+                # Curated parquet layout, set --optimizeLayout to true to also rewrite fragmented partitions
+                '--parquetCodec': 'snappy',
+                '--targetFileSizeMb': '128',
+                '--rowGroupSizeMb': '64',
+                '--optimizeLayout': 'false',
+                # Stage metrics are always logged, these add per-stage row counts and a cProfile of the driver
+                '--detailedMetrics': 'false',
+                '--profile': 'false',
+                # The worker count is sized for a full rebuild, incremental runs scale down
+                '--enable-auto-scaling': 'true',
+                '--additional-python-modules': 'pyarrow==12.0.1,zstandard==0.21.0',
+            }
+        )
+
+        # With etl_shards > 1 the ETL runs as concurrent jobs, each writing the
+        # partitions of a hash range of areaName values (see glue/shards.py),
+        # and a verify job checks that all of them completed before it moves
+        # the raw watermark
+        shard_state_dir = 's3://' + ingest_bucket.bucket_name + '/glue/state/shards/'
+        if etl_shards == 1:
+            glue_etl_jobs = [aws_glue_alpha.Job(self, 'WttrETLJob', job_name='Wttr ETL Job', **etl_job_properties)]
+        else:
+            glue_etl_jobs = [aws_glue_alpha.Job(
+                self, f'WttrETLJobShard{index}',
+                job_name=f'Wttr ETL Job - shard {index + 1} of {etl_shards}',
+                **dict(etl_job_properties, default_arguments=dict(
+                    etl_job_properties['default_arguments'],
+                    **{'--shardIndex': str(index), '--shardCount': str(etl_shards),
+                       '--shardStateDir': shard_state_dir})))
+                for index in range(etl_shards)]
+
+        # Create Glue Python shell job to compact the hourly raw objects of each
+        # location into one gzipped, line-delimited file per day
+        glue_compaction_job = aws_glue_alpha.Job(
+            self, 'WttrCompactionJob',
+            executable=aws_glue_alpha.JobExecutable.python_shell(
+                glue_version=aws_glue_alpha.GlueVersion.V1_0,
+                python_version=aws_glue_alpha.PythonVersion.THREE,
+                script=aws_glue_alpha.Code.from_asset(
+                    'glue/compact_raw.py'),
+                extra_python_files=[
+                    aws_glue_alpha.Code.from_asset('glue/incremental.py'),
+                    aws_glue_alpha.Code.from_asset('lambda/raw_codec.py'),
+                ],
+            ),
+            job_name='Wttr Raw Compaction Job',
+            role=glue_crawler_role,
+            max_capacity=sizing.compaction_max_capacity,
+            timeout=Duration.minutes(sizing.compaction_timeout_minutes),
+            default_arguments={
+                '--rawDir': 's3://' + ingest_bucket.bucket_name + f'/{S3_INGEST_RAW_DATA_PATH.value_as_string}/',
+                '--manifestDir': 's3://' + ingest_bucket.bucket_name + '/glue/state/compaction/',
+                # Number of completed days to compact, days that are already compacted are skipped
+                '--lookbackDays': '2',
             }
         )
 
@@ -199,43 +520,43 @@ class WttrInDataStack(Stack):
         glue_workflow = aws_glue.CfnWorkflow(
             self, 'WttrWorkflow',
             name='wttr_in_workflow',
-            description='Workflow to crawl raw data, ETL and save to S3 as parquet files, and crawl parquet data'
+            description='Workflow to compact raw data, ETL and save to S3 as parquet files, and crawl parquet data'
         )
 
-        # Create raw data crawler trigger
-        crawl_raw_data_trigger = aws_glue.CfnTrigger(
-            self, "CrawlRawDataTrigger",
+        # Create raw data compaction trigger. Raw partitions are registered as
+        # objects land, so the workflow starts with compaction instead of a raw data crawler
+        compaction_job_trigger = aws_glue.CfnTrigger(
+            self, 'WttrCompactionJobTrigger',
             actions=[aws_glue.CfnTrigger.ActionProperty(
-                crawler_name=glue_crawler_raw.name,
-                timeout=300
+                job_name=glue_compaction_job.job_name,
+                timeout=sizing.compaction_timeout_minutes
             )],
-            name=f'Run raw data crawler - {glue_crawler_raw.name}',
-            description='Crawl raw data daily at 03:00',
+            name=f'Run compaction job - {glue_compaction_job.job_name}',
+            description='Compact raw data daily at 03:00',
             workflow_name=glue_workflow.name,
             type='SCHEDULED',
             schedule='cron(0 3 * * ? *)',
             start_on_creation=True,
         )
 
-        crawl_raw_data_trigger.add_depends_on(glue_crawler_raw)
-        crawl_raw_data_trigger.add_depends_on(glue_workflow)
+        compaction_job_trigger.add_depends_on(glue_workflow)
 
         # Create etl job trigger
         glue_etl_job_trigger = aws_glue.CfnTrigger(
             self, 'WttrETLJobTrigger',
             actions=[aws_glue.CfnTrigger.ActionProperty(
                 job_name=glue_etl_job.job_name,
-                timeout=300
-            )],
-            name=f'Run ETL job - {glue_etl_job.job_name}',
-            description='Run ETL job after raw data crawler',
+                timeout=sizing.glue_job_timeout_minutes
+            ) for glue_etl_job in glue_etl_jobs],
+            name=f'Run ETL job - {glue_etl_jobs[0].job_name}',
+            description='Run ETL job after raw data compaction',
             workflow_name=glue_workflow.name,
             type='CONDITIONAL',
             predicate=aws_glue.CfnTrigger.PredicateProperty(
                 conditions=[aws_glue.CfnTrigger.ConditionProperty(
-                    crawler_name=glue_crawler_raw.name,
+                    job_name=glue_compaction_job.job_name,
                     logical_operator='EQUALS',
-                    crawl_state='SUCCEEDED'
+                    state='SUCCEEDED'
                 )]
             ),
             start_on_creation=True,
@@ -245,6 +566,56 @@ class WttrInDataStack(Stack):
         # Since aws_glue_alpha is experimental, the dependency below is not added because it would return an error: Object of type @aws-cdk/aws-glue-alpha.Job is not convertible to aws-cdk-lib.CfnResource
         # glue_etl_job_trigger.add_depends_on(glue_etl_job)
 
+        # The crawler runs once every ETL job has succeeded
+        crawl_after_jobs = glue_etl_jobs
+        if etl_shards > 1:
+            glue_verify_shards_job = aws_glue_alpha.Job(
+                self, 'WttrVerifyShardsJob',
+                executable=aws_glue_alpha.JobExecutable.python_shell(
+                    glue_version=aws_glue_alpha.GlueVersion.V1_0,
+                    python_version=aws_glue_alpha.PythonVersion.THREE,
+                    script=aws_glue_alpha.Code.from_asset('glue/verify_shards.py'),
+                    extra_python_files=[
+                        aws_glue_alpha.Code.from_asset('glue/incremental.py'),
+                        aws_glue_alpha.Code.from_asset('glue/shards.py'),
+                        aws_glue_alpha.Code.from_asset('lambda/weather_schema.py'),
+                    ],
+                ),
+                job_name='Wttr ETL Shards Verify Job',
+                role=glue_crawler_role,
+                max_capacity=0.0625,
+                timeout=Duration.minutes(10),
+                default_arguments={
+                    '--shardStateDir': shard_state_dir,
+                    '--shardCount': str(etl_shards),
+                    '--watermarkPath': 's3://' + ingest_bucket.bucket_name + '/glue/state/raw_watermark.json',
+                }
+            )
+
+            verify_shards_trigger = aws_glue.CfnTrigger(
+                self, 'WttrVerifyShardsTrigger',
+                actions=[aws_glue.CfnTrigger.ActionProperty(
+                    job_name=glue_verify_shards_job.job_name,
+                    timeout=10
+                )],
+                name=f'Run shards verify job - {glue_verify_shards_job.job_name}',
+                description='Verify that every ETL shard completed and move the raw watermark',
+                workflow_name=glue_workflow.name,
+                type='CONDITIONAL',
+                predicate=aws_glue.CfnTrigger.PredicateProperty(
+                    logical='AND',
+                    conditions=[aws_glue.CfnTrigger.ConditionProperty(
+                        job_name=glue_etl_job.job_name,
+                        logical_operator='EQUALS',
+                        state='SUCCEEDED'
+                    ) for glue_etl_job in glue_etl_jobs]
+                ),
+                start_on_creation=True,
+            )
+
+            verify_shards_trigger.add_depends_on(glue_workflow)
+            crawl_after_jobs = [glue_verify_shards_job]
+
         # Create parquet data crawler trigger
         crawl_parquet_data_trigger = aws_glue.CfnTrigger(
             self, "CrawlParquetDataTrigger",
@@ -258,15 +629,15 @@ class WttrInDataStack(Stack):
             type='CONDITIONAL',
             predicate=aws_glue.CfnTrigger.PredicateProperty(
                 conditions=[aws_glue.CfnTrigger.ConditionProperty(
-                    job_name=glue_etl_job.job_name,
+                    job_name=job.job_name,
                     logical_operator='EQUALS',
                     state='SUCCEEDED',
-                )]
+                ) for job in crawl_after_jobs]
             ),
             start_on_creation=True,
         )
 
         crawl_parquet_data_trigger.add_depends_on(glue_crawler_parquet)
         crawl_parquet_data_trigger.add_depends_on(glue_workflow)
-        crawl_parquet_data_trigger.add_depends_on(crawl_raw_data_trigger)
+        crawl_parquet_data_trigger.add_depends_on(compaction_job_trigger)
         crawl_parquet_data_trigger.add_depends_on(glue_etl_job_trigger)